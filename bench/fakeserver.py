@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import argparse
+import asyncio
+import calendar
+import glob
+import heapq
+import logging
+import random
+import time
+
+# Lines of the source kept in memory before dropping the ones all the
+# connected clients were sent
+TRIM_SIZE = 10000
+
+
+def log_lines(paths):
+    """
+    Read the messages of IRC log files, as written by LogWriter.
+
+    Args:
+        paths: List of paths to log files. Messages from several files are
+               merged in the order they were received.
+
+    Returns:
+        An iterator of (offset, line) tuples, where offset is the time in
+        seconds since the first message.
+    """
+    def read_file(path):
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            for line in file:
+                timestamp, sep, msg = line.rstrip('\r\n').partition(' : ')
+                if not sep:
+                    continue
+                try:
+                    t = calendar.timegm(
+                        time.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ'))
+                except ValueError:
+                    continue
+                yield (t, msg)
+    start = None
+    for t, msg in heapq.merge(*[read_file(path) for path in paths],
+                              key=lambda x: x[0]):
+        if start is None:
+            start = t
+        yield (t - start, msg)
+
+
+def synthetic_lines(count, channel='#channel', nick='username', rate=50,
+                    seed=0):
+    """
+    Generate synthetic twitch traffic, as received with 'TWITCHCLIENT 1'.
+
+    Most lines are chat messages. The text of chat message number n starts
+    with 'bench n ', so their delivery can be tracked. Other lines are user
+    data from jtv, JOIN/PART, NAMES, MODE and subscriptions.
+
+    Args:
+        count: Number of lines to generate.
+        channel: Channel of the messages, including the '#'.
+        nick: User name the jtv messages are sent to.
+        rate: Number of lines per second at normal speed.
+        seed: Seed of the random generator.
+
+    Returns:
+        An iterator of (offset, line) tuples, where offset is the time in
+        seconds since the first line.
+    """
+    rand = random.Random(seed)
+    users = ['user{0}'.format(i) for i in range(200)]
+    colors = ['#1E90FF', '#FF0000', 'Blue', 'SeaGreen']
+    specialtypes = ['subscriber', 'turbo', 'staff']
+    seq = 0
+    for i in range(count):
+        user = rand.choice(users)
+        kind = rand.random()
+        if kind < 0.8:
+            line = ':{0}!{0}@{0}.tmi.twitch.tv PRIVMSG {1} :bench {2} ' \
+                'Kappa hello world'.format(user, channel, seq)
+            seq += 1
+        elif kind < 0.85:
+            line = ':jtv PRIVMSG {0} :USERCOLOR {1} {2}'.format(
+                nick, user, rand.choice(colors))
+        elif kind < 0.9:
+            line = ':jtv PRIVMSG {0} :EMOTESET {1} [0,{2}]'.format(
+                nick, user, rand.randint(1, 500))
+        elif kind < 0.93:
+            line = ':jtv PRIVMSG {0} :SPECIALUSER {1} {2}'.format(
+                nick, user, rand.choice(specialtypes))
+        elif kind < 0.96:
+            line = ':{0}!{0}@{0}.tmi.twitch.tv {1} {2}'.format(
+                user, rand.choice(['JOIN', 'PART']), channel)
+        elif kind < 0.98:
+            line = ':{0}.tmi.twitch.tv 353 {0} = {1} :{2}'.format(
+                nick, channel, ' '.join(rand.sample(users, 20)))
+        elif kind < 0.99:
+            line = ':jtv MODE {0} {1}o {2}'.format(
+                channel, rand.choice('+-'), user)
+        else:
+            line = ':twitchnotify!twitchnotify@twitchnotify.tmi.twitch.tv ' \
+                'PRIVMSG {0} :{1} just subscribed!'.format(channel, user)
+        yield (i / rate, line)
+
+
+class FakeTwitchServer:
+    def __init__(self, source, speed=1, ping_interval=60,
+                 disconnect_every=0):
+        """
+        A local stand-in for the twitch IRC server. It accepts the
+        USER/PASS/NICK login and the TWITCHCLIENT message, answers JOIN, and
+        replays lines to the connected clients once they joined a channel.
+
+        Like on twitch, every client gets all the lines: each one has its
+        own cursor over the lines of the source. A client is identified by
+        its nick and its TWITCHCLIENT message, so the replay continues where
+        it stopped when a client reconnects, and each line is sent once to
+        each client. Lines are sent at the pace of their offsets divided by
+        speed, or as fast as possible if speed is 0. The time each synthetic
+        chat message was first written is kept in sent_times, see
+        synthetic_lines.
+
+        Args:
+            source: An iterator of (offset, line) tuples to replay. See
+                    log_lines and synthetic_lines.
+            speed: Replay speed, 1 for real time, 0 for flat-out.
+            ping_interval: Time between two PINGs sent by the server, in
+                           seconds, or 0 to never send PINGs.
+            disconnect_every: Number of lines after which the server closes
+                              the connection, or 0 to never disconnect.
+        """
+        self.source = iter(source)
+        self.lines = []  # Lines read from the source and not dropped yet
+        self.lines_start = 0  # Index in the source of the first line kept
+        self.cursors = {}  # Client -> index of the next line to send
+        self.live = set()  # Clients connected
+        self.speed = speed
+        self.ping_interval = ping_interval
+        self.disconnect_every = disconnect_every
+        self.server = None
+        self.port = None
+        self.finished = None
+        self.connections = 0
+        self.lines_sent = 0
+        self.pings_sent = 0
+        self.pongs_received = 0
+        self.received = []
+        self.sent_times = {}
+        self.handlers = set()
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Start listening for clients. With port 0, a free port is chosen and
+        saved in the port attribute.
+        """
+        self.finished = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info('Fake server: listening on {0}:{1}'.format(
+            host, self.port))
+
+    async def close(self):
+        """
+        Stop listening for clients and close all connections.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for handler in list(self.handlers):
+            handler.cancel()
+        if self.handlers:
+            await asyncio.wait(self.handlers)
+
+    async def _handle(self, reader, writer):
+        """
+        Handle the connection of a client.
+        """
+        self.connections += 1
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            await self._serve(reader, writer)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            writer.close()
+            self.handlers.discard(handler)
+
+    async def _serve(self, reader, writer):
+        """
+        Log in the client, then replay lines until one side disconnects.
+        """
+        try:
+            nick = await asyncio.wait_for(self._login(reader, writer), 10)
+        except (asyncio.TimeoutError, ConnectionError):
+            nick = None
+        if nick is None:
+            return
+        joined = asyncio.Event()
+        session = {'nick': nick, 'twitchclient': None}
+        tasks = [asyncio.ensure_future(coro) for coro in (
+            self._read(reader, writer, session, joined),
+            self._replay(writer, session, joined))]
+        if self.ping_interval > 0:
+            tasks.append(asyncio.ensure_future(self._ping(writer)))
+        try:
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            e = task.exception()
+            if e is not None and not isinstance(e, ConnectionError):
+                logging.error('Fake server: unexpected error',
+                              exc_info=(type(e), e, e.__traceback__))
+        logging.info('Fake server: connection closed')
+
+    async def _login(self, reader, writer):
+        """
+        Wait for the login messages and send the welcome messages.
+
+        Returns:
+            The nick of the client, or None if the connection was closed.
+        """
+        nick = password = None
+        while nick is None or password is None:
+            line = await reader.readline()
+            if not line:
+                return None
+            command, _, param = line.decode('utf-8', 'replace') \
+                .rstrip('\r\n').partition(' ')
+            if command == 'NICK':
+                nick = param
+            elif command == 'PASS':
+                password = param
+        writer.write(''.join(
+            ':tmi.twitch.tv {0} {1} :{2}\r\n'.format(code, nick, text)
+            for code, text in (
+                ('001', 'Welcome, GLHF!'), ('002', 'Your host is tmi'),
+                ('003', 'This server is rather new'), ('004', '-'),
+                ('375', '-'), ('372', 'You are in a maze of twisty passages'),
+                ('376', '>'))).encode())
+        await writer.drain()
+        return nick
+
+    async def _read(self, reader, writer, session, joined):
+        """
+        Read the lines sent by the client until it disconnects.
+        """
+        nick = session['nick']
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            command, _, param = line.partition(' ')
+            if command == 'PONG':
+                self.pongs_received += 1
+            elif command == 'PING':
+                writer.write(b'PONG :tmi.twitch.tv\r\n')
+            elif command == 'JOIN':
+                writer.write(''.join(
+                    ':{0}!{0}@{0}.tmi.twitch.tv JOIN {1}\r\n'
+                    ':{0}.tmi.twitch.tv 353 {0} = {1} :{0}\r\n'
+                    .format(nick, channel)
+                    for channel in param.split(',')).encode())
+                joined.set()
+            else:
+                if command == 'TWITCHCLIENT':
+                    session['twitchclient'] = param
+                self.received.append(line)
+
+    async def _ping(self, writer):
+        """
+        Send a PING every ping_interval seconds.
+        """
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            writer.write(b'PING :tmi.twitch.tv\r\n')
+            self.pings_sent += 1
+            await writer.drain()
+
+    async def _replay(self, writer, session, joined):
+        """
+        Send the lines of the source from the client's cursor, until the
+        connection is closed by disconnect_every or the source is exhausted.
+        """
+        await joined.wait()
+        client = self._client(session)
+        self.live.add(client)
+        try:
+            await self._replay_lines(writer, client)
+        finally:
+            self.live.discard(client)
+
+    async def _replay_lines(self, writer, client):
+        """
+        Send the lines of the source to a client, from its cursor.
+        """
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        start_offset = None
+        sent = 0
+        index = max(self.cursors.get(client, 0), self.lines_start)
+        while True:
+            item = self._get_line(index)
+            if item is None:
+                self.finished.set()
+                await asyncio.Future()  # Keep the connection open
+            offset, line = item
+            if start_offset is None:
+                start_offset = offset
+            if self.speed > 0:
+                delay = start_time + (offset - start_offset) / self.speed - \
+                    loop.time()
+                if delay > 0:
+                    await writer.drain()
+                    await asyncio.sleep(delay)
+            writer.write('{0}\r\n'.format(line).encode())
+            index += 1
+            self.cursors[client] = index
+            if line.startswith('PING'):
+                self.pings_sent += 1
+            elif ' :bench ' in line:
+                seq = int(line.partition(' :bench ')[2].partition(' ')[0])
+                self.sent_times.setdefault(seq, time.perf_counter())
+            self.lines_sent += 1
+            sent += 1
+            if sent % 64 == 0:
+                await writer.drain()
+            if self.disconnect_every > 0 and sent >= self.disconnect_every:
+                await writer.drain()
+                logging.info('Fake server: disconnecting after {0} lines'
+                             .format(sent))
+                return
+
+    def _client(self, session):
+        """
+        Get the client of a connection that joined a channel: the nick and
+        TWITCHCLIENT message of the connection, and a number to tell apart
+        the clients connected with the same ones.
+        """
+        number = 0
+        while (session['nick'], session['twitchclient'], number) in \
+                self.live:
+            number += 1
+        return (session['nick'], session['twitchclient'], number)
+
+    def _get_line(self, index):
+        """
+        Get a line of the source by its index, reading the source as needed.
+        Lines sent to all the connected clients are dropped from time to
+        time.
+
+        Returns:
+            An (offset, line) tuple, or None at the end of the source.
+        """
+        while index - self.lines_start >= len(self.lines):
+            item = next(self.source, None)
+            if item is None:
+                return None
+            self.lines.append(item)
+            if len(self.lines) >= 2 * TRIM_SIZE:
+                start = min([self.cursors.get(client, 0)
+                             for client in self.live] + [index])
+                start = min(start, self.lines_start + TRIM_SIZE)
+                del self.lines[:start - self.lines_start]
+                self.lines_start = max(start, self.lines_start)
+        return self.lines[index - self.lines_start]
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Local stand-in for the twitch IRC server.')
+    arg_parser.add_argument(
+        'logs', nargs='*', help='IRC log files to replay '
+        '(default: irc_logs/*.log)')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=6667)
+    arg_parser.add_argument(
+        '--speed', type=float, default=1,
+        help='replay speed, ex: 1, 10, or 0 for flat-out')
+    arg_parser.add_argument(
+        '--synthetic', type=int, default=0, metavar='COUNT',
+        help='replay COUNT synthetic lines instead of log files')
+    arg_parser.add_argument(
+        '--rate', type=float, default=50,
+        help='lines per second of synthetic traffic at speed 1')
+    arg_parser.add_argument('--channel', default='#channel')
+    arg_parser.add_argument(
+        '--ping-interval', type=float, default=60,
+        help='seconds between PINGs, 0 to disable')
+    arg_parser.add_argument(
+        '--disconnect-every', type=int, default=0, metavar='LINES',
+        help='close the connection after this many lines')
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.synthetic > 0:
+        source = synthetic_lines(args.synthetic, args.channel,
+                                 rate=args.rate)
+    else:
+        source = log_lines(args.logs or sorted(glob.glob('irc_logs/*.log')))
+
+    async def run():
+        server = FakeTwitchServer(
+            source, args.speed, args.ping_interval, args.disconnect_every)
+        await server.start(args.host, args.port)
+        await server.finished.wait()
+        logging.info('Fake server: replay finished, {0} lines sent'
+                     .format(server.lines_sent))
+        await asyncio.Future()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import argparse
+import asyncio
+import logging
+import queue
+import threading
+import time
+from bench.fakeserver import FakeTwitchServer, log_lines, synthetic_lines
+from lib import config, events
+from lib.eventsink import QueueSink
+from lib.irceventgenerator import IrcEventGenerator
+from lib.twitchparser1 import TwitchParser1
+from lib.twitchparser2 import TwitchParser2
+from lib.twitchparser3 import TwitchParser3
+
+
+PARSERS = {'1': TwitchParser1, '2': TwitchParser2, '3': TwitchParser3}
+
+
+def percentiles(values):
+    """
+    Get the usual percentiles of a list of values.
+
+    Returns:
+        A list of (name, value) tuples.
+    """
+    values = sorted(values)
+    if not values:
+        return []
+    result = []
+    for name, p in (('p50', 50), ('p90', 90), ('p99', 99), ('p99.9', 99.9)):
+        result.append((name, values[int(p / 100 * (len(values) - 1))]))
+    result.append(('max', values[-1]))
+    return result
+
+
+def format_percentiles(values, unit, scale):
+    return ', '.join('{0} {1:.1f}{2}'.format(name, value * scale, unit)
+                     for name, value in percentiles(values))
+
+
+def bench_parse(lines, parser_names):
+    """
+    Measure the time each parser takes to parse each line.
+    """
+    for name in parser_names:
+        parser = PARSERS[name]()
+        times = []
+        perf_counter_ns = time.perf_counter_ns
+        start = perf_counter_ns()
+        for line in lines:
+            t0 = perf_counter_ns()
+            parser.parse_message(line)
+            times.append(perf_counter_ns() - t0)
+        total = (perf_counter_ns() - start) / 1e9
+        print('TwitchParser{0}: {1} lines in {2:.3f}s, {3:.0f} lines/sec'
+              .format(name, len(lines), total, len(lines) / total))
+        print('    parse latency: {0}'.format(
+            format_percentiles(times, 'us', 1e-3)))
+
+
+def bench_e2e(c, source, speed, ping_interval, disconnect_every,
+              timeout):
+    """
+    Replay lines from a fake server to a client, and measure the time
+    between the server writing each chat message and its event being taken
+    from the event queue.
+    """
+    event_queue = queue.Queue()
+    delivered = {}
+
+    def consume():
+        while True:
+            batch = event_queue.get()
+            now = time.perf_counter()
+            for msg in batch:
+                if msg.type == events.MSG and \
+                        msg.message.startswith('bench '):
+                    delivered[int(msg.message.split(' ', 2)[1])] = now
+
+    async def run():
+        server = FakeTwitchServer(source, speed, ping_interval,
+                                  disconnect_every)
+        await server.start()
+        c['irc']['server'] = '127.0.0.1'
+        c['irc']['port'] = server.port
+        client = IrcEventGenerator(c, QueueSink(event_queue),
+                                   write_logs=False)
+        client_task = asyncio.ensure_future(client.run_async())
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.wait_for(server.finished.wait(), timeout)
+        # Wait for the last events to be delivered
+        deadline = loop.time() + 5
+        while len(delivered) < len(server.sent_times) and \
+                loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = loop.time() - start
+        client_task.cancel()
+        await server.close()
+        return server, elapsed
+    threading.Thread(target=consume, daemon=True).start()
+    server, elapsed = asyncio.run(run())
+    print('End-to-end: {0} lines in {1:.3f}s, {2:.0f} lines/sec, '
+          '{3} connections, {4} PINGs, {5} PONGs'.format(
+              server.lines_sent, elapsed, server.lines_sent / elapsed,
+              server.connections, server.pings_sent, server.pongs_received))
+    latencies = [delivered[seq] - sent
+                 for seq, sent in server.sent_times.items()
+                 if seq in delivered]
+    lost = len(server.sent_times) - len(latencies)
+    if latencies:
+        print('    delivery latency: {0}'.format(
+            format_percentiles(latencies, 'ms', 1e3)))
+    if lost:
+        print('    {0} chat messages not delivered'.format(lost))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark the IRC parsers and the IRC client.')
+    arg_parser.add_argument(
+        'logs', nargs='*', help='IRC log files to replay '
+        '(default: synthetic traffic)')
+    arg_parser.add_argument(
+        '--mode', choices=['parse', 'e2e', 'all'], default='all')
+    arg_parser.add_argument(
+        '--config', default='config.yaml.default',
+        help='config file, the irc server and port are replaced')
+    arg_parser.add_argument(
+        '--parser', action='append', choices=sorted(PARSERS),
+        help='parser to benchmark, can be repeated (default: all)')
+    arg_parser.add_argument(
+        '--synthetic', type=int, default=100000, metavar='COUNT',
+        help='number of synthetic lines')
+    arg_parser.add_argument(
+        '--speed', type=float, default=0,
+        help='end-to-end replay speed, ex: 1, 10, or 0 for flat-out')
+    arg_parser.add_argument(
+        '--rate', type=float, default=1000,
+        help='lines per second of synthetic traffic at speed 1')
+    arg_parser.add_argument('--ping-interval', type=float, default=1)
+    arg_parser.add_argument('--disconnect-every', type=int, default=0)
+    arg_parser.add_argument('--timeout', type=float, default=600)
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    c = config.config(args.config)
+
+    def make_source():
+        if args.logs:
+            return log_lines(args.logs)
+        return synthetic_lines(args.synthetic, c['irc']['channel'],
+                               c['irc']['user'], args.rate)
+    if args.mode in ('parse', 'all'):
+        lines = [line for _, line in make_source()]
+        bench_parse(lines, args.parser or sorted(PARSERS))
+    if args.mode in ('e2e', 'all'):
+        bench_e2e(c, make_source(), args.speed,
+                  args.ping_interval, args.disconnect_every, args.timeout)
+
+if __name__ == '__main__':
+    main()
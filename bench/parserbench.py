@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import argparse
+import glob
+import json
+import os.path
+import time
+import tracemalloc
+from bench.ircbench import PARSERS
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'corpus')
+BASELINE_PATH = os.path.join(CORPUS_PATH, 'baseline.json')
+
+
+def load_corpus(path=CORPUS_PATH):
+    """
+    Load the corpus files.
+
+    Returns:
+        A dictionary {corpus name: list of lines}.
+    """
+    corpus = {}
+    for file_path in sorted(glob.glob(os.path.join(path, '*.txt'))):
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        with open(file_path, 'r', encoding='utf-8') as file:
+            corpus[name] = file.read().splitlines()
+    return corpus
+
+
+def measure_time(parser, lines, repeat):
+    """
+    Get the time to parse a list of lines, in nanoseconds per line. The
+    best time of all repetitions is kept.
+    """
+    parse_message = parser.parse_message
+    perf_counter_ns = time.perf_counter_ns
+    best = None
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for line in lines:
+            parse_message(line)
+        elapsed = perf_counter_ns() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / len(lines)
+
+
+def measure_allocations(parser, lines):
+    """
+    Get the memory kept by the events parsed from a list of lines.
+
+    Returns:
+        A tuple (blocks, bytes) per line.
+    """
+    results = [None] * len(lines)
+    parse_message = parser.parse_message
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i, line in enumerate(lines):
+        results[i] = parse_message(line)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = size = 0
+    for stat in after.compare_to(before, 'filename'):
+        if stat.traceback[0].filename == tracemalloc.__file__:
+            continue
+        blocks += stat.count_diff
+        size += stat.size_diff
+    return blocks / len(lines), size / len(lines)
+
+
+def bench_parser(parser_class, corpus, repeat):
+    """
+    Measure a parser on each corpus file, and on the lines of each event
+    type across all files.
+
+    Returns:
+        A dictionary {group: {'lines': ..., 'ns': ..., 'blocks': ...,
+        'bytes': ...}}, where group is 'corpus:<name>' or 'event:<type>'.
+        Lines the parser rejects are in 'event:UNPARSED'.
+    """
+    parser = parser_class()
+    groups = {}
+    by_event = {}
+    for name, lines in corpus.items():
+        groups['corpus:{0}'.format(name)] = lines
+        for line in lines:
+            msg = parser.parse_message(line)
+            event = msg.type if msg is not None else 'UNPARSED'
+            by_event.setdefault('event:{0}'.format(event), []).append(line)
+    groups.update(sorted(by_event.items()))
+    results = {}
+    for group, lines in groups.items():
+        blocks, size = measure_allocations(parser_class(), lines)
+        results[group] = {
+            'lines': len(lines),
+            'ns': round(measure_time(parser, lines, repeat), 1),
+            'blocks': round(blocks, 2),
+            'bytes': round(size, 1)}
+    return results
+
+
+def format_change(value, baseline):
+    if not baseline:
+        return ''
+    return '{0:+.1f}%'.format((value - baseline) / baseline * 100)
+
+
+def print_results(name, results, baseline):
+    """
+    Print the results of a parser, with the change from the baseline.
+    """
+    print('{0}:'.format(name))
+    print('    {0:<20} {1:>6} {2:>9} {3:>8} {4:>7} {5:>9} {6:>8}'.format(
+        'group', 'lines', 'ns/line', 'change', 'blocks', 'bytes', 'change'))
+    for group, result in results.items():
+        base = baseline.get(group, {})
+        print('    {0:<20} {1:>6} {2:>9.0f} {3:>8} {4:>7.2f} {5:>9.1f} {6:>8}'
+              .format(group, result['lines'], result['ns'],
+                      format_change(result['ns'], base.get('ns')),
+                      result['blocks'], result['bytes'],
+                      format_change(result['bytes'], base.get('bytes'))))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark the IRC parsers on the corpus in bench/corpus.')
+    arg_parser.add_argument(
+        '--parser', action='append', choices=sorted(PARSERS),
+        help='parser to benchmark, can be repeated (default: all)')
+    arg_parser.add_argument(
+        '--repeat', type=int, default=20,
+        help='number of runs, the best time is kept')
+    arg_parser.add_argument('--baseline', default=BASELINE_PATH)
+    arg_parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='save the results as the new baseline')
+    args = arg_parser.parse_args()
+    corpus = load_corpus()
+    if os.access(args.baseline, os.F_OK):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    else:
+        baseline = {}
+    all_results = {}
+    for name in args.parser or sorted(PARSERS):
+        parser_name = PARSERS[name].__name__
+        results = bench_parser(PARSERS[name], corpus, args.repeat)
+        print_results(parser_name, results, baseline.get(parser_name, {}))
+        all_results[parser_name] = results
+    if args.save_baseline:
+        baseline.update(all_results)
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print('Baseline saved to {0}'.format(args.baseline))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+# Headless version of main.pyw: connects to the IRC server, writes the logs
+# and sends the messages typed on the standard input, without a GUI. GTK
+# isn't needed.
+
+import argparse
+import logging
+import queue
+import sys
+import threading
+
+from lib import config, events, metrics, tracing, usernames
+from lib.eventsink import CallbackSink
+from lib.ircclient import run_clients
+from lib.irceventgenerator import IrcEventGenerator
+from lib.ircsender import IrcSender
+
+
+def print_events(batch):
+    """
+    Print the chat messages and the connection status.
+    """
+    lines = []
+    for event in batch:
+        if event.type == events.MSG:
+            lines.append('{0} <{1}> {2}\n'.format(
+                event.channel, event.username, event.message))
+        elif event.type == events.CONNECTING:
+            lines.append('* Connecting\n')
+        elif event.type == events.CONNECTED:
+            lines.append('* Connected\n')
+        elif event.type == events.DISCONNECTED:
+            lines.append('* Disconnected\n')
+    if lines:
+        sys.stdout.write(''.join(lines))
+        sys.stdout.flush()
+
+
+def read_input(config, out_queue):
+    """
+    Send the lines of the standard input as chat messages. A line starting
+    with one of the channels is sent to it, other lines are sent to the
+    first channel.
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        channel, _, text = line.partition(' ')
+        if channel.lower() in config['irc']['channels'] and text:
+            out_queue.put((channel.lower(), text))
+        elif line:
+            out_queue.put(line)
+
+
+def irc_main(config, sink, out_queue):
+    if config['irc']['shared_connection']:
+        irc_event_generator = IrcEventGenerator(config, sink, out_queue)
+        run_clients([irc_event_generator])
+    else:
+        irc_event_generator = IrcEventGenerator(config, sink)
+        irc_sender = IrcSender(config, out_queue)
+        run_clients([irc_event_generator, irc_sender])
+    return
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(
+        description='Run the bot without a GUI. Lines typed on the standard '
+        'input are sent to the first channel, or to the channel they start '
+        'with (ex: "#channel Hello").')
+    arg_parser.add_argument('-c', '--config', default='./config.yaml',
+                            help='config file (default: ./config.yaml)')
+    arg_parser.add_argument('-q', '--quiet', action='store_true',
+                            help="don't print the chat messages")
+    args = arg_parser.parse_args()
+    # Load config file
+    try:
+        c = config.config(args.config)
+    except RuntimeError:
+        print('Invalid config file')
+        sys.exit(0)
+    # Configure logger
+    log_levels = {
+        'debug': logging.DEBUG, 'info': logging.INFO,
+        'warning': logging.WARNING, 'error': logging.ERROR,
+        'critical': logging.CRITICAL}
+    logging.basicConfig(
+        filename=c['debug']['log-file'], filemode='w',
+        level=log_levels[c['debug']['log-level']])
+    # Share usernames across the application
+    usernames.configure(c)
+    metrics.start_exporter(c)
+    tracing.configure(c)
+    # Read messages to send
+    out_queue = queue.Queue(maxsize=c['irc']['send_queue_size'])
+    threading.Thread(target=read_input, daemon=True,
+                     args=(c, out_queue)).start()
+    if args.quiet:
+        sink = CallbackSink(lambda batch: None)
+    else:
+        sink = CallbackSink(print_events)
+    try:
+        irc_main(c, sink, out_queue)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+from gi.repository import Gdk, Gtk
+
+# Keys scrolling a text view up
+UP_KEYS = frozenset((Gdk.KEY_Up, Gdk.KEY_KP_Up, Gdk.KEY_Page_Up,
+                     Gdk.KEY_KP_Page_Up, Gdk.KEY_Home, Gdk.KEY_KP_Home))
+
+
+class AutoScroll():
+    def __init__(self, scrolled_window, at_end=None, on_jump=None):
+        """
+        This class keeps a scrolled window at the bottom when lines are added
+        to it, and stops when the user scrolls up to read older lines.
+
+        Scrolls are done from a tick callback of the frame clock: all the
+        scroll requests made between two frames (new lines, resizes) are
+        coalesced into one scroll, made just before the frame is drawn.
+
+        The autoscroll is paused by the user's input only: scrolling up with
+        the mouse wheel or the keyboard, or holding the scrollbar. Changes of
+        the adjustment's value can't be told apart from the text view keeping
+        its first visible line in place when lines are removed above it.
+
+        While the user is scrolled up, the new lines are counted and a
+        "N new messages" button is shown. Clicking it jumps to the bottom and
+        resumes the autoscroll, as does scrolling back to the bottom. The
+        button is the indicator attribute: the owner of the window puts it
+        over the window, e.g. with a Gtk.Overlay.
+
+        Args:
+            scrolled_window: The Gtk.ScrolledWindow to scroll.
+            at_end: Function returning True if the last line is in the
+                    window. Optional, for windows that don't hold all
+                    their lines (see ChatDisplay).
+            on_jump: Function called to show the last lines before jumping
+                     to the bottom. Optional.
+        """
+        self.window = scrolled_window
+        self.at_end = at_end
+        self.on_jump = on_jump
+        self.following = True  # The window follows the new lines
+        self.unseen = 0  # Lines added since the user scrolled up
+        self.tick_id = None  # Pending tick callback
+        self.scrolling = False  # The value is being set by this class
+        self.dragging = False  # The scrollbar is held by the user
+        self.indicator = Gtk.Button()
+        self.indicator.set_halign(Gtk.Align.CENTER)
+        self.indicator.set_valign(Gtk.Align.END)
+        self.indicator.set_margin_bottom(6)
+        self.indicator.set_no_show_all(True)
+        self.indicator.connect('clicked', self.jump)
+        adj = scrolled_window.get_vadjustment()
+        adj.connect('changed', self.request_scroll)
+        adj.connect('value-changed', self.on_value_changed)
+        scrolled_window.connect('scroll-event', self.on_scroll_event)
+        # The child handles the keys before the window sees them
+        child = scrolled_window.get_child()
+        if child is not None:
+            child.connect('key-press-event', self.on_key_press)
+        scrollbar = scrolled_window.get_vscrollbar()
+        scrollbar.connect('button-press-event', self.on_scrollbar_press)
+        scrollbar.connect('button-release-event', self.on_scrollbar_release)
+
+    def request_scroll(self, *args):
+        """
+        Scroll to the bottom before the next frame, if the window follows
+        the new lines. Can be connected to a signal.
+        """
+        if self.following and self.tick_id is None:
+            self.tick_id = self.window.add_tick_callback(self._on_tick)
+
+    def add_lines(self, count):
+        """
+        Notify this class that lines were added to the window.
+
+        Args:
+            count: Number of lines added.
+        """
+        if self.following:
+            self.request_scroll()
+        elif count > 0:
+            self.unseen += count
+            self.indicator.set_label('{0} new message{1}'.format(
+                self.unseen, 's' if self.unseen > 1 else ''))
+            self.indicator.show()
+
+    def jump(self, *args):
+        """
+        Jump to the bottom of the window and follow the new lines again.
+        Called when the indicator is clicked.
+        """
+        self.resume()
+        if self.on_jump is not None:
+            self.on_jump()
+
+    def resume(self):
+        """
+        Follow the new lines again, without jumping to the last lines.
+        """
+        self.following = True
+        self.unseen = 0
+        self.indicator.hide()
+        self.request_scroll()
+
+    def on_value_changed(self, adj):
+        """
+        Resume the autoscroll when the user scrolls back to the bottom.
+
+        Args:
+            adj: The vertical Gtk.Adjustment of the window.
+        """
+        if self.scrolling or self.dragging or self.following:
+            return
+        at_bottom = adj.get_upper() - adj.get_page_size() - \
+            adj.get_value() < 1
+        if at_bottom and (self.at_end is None or self.at_end()):
+            self.resume()
+
+    def on_scroll_event(self, widget, event):
+        """
+        Pause the autoscroll when the user scrolls up with the mouse wheel
+        or the touchpad.
+        """
+        if event.direction == Gdk.ScrollDirection.UP:
+            self._pause()
+        elif event.direction == Gdk.ScrollDirection.SMOOTH:
+            _, _, delta_y = event.get_scroll_deltas()
+            if delta_y < 0:
+                self._pause()
+        return False
+
+    def on_key_press(self, widget, event):
+        """
+        Pause the autoscroll when the user scrolls up with the keyboard.
+        """
+        if event.keyval in UP_KEYS:
+            self._pause()
+        return False
+
+    def on_scrollbar_press(self, widget, event):
+        """
+        Pause the autoscroll while the user holds the scrollbar.
+        """
+        self.dragging = True
+        self.following = False
+        return False
+
+    def on_scrollbar_release(self, widget, event):
+        """
+        Resume the autoscroll if the scrollbar was released at the bottom.
+        """
+        self.dragging = False
+        self.on_value_changed(self.window.get_vadjustment())
+        return False
+
+    def _pause(self):
+        """
+        Stop following the new lines, if the window can be scrolled up.
+        """
+        adj = self.window.get_vadjustment()
+        if adj.get_value() > adj.get_lower():
+            self.following = False
+
+    def _on_tick(self, widget, frame_clock):
+        """
+        Scroll to the bottom. Called once by the frame clock.
+        """
+        self.tick_id = None
+        if self.following:
+            adj = self.window.get_vadjustment()
+            self.scrolling = True
+            adj.set_value(adj.get_upper() - adj.get_page_size())
+            self.scrolling = False
+        return False
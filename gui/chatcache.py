@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import logging
+import os
+import os.path
+import random
+import threading
+import yaml
+from collections import OrderedDict
+from gi.repository import Gtk, Pango, GdkPixbuf, GLib
+from gui.chatworker import ChatWorker, WorkQueue
+from gui.emotematcher import EmoteMatcherCache
+from lib import events, metrics, usernames
+
+emote_hits = metrics.counter(
+    'emote_cache_hits_total', 'Emote images found in memory')
+emote_misses = metrics.counter(
+    'emote_cache_misses_total', 'Emote images loaded from disk')
+
+
+def worker_main(config, queue):
+    worker = ChatWorker(config, queue)
+    worker.run()
+
+
+class ChatCache():
+    def __init__(self, config):
+        """
+        This class keeps the chat data that is shared between the chat
+        widgets of all channels: user colors, emotesets, display names,
+        emotes data and images. It also owns the worker thread that
+        downloads this data.
+
+        Args:
+            config: A dictionnary with configuration options.
+        """
+        self.config = config
+        self.tag_table = Gtk.TextTagTable()
+        self.default_tag = Gtk.TextTag(
+            name='default', weight=Pango.Weight.BOLD, foreground='#000000')
+        self.tag_table.add(self.default_tag)
+        self.usercolors = OrderedDict()
+        self.emotesets = OrderedDict()
+        self.emotes = OrderedDict()
+        # Init display names
+        display_names_file_path = self.config['gui']['display_names_file']
+        if os.access(display_names_file_path, os.F_OK):
+            yaml_file = open(display_names_file_path, 'r')
+            try:
+                display_names_data = yaml.load(yaml_file, yaml.Loader)
+            except AttributeError:
+                display_names_data = yaml.load(yaml_file, yaml.CLoader)
+            self.display_names = OrderedDict(
+                (usernames.intern_username(username), display_name)
+                for username, display_name in display_names_data.items())
+        else:
+            self.display_names = OrderedDict()
+        GLib.timeout_add_seconds(
+            self.config['gui']['display_names_save_interval'],
+            self.save_display_names)
+        # Init twitch default colors
+        self.default_colors = {
+            'Red': '#FF0000',
+            'Blue': '#0000FF',
+            'Green': '#00FF00',
+            'FireBrick': '#B22222',
+            'Coral': '#FF7F50',
+            'YellowGreen': '#9ACD32',
+            'OrangeRed': '#FF4500',
+            'SeaGreen': '#2E8B57',
+            'GoldenRod': '#DAA520',
+            'Chocolate': '#D2691E',
+            'CadetBlue': '#5F9EA0',
+            'DodgerBlue': '#1E90FF',
+            'HotPink': '#FF69B4',
+            'BlueViolet': '#8A2BE2',
+            'SpringGreen': '#00FF7F',
+            'black': '#000000'}
+        # Spawn thread
+        self.queue = WorkQueue(self.config['gui']['worker_queue_size'])
+        metrics.gauge('worker_queue_depth',
+                      'Requests waiting for the worker thread') \
+            .add_source(lambda: len(self.queue))
+        metrics.counter('worker_requests_deduped_total',
+                        'Requests grouped with an identical request') \
+            .add_source(lambda: sum(self.queue.deduped.values()))
+        metrics.counter('worker_requests_shed_total',
+                        'Requests refused because the worker was late') \
+            .add_source(lambda: sum(self.queue.shed.values()))
+        worker = threading.Thread(
+            target=worker_main, daemon=True,
+            args=(self.config, self.queue))
+        worker.start()
+        # Download emotes data
+        self.emotes_global = {}
+        self.emotes_subscriber = {}
+        self.emotes_sets = {}
+        self.emotes_initialized = False
+        self.emote_matchers = EmoteMatcherCache(
+            self.config['gui']['emote_matcher_cache_size'] * 1024)
+        metrics.gauge('emote_matcher_cache_bytes',
+                      'Memory used by the emote matchers') \
+            .add_source(lambda: self.emote_matchers.size)
+        self.queue.put(['INIT_EMOTES', self.on_emotes_init])
+
+    def notify(self, event):
+        """
+        Notify this object of an event.
+
+        Args:
+            event: An event from lib.events.
+        """
+        if event.type == events.USERCOLOR:
+            self.set_usercolor(event.username, event.color)
+        elif event.type == events.EMOTESET:
+            if event.username in self.emotesets:
+                self.emotesets.move_to_end(event.username)
+            self.emotesets[event.username] = event.emotesets
+            cache_size = self.config['gui']['chat_cache_size']
+            if len(self.emotesets) > cache_size:
+                self.emotesets.popitem(last=False)
+        return
+
+    def get_emote(self, name, emoteset):
+        """
+        Get the image of an emote. The image file must exist.
+
+        Args:
+            name: Name of the emote.
+            emoteset: Emoteset of the emote, or None for global emotes.
+
+        Returns:
+            A GdkPixbuf.Pixbuf with the emote's image.
+        """
+        if (name, emoteset) in self.emotes:
+            emote_hits.value += 1
+            pixbuf = self.emotes[(name, emoteset)]
+            self.emotes.move_to_end((name, emoteset))
+        else:
+            emote_misses.value += 1
+            if emoteset is None:
+                image_path = os.path.join(
+                    self.config['gui']['emote_globals_path'],
+                    '{0}.png'.format(name))
+            else:
+                image_path = os.path.join(
+                    self.config['gui']['emote_subscriber_path'],
+                    emoteset,
+                    '{0}.png'.format(name))
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(image_path)
+            self.emotes[(name, emoteset)] = pixbuf
+            cache_size = self.config['gui']['chat_cache_size']
+            if len(self.emotes) > cache_size:
+                self.emotes.popitem(last=False)
+        return pixbuf
+
+    def find_emotes(self, username, message):
+        """
+        Find the global emotes of a message, and the subscriber emotes the
+        user is allowed to use.
+
+        Args:
+            username: Name of the user who sent the message.
+            message: Text of the message.
+
+        Returns:
+            A list of (offset, emote, emoteset) tuples, see
+            EmoteMatcher.match. emoteset is None for global emotes.
+        """
+        emotesets = self.emotesets.get(username)
+        if emotesets is None:
+            return self.emote_matchers.global_matcher.match(message)
+        return self.emote_matchers.get(emotesets).match(message)
+
+    def emote_file_exists(self, emote, emoteset):
+        """
+        Check if an emote's image exists.
+
+        Args:
+            emote: A string that describes the emote's name.
+            emoteset: Name of the emoteset (i.e. channel name), or None for
+                      global emotes.
+
+        Returns:
+            True if the file exists, false otherwise.
+        """
+        if emoteset is None:
+            emote_dir = self.config['gui']['emote_globals_path']
+        else:
+            emote_dir = os.path.join(
+                self.config['gui']['emote_subscriber_path'], emoteset)
+        emote_path = os.path.join(emote_dir, '{0}.png'.format(emote))
+        os.makedirs(emote_dir, exist_ok=True)
+        if os.access(emote_path, os.F_OK):
+            return True
+        else:
+            return None
+        return
+
+    def set_display_name(self, username, display_name):
+        """
+        Set a user's display name.
+
+        Args:
+            username: Name of the user.
+            display_name: Display name of the user.
+        """
+        if username in self.display_names:
+            self.display_names[username] = display_name
+            self.display_names.move_to_end(username)
+        else:
+            self.display_names[username] = display_name
+            cache_size = self.config['gui']['display_names_cache_size']
+            if len(self.display_names) > cache_size:
+                self.display_names.popitem(last=False)
+
+    def set_usercolor(self, user, color=None):
+        """
+        Set a user's usercolor.
+
+        Args:
+            user: username
+            color: Color to set, or None to choose a default colot
+        """
+        if color is None:
+            color = random.choice(list(self.default_colors.values()))
+        if color[0] != '#':
+            try:
+                color = self.default_colors[color]
+            except:
+                logging.warning('Chat: Invalid color: {0}'.format(color))
+                color = '#000000'
+        if user in self.usercolors:
+            self.usercolors.move_to_end(user)
+        tag = Gtk.TextTag(weight=Pango.Weight.BOLD, foreground=color)
+        self.tag_table.add(tag)
+        self.usercolors[user] = tag
+        cache_size = self.config['gui']['chat_cache_size']
+        if len(self.usercolors) > cache_size:
+            self.usercolors.popitem(last=False)
+
+    def on_emotes_init(self, emotes_global, emotes_subscriber, emotes_sets):
+        """
+        Function called when emotes data was initialized by the worker thread.
+        """
+        self.emotes_global = emotes_global
+        self.emotes_subscriber = emotes_subscriber
+        self.emotes_sets = emotes_sets
+        self.emote_matchers.set_emotes(
+            emotes_global, emotes_subscriber, emotes_sets)
+        self.emotes_initialized = True
+        return
+
+    def save_display_names(self, *args, **kwargs):
+        """
+        Save display names to the file defined in the config.
+        """
+        file = open(self.config['gui']['display_names_file'], 'w')
+        yaml.dump(dict(self.display_names), file)
+        file.close()
+        return True
@@ -1,41 +1,60 @@
 #!/usr/bin/env python
 # -*- encoding:utf-8 -*-
 
-import json
 import logging
-import queue
 import os
 import os.path
-import random
-import re
-import threading
-import yaml
-from collections import OrderedDict
-from gi.repository import Gtk, Pango, GdkPixbuf, GLib
-from gui.chatworker import ChatWorker
+import time
+from collections import OrderedDict, deque
+from gi.repository import Gtk, GdkPixbuf, GLib
+from gui.autoscroll import AutoScroll
+from gui.chatmodel import ChatLine, ChatModel
+from lib import events, metrics
+from lib.tracing import tracer
 
-
-def worker_main(config, queue):
-    worker = ChatWorker(config, queue)
-    worker.run()
+render_time = metrics.histogram(
+    'chat_render_seconds', 'Time spent adding a batch of messages to a chat')
+display_name_hits = metrics.counter(
+    'display_name_cache_hits_total', 'Display names found in the cache')
+display_name_misses = metrics.counter(
+    'display_name_cache_misses_total', 'Display names asked to the worker')
+# Characters starting a new line in a Gtk.TextBuffer, replaced by spaces in
+# the messages so that each message is one line of the buffer
+LINE_BREAKS = str.maketrans('\r\n\u2029', '   ')
 
 
 class ChatDisplay(Gtk.ScrolledWindow):
-    def __init__(self, config):
+    def __init__(self, config, channel, cache):
         """
-        This widget shows the chat messages in a text box.
+        This widget shows the chat messages of a channel in a text box.
+
+        The last gui.chat_maxmessages messages are kept in a ChatModel, but
+        the text box only holds a window of gui.chat_window_size of them, so
+        the cost of adding a message doesn't depend on the scrollback. While
+        the view is at the bottom, the window follows the new messages. When
+        the user scrolls near the top or the bottom of the window, older or
+        newer messages are loaded from the model and the same number of
+        messages is removed from the other end. The view is kept at the
+        bottom by an AutoScroll, whose indicator shows the number of messages
+        received while the user is scrolled up.
 
         Args:
             config: A dictionnary with configuration options.
+            channel: Channel to display, including the '#'.
+            cache: ChatCache shared by the chat widgets of all channels.
         """
         # Init ScrolledWindow
         Gtk.ScrolledWindow.__init__(self)
         self.config = config
+        self.channel = channel
+        self.cache = cache
+        self.queue = cache.queue
         self.set_hexpand(True)
         self.set_vexpand(True)
         self.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.ALWAYS)
         # Init TextView
-        self.text_view = Gtk.TextView()
+        self.text_view = Gtk.TextView.new_with_buffer(
+            Gtk.TextBuffer.new(cache.tag_table))
         self.text_view.set_editable(False)
         self.text_view.set_cursor_visible(False)
         self.text_view.set_justification(Gtk.Justification.LEFT)
@@ -47,181 +66,76 @@ class ChatDisplay(Gtk.ScrolledWindow):
         self.text_view.set_pixels_below_lines(
             self.config['gui']['chat_linespacing'])
         self.add(self.text_view)
+        # Init the model and the window of lines shown in the text view
+        self.model = ChatModel(self.config['gui']['chat_maxmessages'])
+        self.window_size = self.config['gui']['chat_window_size']
+        self.window_start = 0  # Serial number of the first line shown
+        self.window_end = 0  # Serial number after the last line shown
+        self.line_marks = deque()  # Pending marks of each line shown
+        self.load_pending = False
         # Bind events and init misc stuff
-        self.msg_count = 0
-        self.text_view.connect('size-allocate', self.scroll_bottom)
-        self.default_tag = self.text_view.get_buffer().create_tag(
-            "default", weight=Pango.Weight.BOLD, foreground='#000000')
-        self.usercolors = OrderedDict()
-        self.emotesets = OrderedDict()
-        self.emotes = OrderedDict()
+        self.autoscroll = AutoScroll(self, at_end=self._shows_last_line,
+                                     on_jump=self._jump_to_end)
+        self.get_vadjustment().connect('value-changed', self.on_scroll)
         self.specialusers = OrderedDict()
         self.moderators = set()
-        # Init display names
-        display_names_file_path = self.config['gui']['display_names_file']
-        if os.access(display_names_file_path, os.F_OK):
-            yaml_file = open(display_names_file_path, 'r')
-            try:
-                display_names_data = yaml.load(yaml_file, yaml.Loader)
-            except AttributeError:
-                display_names_data = yaml.load(yaml_file, yaml.CLoader)
-            self.display_names = OrderedDict(display_names_data)
-        else:
-            self.display_names = OrderedDict()
-        GLib.timeout_add_seconds(
-            self.config['gui']['display_names_save_interval'],
-            self.save_display_names)
-        # Init twitch default colors
-        self.default_colors = {
-            'Red': '#FF0000',
-            'Blue': '#0000FF',
-            'Green': '#00FF00',
-            'FireBrick': '#B22222',
-            'Coral': '#FF7F50',
-            'YellowGreen': '#9ACD32',
-            'OrangeRed': '#FF4500',
-            'SeaGreen': '#2E8B57',
-            'GoldenRod': '#DAA520',
-            'Chocolate': '#D2691E',
-            'CadetBlue': '#5F9EA0',
-            'DodgerBlue': '#1E90FF',
-            'HotPink': '#FF69B4',
-            'BlueViolet': '#8A2BE2',
-            'SpringGreen': '#00FF7F',
-            'black': '#000000'}
-        # Spawn thread
-        self.queue = queue.Queue()
-        worker = threading.Thread(
-            target=worker_main, daemon=True,
-            args=(self.config, self.queue))
-        worker.start()
-        # Download emotes and badges data
+        # Download badges data
         self.badges_initialized = False
         self.badges = {}
-        self.queue.put(['INIT_BADGES', self.on_badges_init])
-        self.emotes_global = {}
-        self.emotes_subscriber = {}
-        self.emotes_sets = {}
-        self.emotes_initialized = False
-        self.queue.put(['INIT_EMOTES', self.on_emotes_init])
+        self.queue.put(['INIT_BADGES', self.on_badges_init, self.channel])
 
-    def notify(self, event, data):
+    def notify(self, event):
         """
         Notify this widget of an event.
 
         Args:
-            event: Type of the event
-            data: Additionnal data for this event
-        """
-        if event == 'MSG':
-            # Add chat message to buffer
-            text_buffer = self.text_view.get_buffer()
-            if self.msg_count != 0:
-                text_buffer.insert(text_buffer.get_end_iter(), '\r\n')
-            mark_begin = text_buffer.create_mark(
-                None, text_buffer.get_end_iter(), True)
-            text_buffer.insert(text_buffer.get_end_iter(),
-                               '{0}:  {1}'.format(data[0], data[1]))
-            text_iter = text_buffer.get_iter_at_mark(mark_begin)
-            text_iter.forward_chars(len(data[0])+2)
-            mark_message = text_buffer.create_mark(
-                None, text_iter, True)
-            # Get display name
-            if data[0] in self.display_names:
-                display_name = self.display_names[data[0]]
-                mark = text_buffer.create_mark(
-                    None, text_buffer.get_iter_at_mark(mark_begin), False)
-                self.change_display_name(mark, data[0], new_name=display_name)
-            else:
-                display_name = data[0][0].upper() + data[0][1:]
-                mark = text_buffer.create_mark(
-                    None, text_buffer.get_iter_at_mark(mark_begin), False)
-                self.queue.put(['DISPLAY_NAME', self.change_display_name,
-                                mark, data[0]])
-            # Add turbo and subscriber icons
-            if not self.badges_initialized:
-                self.queue.put(['INIT_BADGES', self.on_badges_init])
-            statuses = self.specialusers[data[0]].copy() if data[0] in \
-                self.specialusers else set()
-            if data[0] == self.config['irc']['channel'][1:]:
-                statuses.add('broadcaster')
-            elif data[0] in self.moderators:
-                statuses.add('mod')
-            mark = text_buffer.create_mark(
-                None, text_buffer.get_iter_at_mark(mark_begin), True)
-            if self.badges_initialized:
-                self.add_user_icons(mark, statuses)
-            else:
-                self.queue.put(['BADGE', self.add_user_icons, mark, statuses])
-            # Add emotes to chat
-            to_replace = []  # List of tuples with format (index, name, path)
-            if not self.emotes_initialized:
-                self.queue.put(['INIT_EMOTES', self.on_emotes_init])
-            if self.emotes_initialized:
-                for globalemote in self.emotes_global.keys():
-                    for match in re.finditer(globalemote, data[1]):
-                        to_replace.append(tuple([
-                            match.start(),
-                            globalemote,
-                            None]))
-            if self.emotes_initialized and data[0] in self.emotesets:
-                for emoteset in self.emotesets[data[0]]:
-                    if str(emoteset) not in self.emotes_sets:
-                        continue
-                    emoteset_name = self.emotes_sets[str(emoteset)]
-                    if emoteset_name not in self.emotes_subscriber.keys():
-                        continue
-                    for emote in self.\
-                            emotes_subscriber[emoteset_name]['emotes'].keys():
-                        for match in re.finditer(emote, data[1]):
-                            to_replace.append(tuple([
-                                match.start(),
-                                emote,
-                                emoteset_name]))
-            to_replace.sort(key=lambda x: x[0], reverse=True)
-            for (index, emote, emoteset) in to_replace:
-                text_iter_begin = text_buffer.get_iter_at_mark(mark_message)
-                text_iter_begin.forward_chars(index+1)
-                mark = text_buffer.create_mark(
-                    None, text_iter_begin, True)
-                if self._emote_file_exists(emote, emoteset):
-                    self.add_emote(mark, emote, emoteset)
-                else:
-                    self.queue.put(['EMOTE', self.add_emote,
-                                    mark, emote, emoteset])
-            # Cleanup mark and old messages
-            text_buffer.delete_mark(mark_begin)
-            text_buffer.delete_mark(mark_message)
-            self.msg_count += 1
-            if self.msg_count > self.config['gui']['chat_maxmessages']:
-                iter_1 = text_buffer.get_start_iter()
-                iter_2 = text_buffer.get_iter_at_line(1)
-                text_buffer.delete(iter_1, iter_2)
-                self.msg_count -= 1
-        elif event == 'USERCOLOR':
-            self._set_usercolor(data[0], data[1])
-        elif event == 'EMOTESET':
-            if data[0] in self.emotesets:
-                self.emotesets.move_to_end(data[0])
-            self.emotesets[data[0]] = data[1:]
-            cache_size = self.config['gui']['chat_cache_size']
-            if len(self.emotesets) > cache_size:
-                self.emotesets.popitem(last=False)
-        elif event == 'SPECIALUSER':
-            if data[0] in self.specialusers:
-                self.specialusers[data[0]].add(data[1])
-                self.specialusers.move_to_end(data[0])
+            event: An event from lib.events.
+        """
+        if event.type == events.MSG:
+            self.notify_batch([event])
+        elif event.type == events.SPECIALUSER:
+            username = event.username
+            if username in self.specialusers:
+                self.specialusers[username].add(event.usertype)
+                self.specialusers.move_to_end(username)
             else:
-                self.specialusers[data[0]] = set([data[1]])
+                self.specialusers[username] = set([event.usertype])
                 cache_size = self.config['gui']['chat_cache_size']
                 if len(self.specialusers) > cache_size:
                     self.specialusers.popitem(last=False)
-        elif event == 'MOD':
-            self.moderators.add(data[0])
-        elif event == 'DEMOD':
-            self.moderators.discard(data[0])
+        elif event.type == events.MOD:
+            self.moderators.add(event.username)
+        elif event.type == events.DEMOD:
+            self.moderators.discard(event.username)
         return
 
+    def notify_batch(self, batch):
+        """
+        Notify this widget of a list of events. All messages are added to the
+        model, but only the ones that end up in the window are shown.
+
+        Args:
+            batch: A list of events from lib.events.
+        """
+        start = time.perf_counter()
+        tracing = tracer.enabled
+        traces = {}  # Serial number -> Trace, see lib.tracing
+        count = 0
+        for event in batch:
+            if event.type == events.MSG:
+                count += 1
+                trace = tracer.get(event) if tracing else None
+                serial = self.model.append(self._make_line(event, trace))
+                if trace is not None:
+                    traces[serial] = trace
+            else:
+                self.notify(event)
+        self._show_new_lines(traces)
+        self.autoscroll.add_lines(count)
+        for trace in traces.values():
+            tracer.finish(trace.event)
+        render_time.observe(time.perf_counter() - start)
+
     def add_user_icons(self, mark, statuses):
         """
         Add icons to indicate a user's statuses.
@@ -230,13 +144,11 @@ class ChatDisplay(Gtk.ScrolledWindow):
             mark: Mark at the beginning of the username.
             statuses: Set containing the user's statuses.
         """
+        if mark.get_deleted():
+            return  # The line was removed from the window
         text_buffer = self.text_view.get_buffer()
         for specialstatus in reversed(self.status_order):
             if specialstatus in statuses:
-                image_path = os.path.join(
-                    self.config['gui']['badges_path'],
-                    self.config['irc']['channel'][1:],
-                    '{0}.png'.format(specialstatus))
                 text_iter = text_buffer.get_iter_at_mark(mark)
                 pixbuf = self.badges[specialstatus]
                 text_buffer.insert_pixbuf(text_iter, pixbuf)
@@ -251,25 +163,12 @@ class ChatDisplay(Gtk.ScrolledWindow):
             name: Name of the emote.
             emoteset: Emoteset of the emote, or None for global emotes.
         """
+        if tracer.enabled:
+            tracer.end(mark, time.perf_counter())
+        if mark.get_deleted():
+            return  # The line was removed from the window
         text_buffer = self.text_view.get_buffer()
-        if (name, emoteset) in self.emotes:
-            pixbuf = self.emotes[(name, emoteset)]
-            self.emotes.move_to_end((name, emoteset))
-        else:
-            if emoteset is None:
-                image_path = os.path.join(
-                    self.config['gui']['emote_globals_path'],
-                    '{0}.png'.format(name))
-            else:
-                image_path = os.path.join(
-                    self.config['gui']['emote_subscriber_path'],
-                    emoteset,
-                    '{0}.png'.format(name))
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file(image_path)
-            self.emotes[(name, emoteset)] = pixbuf
-            cache_size = self.config['gui']['chat_cache_size']
-            if len(self.emotes) > cache_size:
-                self.emotes.popitem(last=False)
+        pixbuf = self.cache.get_emote(name, emoteset)
         text_iter_begin = text_buffer.get_iter_at_mark(mark)
         text_iter_end = text_buffer.get_iter_at_mark(mark)
         text_iter_end.forward_chars(len(name))
@@ -286,17 +185,13 @@ class ChatDisplay(Gtk.ScrolledWindow):
             username: Name of the user.
             new_name: New name to set for the user. Optional.
         """
+        if new_name is not None:
+            self.cache.set_display_name(username, new_name)
+        if mark.get_deleted():
+            return  # The line was removed from the window
         text_buffer = self.text_view.get_buffer()
         # Set display name
         if new_name is not None:
-            if username in self.display_names:
-                self.display_names[username] = new_name
-                self.display_names.move_to_end(username)
-            else:
-                self.display_names[username] = new_name
-                cache_size = self.config['gui']['display_names_cache_size']
-                if len(self.display_names) > cache_size:
-                    self.display_names.popitem(last=False)
             text_iter_begin = text_buffer.get_iter_at_mark(mark)
             found = text_iter_begin.forward_search(
                 ':', Gtk.TextSearchFlags.TEXT_ONLY, None)
@@ -307,9 +202,9 @@ class ChatDisplay(Gtk.ScrolledWindow):
                 text_iter_begin.backward_chars(len(new_name))
                 text_buffer.move_mark(mark, text_iter_begin)
         # Set color
-        if username not in self.usercolors:
-            self._set_usercolor(username, None)
-        text_tag = self.usercolors[username]
+        if username not in self.cache.usercolors:
+            self.cache.set_usercolor(username, None)
+        text_tag = self.cache.usercolors[username]
         text_iter_begin = text_buffer.get_iter_at_mark(mark)
         found = text_iter_begin.forward_search(
             ':', Gtk.TextSearchFlags.TEXT_ONLY, None)
@@ -329,7 +224,7 @@ class ChatDisplay(Gtk.ScrolledWindow):
         for specialstatus in reversed(self.status_order):
             image_path = os.path.join(
                 self.config['gui']['badges_path'],
-                self.config['irc']['channel'][1:],
+                self.channel[1:],
                 '{0}.png'.format(specialstatus))
             pixbuf = GdkPixbuf.Pixbuf.new_from_file(image_path)
             self.badges[specialstatus] = pixbuf
@@ -337,83 +232,330 @@ class ChatDisplay(Gtk.ScrolledWindow):
         self.badges_initialized = True
         return
 
-    def on_emotes_init(self, emotes_global, emotes_subscriber, emotes_sets):
+    def on_scroll(self, adj):
         """
-        Function called when emotes data was initialized by the worker thread.
+        Load messages from the model when the view gets near an end of the
+        window. Nothing is loaded while the window follows the new messages:
+        the value also changes when lines are removed above the view.
+
+        Args:
+            adj: The vertical Gtk.Adjustment of the window.
         """
-        self.emotes_global = emotes_global
-        self.emotes_subscriber = emotes_subscriber
-        self.emotes_sets = emotes_sets
-        self.emotes_initialized = True
-        return
+        value = adj.get_value()
+        page_size = adj.get_page_size()
+        to_bottom = adj.get_upper() - page_size - value
+        if self.load_pending or self.autoscroll.following:
+            return
+        if (value - adj.get_lower() < page_size and
+                self.window_start > self.model.first) or \
+                (to_bottom < page_size and
+                 self.window_end < self.model.end):
+            # Don't change the text while GTK is scrolling
+            self.load_pending = True
+            GLib.idle_add(self._load_lines)
 
-    def save_display_names(self, *args, **kwargs):
+    def _make_line(self, event, trace=None):
         """
-        Save display names to the file defined in the config.
+        Build the chat line of a message: the statuses of the user and the
+        position of the emotes. Line breaks in the message are replaced by
+        spaces, see LINE_BREAKS.
+
+        Args:
+            event: The Msg event.
+            trace: The Trace of the event if it's traced, see lib.tracing.
+
+        Returns:
+            A ChatLine.
         """
-        file = open(self.config['gui']['display_names_file'], 'w')
-        yaml.dump(dict(self.display_names), file)
-        file.close()
-        return True
+        username = event.username
+        message = event.message
+        if '\n' in message or '\r' in message or '\u2029' in message:
+            message = message.translate(LINE_BREAKS)
+        statuses = self.specialusers[username].copy() if username in \
+            self.specialusers else set()
+        if username == self.channel[1:]:
+            statuses.add('broadcaster')
+        elif username in self.moderators:
+            statuses.add('mod')
+        if trace is not None:
+            match_start = time.perf_counter()
+        if self.cache.emotes_initialized:
+            # List of tuples with format (index, name, emoteset)
+            emotes = self.cache.find_emotes(username, message)
+        else:
+            self.queue.put(['INIT_EMOTES', self.cache.on_emotes_init])
+            emotes = []
+        if trace is not None:
+            tracer.span('emote match', match_start, time.perf_counter(),
+                        trace, {'emotes': len(emotes)})
+        return ChatLine(username, message, frozenset(statuses), emotes)
 
-    def scroll_bottom(self, event, data=None):
+    def _show_new_lines(self, traces):
         """
-        Scroll to the bottom of the window.
+        Show the lines added to the model since the last call, if the window
+        follows the new messages.
 
         Args:
-            event: Event that called this function
-            data: Additionnal data for this event
+            traces: A dictionnary of serial number -> Trace, for the lines
+                    whose render is traced.
+        """
+        model = self.model
+        if self.window_start < model.first:
+            if self.window_end > model.first:
+                self._remove_first_lines(model.first - self.window_start)
+            else:
+                # All the lines of the window were removed from the model
+                self._clear(model.first)
+                self.autoscroll.resume()
+        if not self.autoscroll.following:
+            return
+        start = model.end - self.window_size
+        if start > self.window_end:
+            # The window would be replaced, skip the lines in between
+            self._clear(start)
+        for serial in range(self.window_end, model.end):
+            trace = traces.get(serial)
+            if trace is None:
+                self._render_line(serial)
+            else:
+                render_start = time.perf_counter()
+                self._render_line(serial, trace=trace)
+                tracer.span('render', render_start, time.perf_counter(),
+                            trace, {'channel': self.channel})
+        excess = self.window_end - self.window_start - self.window_size
+        if excess > 0:
+            self._remove_first_lines(excess)
+
+    def _shows_last_line(self):
+        """
+        Returns:
+            True if the last line of the model is in the window.
+        """
+        return self.window_end == self.model.end
+
+    def _jump_to_end(self):
         """
+        Move the window to the last lines of the model. Called when the
+        indicator of the AutoScroll is clicked.
+        """
+        if self.window_end < self.model.end:
+            self._clear(max(self.model.first,
+                            self.model.end - self.window_size))
+            self._show_new_lines({})
+
+    def _load_lines(self):
+        """
+        Load lines from the model when the view is near an end of the window,
+        keeping the first visible line in place. Called from the main loop.
+        """
+        self.load_pending = False
         adj = self.get_vadjustment()
-        adj.set_value(adj.get_upper() - adj.get_page_size())
-        self.text_view.queue_draw()
-        return
+        value = adj.get_value()
+        page_size = adj.get_page_size()
+        count = max(self.window_size // 4, 1)
+        text_buffer = self.text_view.get_buffer()
+        text_iter, _ = self.text_view.get_line_at_y(int(value))
+        anchor = text_buffer.create_mark(None, text_iter, True)
+        if value - adj.get_lower() < page_size and \
+                self.window_start > self.model.first:
+            count = min(count, self.window_start - self.model.first)
+            for serial in range(self.window_start - 1,
+                                self.window_start - count - 1, -1):
+                self._render_line(serial, at_start=True)
+            excess = self.window_end - self.window_start - self.window_size
+            if excess > 0:
+                self._remove_last_lines(excess)
+        elif adj.get_upper() - page_size - value < page_size and \
+                self.window_end < self.model.end:
+            count = min(count, self.model.end - self.window_end)
+            for serial in range(self.window_end, self.window_end + count):
+                self._render_line(serial)
+            excess = self.window_end - self.window_start - self.window_size
+            if excess > 0:
+                self._remove_first_lines(excess)
+        self.text_view.scroll_to_mark(anchor, 0, True, 0, 0)
+        text_buffer.delete_mark(anchor)
+        return False
 
-    def _emote_file_exists(self, emote, emoteset):
+    def _render_line(self, serial, at_start=False, trace=None):
         """
-        Check if an emote's image exists.
+        Add a line of the model to the text view, at the end of the window or
+        at its beginning.
 
-        Args:
-            emote: A string that describes the emote's name.
-            emoteset: Name of the emoteset (i.e. channel name), or None for
-                      global emotes.
+        The line is composed first, with the display name, color, badges and
+        emotes that are ready, and inserted in one sequence. Marks are only
+        created for what the worker thread still has to download: the text is
+        changed by the callbacks when it's ready.
 
-        Returns:
-            True if the file exists, false otherwise.
+        Args:
+            serial: Serial number of the line, just before or after the
+                    window.
+            at_start: Add the line before the first line of the window.
+            trace: The Trace of the line's event if it's traced.
         """
-        if emoteset is None:
-            emote_dir = self.config['gui']['emote_globals_path']
+        line = self.model[serial]
+        username = line.username
+        cache = self.cache
+        text_buffer = self.text_view.get_buffer()
+        marks = []  # Marks waiting for the worker thread
+        # Display name and color
+        if username in cache.display_names:
+            display_name_hits.value += 1
+            display_name = cache.display_names[username]
+            cache.set_display_name(username, display_name)
+            request_name = False
         else:
-            emote_dir = os.path.join(
-                self.config['gui']['emote_subscriber_path'], emoteset)
-        emote_path = os.path.join(emote_dir, '{0}.png'.format(emote))
-        os.makedirs(emote_dir, exist_ok=True)
-        if os.access(emote_path, os.F_OK):
-            return True
+            display_name_misses.value += 1
+            display_name = username
+            request_name = True
+        if username not in cache.usercolors:
+            cache.set_usercolor(username, None)
+        name_tag = cache.usercolors[username]
+        # Turbo and subscriber icons
+        if self.badges_initialized:
+            badges = [self.badges[status] for status in self.status_order
+                      if status in line.statuses]
         else:
-            return None
-        return
+            badges = ()
+            self.queue.put(['INIT_BADGES', self.on_badges_init,
+                            self.channel])
+        # Text and emotes of the message, as a list of strings and
+        # (emote, emoteset, pixbuf) tuples. pixbuf is None if the emote must
+        # be downloaded.
+        runs = []
+        message = line.message
+        position = 0
+        for (index, emote, emoteset) in line.emotes:
+            if index > position:
+                runs.append(message[position:index])
+            if (emote, emoteset) in cache.emotes or \
+                    cache.emote_file_exists(emote, emoteset):
+                runs.append((emote, emoteset,
+                             cache.get_emote(emote, emoteset)))
+            else:
+                runs.append((emote, emoteset, None))
+            position = index + len(emote)
+        if position < len(message):
+            runs.append(message[position:])
+        # Insert the line
+        if at_start:
+            # Marks with a left gravity at the beginning of the first line
+            # would stay before the new line, move them after it
+            moved_marks = []
+            if self.window_end != self.window_start:
+                moved_marks = [
+                    mark for mark in self.line_marks[0]
+                    if not mark.get_deleted() and mark.get_left_gravity() and
+                    text_buffer.get_iter_at_mark(mark).is_start()]
+            text_iter = text_buffer.get_start_iter()
+        else:
+            text_iter = text_buffer.get_end_iter()
+            if self.window_end != self.window_start:
+                text_buffer.insert(text_iter, '\r\n')
+        if not self.badges_initialized:
+            mark = text_buffer.create_mark(None, text_iter, True)
+            if self.queue.put(['BADGE', self.add_user_icons, mark,
+                               line.statuses, self.channel]):
+                marks.append(mark)
+            else:
+                text_buffer.delete_mark(mark)
+        for pixbuf in badges:
+            text_buffer.insert_pixbuf(text_iter, pixbuf)
+        text_buffer.insert_with_tags(text_iter, display_name, name_tag)
+        if request_name:
+            name_iter = text_iter.copy()
+            name_iter.backward_chars(len(display_name))
+            mark = text_buffer.create_mark(None, name_iter, False)
+            if self.queue.put(['DISPLAY_NAME', self.change_display_name,
+                               mark, username]):
+                marks.append(mark)
+            else:
+                text_buffer.delete_mark(mark)
+        text = ':  '
+        for run in runs:
+            if type(run) == str:
+                text += run
+                continue
+            emote, emoteset, pixbuf = run
+            if text:
+                text_buffer.insert(text_iter, text)
+                text = ''
+            if pixbuf is not None:
+                text_buffer.insert_pixbuf(text_iter, pixbuf)
+                continue
+            mark = text_buffer.create_mark(None, text_iter, True)
+            text_buffer.insert(text_iter, emote)
+            if self.queue.put(['EMOTE', self.add_emote,
+                               mark, emote, emoteset]):
+                marks.append(mark)
+                if trace is not None:
+                    tracer.begin('emote resolve', mark, trace,
+                                 time.perf_counter())
+            else:
+                text_buffer.delete_mark(mark)
+        if at_start and self.window_end != self.window_start:
+            text += '\r\n'
+        if text:
+            text_buffer.insert(text_iter, text)
+        if at_start:
+            for mark in moved_marks:
+                text_buffer.move_mark(mark, text_buffer.get_iter_at_line(1))
+            self.line_marks.appendleft(marks)
+            self.window_start -= 1
+        else:
+            self.line_marks.append(marks)
+            self.window_end += 1
 
-    def _set_usercolor(self, user, color=None):
+    def _remove_first_lines(self, count):
         """
-        Set a user's usercolor.
+        Remove lines from the beginning of the window.
+        """
+        count = min(count, self.window_end - self.window_start)
+        if count == self.window_end - self.window_start:
+            self._clear(self.window_end)
+            return
+        text_buffer = self.text_view.get_buffer()
+        text_buffer.delete(text_buffer.get_start_iter(),
+                           text_buffer.get_iter_at_line(count))
+        for _ in range(count):
+            self._delete_marks(self.line_marks.popleft())
+        self.window_start += count
 
-        Args:
-            user: username
-            color: Color to set, or None to choose a default colot
-        """
-        if color is None:
-            color = random.choice(list(self.default_colors.values()))
-        if color[0] != '#':
-            try:
-                color = self.default_colors[color]
-            except:
-                logging.warning('Chat: Invalid color: {0}'.format(color))
-                color = '#000000'
-        if user in self.usercolors:
-            self.usercolors.move_to_end(user)
-        self.usercolors[user] = self.text_view.get_buffer().create_tag(
-            None, weight=Pango.Weight.BOLD, foreground=color)
-        cache_size = self.config['gui']['chat_cache_size']
-        if len(self.usercolors) > cache_size:
-            self.usercolors.popitem(last=False)
+    def _remove_last_lines(self, count):
+        """
+        Remove lines from the end of the window.
+        """
+        count = min(count, self.window_end - self.window_start)
+        if count == self.window_end - self.window_start:
+            self._clear(self.window_start)
+            return
+        text_buffer = self.text_view.get_buffer()
+        text_iter = text_buffer.get_iter_at_line(
+            self.window_end - self.window_start - count)
+        text_iter.backward_chars(2)  # Line separator
+        text_buffer.delete(text_iter, text_buffer.get_end_iter())
+        for _ in range(count):
+            self._delete_marks(self.line_marks.pop())
+        self.window_end -= count
+
+    def _clear(self, serial):
+        """
+        Remove all the lines of the window, and move the window to a line.
+        """
+        text_buffer = self.text_view.get_buffer()
+        text_buffer.delete(text_buffer.get_start_iter(),
+                           text_buffer.get_end_iter())
+        for marks in self.line_marks:
+            self._delete_marks(marks)
+        self.line_marks.clear()
+        self.window_start = self.window_end = serial
+
+    def _delete_marks(self, marks):
+        """
+        Delete the marks of a line removed from the window, so that the
+        worker's callbacks don't change the text at their position.
+        """
+        text_buffer = self.text_view.get_buffer()
+        for mark in marks:
+            if not mark.get_deleted():
+                text_buffer.delete_mark(mark)
@@ -1,18 +1,21 @@
 #!/usr/bin/env python
 # -*- encoding:utf-8 -*-
 
+import logging
+import queue
 from gi.repository import Gtk, Pango, GdkPixbuf
 
 
 class ChatEntry(Gtk.Entry):
-    def __init__(self, config, out_queue, *args, **kwargs):
+    def __init__(self, config, out_queue, channel, *args, **kwargs):
         """
         This widget is an input box that allows the user to send chat messages
-        to the IRC channel.
+        to an IRC channel.
         """
         Gtk.Entry.__init__(self, *args, **kwargs)
         self.config = config
         self.out_queue = out_queue
+        self.channel = channel
         self.set_hexpand(True)
         self.set_vexpand(False)
         self.set_max_length(500)
@@ -21,8 +24,13 @@ class ChatEntry(Gtk.Entry):
     def on_activate(self, *args, **kwargs):
         """
         Function called by GTK when the user presses the Enter key.
-        Sends the chat message and clears the entry box.
+        Sends the chat message and clears the entry box. If too many
+        messages are waiting to be sent, the message stays in the entry box.
         """
         text_buffer = self.get_buffer()
-        self.out_queue.put(text_buffer.get_text())
+        try:
+            self.out_queue.put_nowait((self.channel, text_buffer.get_text()))
+        except queue.Full:
+            logging.warning('Chat: too many messages waiting to be sent')
+            return
         text_buffer.delete_text(0, -1)
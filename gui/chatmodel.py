@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+from collections import namedtuple
+
+
+class ChatLine(namedtuple('ChatLine', 'username message statuses emotes')):
+    """
+    A chat message as shown by ChatDisplay. statuses is the set of badges of
+    the user when the message was sent (e.g. 'mod', 'subscriber'), emotes is
+    a list of (offset, emote, emoteset) tuples, see EmoteMatcher.match.
+
+    The display name and color of the user are not kept: they are taken
+    from ChatCache when the line is shown, so they are updated once they are
+    downloaded.
+    """
+    __slots__ = ()
+
+
+class ChatModel():
+    def __init__(self, max_lines):
+        """
+        This class keeps the last max_lines chat lines of a channel in a ring
+        buffer, independently of the widget that shows them.
+
+        Each line gets a serial number when it is added: the first line is 0,
+        the next one 1, etc. Lines keep their number when older lines are
+        removed, so that views can refer to them. The lines in the model are
+        the numbers from first (included) to end (excluded).
+
+        Args:
+            max_lines: Maximum number of lines to keep.
+        """
+        self.max_lines = max_lines
+        self.lines = [None] * max_lines
+        self.first = 0  # Number of the oldest line
+        self.end = 0  # Number of the next line
+
+    def __len__(self):
+        return self.end - self.first
+
+    def __getitem__(self, serial):
+        """
+        Get a line by its serial number.
+
+        Raises:
+            IndexError if the line isn't in the model.
+        """
+        if not self.first <= serial < self.end:
+            raise IndexError('Chat line {0} not in the model'.format(serial))
+        return self.lines[serial % self.max_lines]
+
+    def append(self, line):
+        """
+        Add a line, removing the oldest line if the model is full.
+
+        Returns:
+            The serial number of the line.
+        """
+        self.lines[self.end % self.max_lines] = line
+        self.end += 1
+        if self.end - self.first > self.max_lines:
+            self.first += 1
+        return self.end - 1
@@ -5,10 +5,118 @@ import json
 import logging
 import os
 import os.path
+import threading
+import time
 import urllib.request
 import urllib.error
-from collections import OrderedDict
+from collections import Counter, OrderedDict, deque
 from gi.repository import GLib
+from lib import metrics
+
+fetch_time = metrics.histogram(
+    'http_fetch_seconds', 'Time spent downloading data from the web')
+requests_handled = metrics.counter(
+    'worker_requests_total', 'Groups of requests handled by the worker')
+
+
+def fetch(url):
+    """
+    Download data from the web.
+
+    Args:
+        url: A URL, or a urllib.request.Request.
+
+    Returns:
+        The data, as bytes.
+
+    Raises:
+        urllib.error.URLError if the download failed.
+    """
+    start = time.perf_counter()
+    try:
+        return urllib.request.urlopen(url).read()
+    finally:
+        fetch_time.observe(time.perf_counter() - start)
+
+
+class WorkQueue():
+    def __init__(self, max_size):
+        """
+        This class is the queue of requests sent to ChatWorker. Requests for
+        the same thing (the display name of a user, an emote, the badges of a
+        channel...) are grouped while they wait, so the worker only handles
+        them once. Requests of the INIT types are always queued; other
+        requests are refused when max_size groups are waiting.
+
+        The number of requests grouped with an earlier one and refused are
+        counted by request type in deduped and shed.
+
+        Args:
+            max_size: Maximum number of groups of requests waiting.
+        """
+        self.max_size = max_size
+        self.condition = threading.Condition()
+        self.keys = deque()
+        self.waiting = {}  # Key -> list of requests
+        self.deduped = Counter()
+        self.shed = Counter()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def put(self, msg):
+        """
+        Add a request to the queue. See ChatWorker.run for the requests.
+
+        Returns:
+            False if the request was refused because the queue is full.
+        """
+        key = self._key(msg)
+        with self.condition:
+            requests = self.waiting.get(key)
+            if requests is not None:
+                requests.append(msg)
+                self.deduped[msg[0]] += 1
+                return True
+            if len(self.keys) >= self.max_size and \
+                    not msg[0].startswith('INIT_'):
+                if self.shed[msg[0]] % 1000 == 0:
+                    logging.warning(
+                        'ChatWorker: queue full, {0} {1} requests refused so '
+                        'far'.format(self.shed[msg[0]] + 1, msg[0]))
+                self.shed[msg[0]] += 1
+                return False
+            self.keys.append(key)
+            self.waiting[key] = [msg]
+            self.condition.notify()
+            return True
+
+    def get(self):
+        """
+        Wait for a group of requests, and take it from the queue.
+
+        Returns:
+            A list of requests for the same thing, oldest first.
+        """
+        with self.condition:
+            while not self.keys:
+                self.condition.wait()
+            return self.waiting.pop(self.keys.popleft())
+
+    def _key(self, msg):
+        """
+        Get what a request is about. Requests with the same key are handled
+        once.
+        """
+        if msg[0] == 'DISPLAY_NAME':
+            return (msg[0], msg[3])
+        elif msg[0] == 'BADGE':
+            return (msg[0], msg[4])
+        elif msg[0] == 'EMOTE':
+            return (msg[0], msg[3], msg[4])
+        elif msg[0] == 'INIT_BADGES':
+            return (msg[0], msg[2])
+        return (msg[0],)
 
 
 class ChatWorker():
@@ -18,52 +126,60 @@ class ChatWorker():
 
         Args:
             config: A dictionnary with configuration options.
-            queue: A queue to receive commands.
+            queue: A WorkQueue to receive commands.
         """
         self.config = config
         self.queue = queue
-        self.badges_initialized = False
+        self.badges_order = {}  # Channel -> list of badges
         self.emotes_initialized = False
         self.display_names = OrderedDict()
 
     def run(self):
         """
-        Wait for a message from ChatDisplay, and process it. Supported format
-        for messages is:
-            ['INIT_BADGES', callback_function]
-            Init badges data.
+        Wait for a group of messages from ChatDisplay, and process it. The
+        messages of a group only differ by their callback functions and
+        marks: the data is only downloaded once, and all the callbacks are
+        called. Supported format for messages is:
+            ['INIT_BADGES', callback_function, channel]
+            Init badges data of a channel.
             ['INIT_EMOTES', callback_function]
             Init emotes data.
             ['DISPLAY_NAME', callback_function, mark, username]
             Get the display name for a user.
-            ['BADGE', callback_function, mark, statuses]
+            ['BADGE', callback_function, mark, statuses, channel]
             Call after initializing badges data to add badges to text.
             ['EMOTE', callback_function, mark, emote, emoteset]
             Download an emote.
         """
         while(True):
-            msg = self.queue.get()
+            msgs = self.queue.get()
+            requests_handled.value += 1
+            msg = msgs[0]
             if msg[0] == 'INIT_BADGES':
-                self.get_badge_data(msg[1])
+                self.get_badge_data(msg[1], msg[2])
             elif msg[0] == 'INIT_EMOTES':
                 self.get_emotes_data(msg[1])
             elif msg[0] == 'DISPLAY_NAME':
-                self.get_display_name(msg[1], msg[2], msg[3])
+                display_name = self.get_display_name(msg[3])
+                for msg in msgs:
+                    GLib.idle_add(msg[1], msg[2], msg[3], display_name)
             elif msg[0] == 'BADGE':
-                self.on_badge(msg[1], msg[2], msg[3])
+                for msg in msgs:
+                    self.on_badge(msg[1], msg[2], msg[3], msg[4])
             elif msg[0] == 'EMOTE':
-                self.on_emote(msg[1], msg[2], msg[3], msg[4])
+                if self.get_emote(msg[3], msg[4]):
+                    for msg in msgs:
+                        GLib.idle_add(msg[1], msg[2], msg[3], msg[4])
 
-    def get_badge_data(self, callback_func):
-        if not self.badges_initialized:
+    def get_badge_data(self, callback_func, channel):
+        if channel not in self.badges_order:
             # Get badges data
             try:
                 request = urllib.request.Request(
                     'https://api.twitch.tv/kraken/chat/{0}/badges'
-                    .format(self.config['irc']['channel'][1:]),
+                    .format(channel[1:]),
                     headers={'Accept': 'application/vnd.twitchtv.v3+json'})
-                u = urllib.request.urlopen(request)
-                s = u.read().decode()
+                s = fetch(request).decode()
                 j = json.loads(s)
             except:
                 logging.warning('ChatWorker: failed to get badges data')
@@ -71,44 +187,38 @@ class ChatWorker():
             # Download badges
             to_download = ['admin', 'broadcaster', 'mod', 'staff',
                            'subscriber', 'turbo']
-            self.badges_order = []
+            badges_order = []
             badges_dir = os.path.join(self.config['gui']['badges_path'],
-                                      self.config['irc']['channel'][1:])
+                                      channel[1:])
             os.makedirs(badges_dir, exist_ok=True)
             for badge_name in to_download:
                 try:
                     badge_path = os.path.join(
                         badges_dir, '{0}.png'.format(badge_name))
                     if os.access(badge_path, os.F_OK):
-                        self.badges_order.append(badge_name)
+                        badges_order.append(badge_name)
                         continue  # File already exists
                     badge_url = j[badge_name]['image']
-                    badge = urllib.request.urlopen(badge_url)
+                    badge = fetch(badge_url)
                     badge_file = open(badge_path, 'wb')
-                    badge_file.write(badge.read())
+                    badge_file.write(badge)
                     badge_file.close()
-                    self.badges_order.append(badge_name)
+                    badges_order.append(badge_name)
                 except:
                     logging.warning('Chat: Failed to download badge {0}'
                                     .format(badge_name))
-            self.badges_initialized = True
+            self.badges_order[channel] = badges_order
         # Call callback function
-        GLib.idle_add(callback_func, self.badges_order)
+        GLib.idle_add(callback_func, self.badges_order[channel])
         return
 
     def get_emotes_data(self, callback_function):
         try:
-            u = urllib.request.urlopen(
-                'http://www.twitchemotes.com/global.json')
-            s = u.read().decode()
+            s = fetch('http://www.twitchemotes.com/global.json').decode()
             emotes_global = json.loads(s)
-            u = urllib.request.urlopen(
-                'http://www.twitchemotes.com/subscriber.json')
-            s = u.read().decode()
+            s = fetch('http://www.twitchemotes.com/subscriber.json').decode()
             emotes_subscriber = json.loads(s)
-            u = urllib.request.urlopen(
-                'http://www.twitchemotes.com/sets.json')
-            s = u.read().decode()
+            s = fetch('http://www.twitchemotes.com/sets.json').decode()
             emotes_sets = json.loads(s)
             self.emotes_initialized = True
             self.emotes_global = emotes_global
@@ -120,7 +230,10 @@ class ChatWorker():
             logging.warning('ChatWorker: failed to download emotes data')
         return
 
-    def get_display_name(self, callback_function, mark, username):
+    def get_display_name(self, username):
+        """
+        Get the display name of a user, downloading it if needed.
+        """
         if username in self.display_names:
             display_name = self.display_names[username]
             self.display_names.move_to_end(username)
@@ -130,8 +243,7 @@ class ChatWorker():
                     'https://api.twitch.tv/kraken/users/{0}'
                     .format(username),
                     headers={'Accept': 'application/vnd.twitchtv.v3+json'})
-                u = urllib.request.urlopen(request)
-                s = u.read().decode()
+                s = fetch(request).decode()
                 j = json.loads(s)
                 display_name = j['display_name']
                 self.display_names[username] = display_name
@@ -143,15 +255,21 @@ class ChatWorker():
                     'ChatWorker: Failed to get display name for user {0}'
                     .format(username))
                 display_name = username[0].upper() + username[1:]
-        GLib.idle_add(callback_function, mark, username, display_name)
+        return display_name
 
-    def on_badge(self, callback_func, mark, statuses):
-        if self.badges_initialized:
+    def on_badge(self, callback_func, mark, statuses, channel):
+        if channel in self.badges_order:
             GLib.idle_add(callback_func, mark, statuses)
 
-    def on_emote(self, callback_func, mark, emote, emoteset):
+    def get_emote(self, emote, emoteset):
+        """
+        Download an emote if its image doesn't exist yet.
+
+        Returns:
+            True if the image exists.
+        """
         if not self.emotes_initialized:
-            return
+            return False
         if emoteset is None:
             emote_dir = self.config['gui']['emote_globals_path']
         else:
@@ -163,13 +281,13 @@ class ChatWorker():
             if emoteset is None and not self._download_global_emote(emote):
                 logging.warning('ChatWorker: Failed to download emote {0},{1}'
                                 .format(emote, emoteset))
-                return
+                return False
             elif emoteset is not None and \
                     not self._download_subscriber_emote(emoteset, emote):
                 logging.warning('ChatWorker: Failed to download emote {0},{1}'
                                 .format(emote, emoteset))
-                return
-        GLib.idle_add(callback_func, mark, emote, emoteset)
+                return False
+        return True
 
     def _download_global_emote(self, name):
         """
@@ -185,12 +303,12 @@ class ChatWorker():
         os.makedirs(self.config['gui']['emote_globals_path'], exist_ok=True)
         try:
             emote_url = 'http:' + self.emotes_global[name]['url']
-            emote = urllib.request.urlopen(emote_url)
+            emote = fetch(emote_url)
             emote_file = open(
                 os.path.join(self.config['gui']['emote_globals_path'],
                              '{0}.png'.format(name)),
                 'wb')
-            emote_file.write(emote.read())
+            emote_file.write(emote)
             emote_file.close()
         except urllib.error.URLError:
             return False
@@ -218,9 +336,9 @@ class ChatWorker():
         try:
             emote_url = 'http:' + \
                 self.emotes_subscriber[emoteset]['emotes'][emotename]
-            emote = urllib.request.urlopen(emote_url)
+            emote = fetch(emote_url)
             emote_file = open(emote_path, 'wb')
-            emote_file.write(emote.read())
+            emote_file.write(emote)
             emote_file.close()
         except urllib.error.URLError:
             return False
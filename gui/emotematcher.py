@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import re
+import sys
+from collections import OrderedDict
+
+# A word of a chat message: emotes are only recognized as whole words
+WORD = re.compile(r'\S+')
+
+
+class EmoteMatcher():
+    def __init__(self, emotes):
+        """
+        This class finds emotes in chat messages. It is built once for a set
+        of emotes, and finds all the emotes of a message in a single pass.
+
+        Emote names are matched literally, as whole words: a word is a run of
+        characters between spaces, so 'Kappa' is found in 'Kappa Kappa' but
+        not in 'KappaPride' or 'xKappa'.
+
+        Args:
+            emotes: A dictionnary of emote name -> emoteset name, or None for
+                    global emotes.
+        """
+        self.emotes = {sys.intern(emote): emoteset
+                       for emote, emoteset in emotes.items()}
+        # Approximate memory used, in bytes. Names are interned, so they are
+        # shared with the other matchers and not counted.
+        self.size = sys.getsizeof(self.emotes)
+
+    def __len__(self):
+        return len(self.emotes)
+
+    @classmethod
+    def combine(cls, matchers):
+        """
+        Build a matcher finding the emotes of several matchers. If an emote
+        is in several of them, the last one wins.
+        """
+        emotes = {}
+        for matcher in matchers:
+            emotes.update(matcher.emotes)
+        return cls(emotes)
+
+    def match(self, message):
+        """
+        Find the emotes of a message.
+
+        Args:
+            message: Text of a chat message.
+
+        Returns:
+            A list of (offset, emote, emoteset) tuples, one for each emote in
+            the message, in the order they appear. offset is the index of
+            the emote's first character in the message.
+        """
+        emotes = self.emotes
+        # Most messages have no emotes: check all words at once first
+        if emotes.keys().isdisjoint(message.split()):
+            return []
+        return [(match.start(), match.group(), emotes[match.group()])
+                for match in WORD.finditer(message)
+                if match.group() in emotes]
+
+
+class EmoteMatcherCache():
+    def __init__(self, max_size):
+        """
+        This class builds and keeps the emote matchers of the users: one
+        matcher per distinct tuple of emotesets, with the global emotes and
+        the emotes of all the sets, so that a message is scanned once. Users
+        with the same emotesets share a matcher. The matcher of each
+        emoteset is kept too, to build the combined matchers.
+
+        The least recently used matchers are removed when the matchers use
+        more than max_size bytes.
+
+        Args:
+            max_size: Memory budget of the matchers, in bytes.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.matchers = OrderedDict()  # Key -> EmoteMatcher
+        self.global_matcher = EmoteMatcher({})
+        self.emotes_subscriber = {}
+        self.emotes_sets = {}
+
+    def set_emotes(self, emotes_global, emotes_subscriber, emotes_sets):
+        """
+        Set the emotes data, see ChatWorker.get_emotes_data. The cache is
+        cleared.
+        """
+        self.global_matcher = EmoteMatcher(dict.fromkeys(emotes_global))
+        self.emotes_subscriber = emotes_subscriber
+        self.emotes_sets = emotes_sets
+        self.matchers.clear()
+        self.size = 0
+
+    def get(self, emotesets):
+        """
+        Get the matcher of a user.
+
+        Args:
+            emotesets: The emotesets of the user, as a tuple of ints. See
+                       lib.events.EmoteSet.
+
+        Returns:
+            An EmoteMatcher for the global emotes and the emotes of the sets.
+        """
+        matcher = self.matchers.get(emotesets)
+        if matcher is not None:
+            self.matchers.move_to_end(emotesets)
+            return matcher
+        matchers = [self.global_matcher]
+        for emoteset in emotesets:
+            emoteset_name = self.emotes_sets.get(str(emoteset))
+            if emoteset_name in self.emotes_subscriber:
+                matchers.append(self._get_set_matcher(emoteset_name))
+        if len(matchers) == 1:
+            matcher = self.global_matcher
+        else:
+            matcher = EmoteMatcher.combine(matchers)
+        self._add(emotesets, matcher)
+        return matcher
+
+    def _get_set_matcher(self, emoteset_name):
+        """
+        Get the matcher of a single emoteset.
+        """
+        key = ('SET', emoteset_name)
+        matcher = self.matchers.get(key)
+        if matcher is not None:
+            self.matchers.move_to_end(key)
+            return matcher
+        emotes = self.emotes_subscriber[emoteset_name]['emotes']
+        matcher = EmoteMatcher(dict.fromkeys(emotes, emoteset_name))
+        self._add(key, matcher)
+        return matcher
+
+    def _add(self, key, matcher):
+        """
+        Add a matcher to the cache, removing the least recently used ones if
+        the cache uses too much memory.
+        """
+        self.matchers[key] = matcher
+        if matcher is not self.global_matcher:
+            self.size += matcher.size
+        while self.size > self.max_size and len(self.matchers) > 1:
+            _, removed = self.matchers.popitem(last=False)
+            if removed is not self.global_matcher:
+                self.size -= removed.size
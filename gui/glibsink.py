@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import asyncio
+import time
+from gi.repository import GLib
+from lib import metrics
+from lib.eventbuffer import EventBuffer
+from lib.eventsink import EventSink
+
+idle_latency = metrics.histogram(
+    'gui_idle_latency_seconds',
+    'Time between events being ready and the main loop taking them')
+
+
+class GLibSink(EventSink):
+    def __init__(self, config, func_queue):
+        """
+        This sink sends the batches of events to the GTK main loop: the
+        function received from func_queue is called with the events in the
+        main loop, with GLib.idle_add.
+
+        Events wait in an EventBuffer until the main loop takes them, and
+        only one call is pending at a time. If the GUI is late, the events
+        received in the meantime are delivered together with the next call,
+        and the buffer sheds events past irc.event_buffer_size following
+        irc.event_overflow.
+
+        Args:
+            config: config object. See config.py and config.yaml.
+            func_queue: A queue.Queue that receives the function to call
+                        once the GUI is ready, e.g. IrcHandler.receive_batch.
+        """
+        self.func_queue = func_queue
+        self.glib_func = None
+        self.buffer = EventBuffer(config['irc']['event_buffer_size'],
+                                  config['irc']['event_overflow'])
+        self.scheduled = 0
+        metrics.gauge('event_buffer_depth', 'Events waiting for the GUI') \
+            .add_source(lambda: len(self.buffer))
+        metrics.counter('events_shed_total',
+                        'Events shed because the GUI was late') \
+            .add_source(lambda: self.buffer.shed_total)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.glib_func = await loop.run_in_executor(None, self.func_queue.get)
+
+    def send(self, batch):
+        if self.buffer.put(batch):
+            self.scheduled = time.perf_counter()
+            GLib.idle_add(self._deliver)
+
+    def _deliver(self):
+        """
+        Send the buffered events to the GUI. Called in the main loop.
+        """
+        idle_latency.observe(time.perf_counter() - self.scheduled)
+        self.glib_func(self.buffer.take())
+        return False
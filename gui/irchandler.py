@@ -1,8 +1,14 @@
 #!/usr/bin/env python
 # -*- encoding:utf-8 -*-
 
-from gi.repository import GLib
+import time
+from lib import metrics
+from lib.tracing import tracer
 
+dispatch_time = metrics.histogram(
+    'gui_dispatch_seconds', 'Time spent notifying the widgets of a batch')
+events_dispatched = metrics.counter(
+    'gui_events_total', 'Events received by the GUI')
 
 class IrcHandler():
     def __init__(self, config):
@@ -10,57 +16,147 @@ class IrcHandler():
         This class receives message from the irc thread and notifies the
         widgets.
 
+        Observers subscribe to an event type, either on one channel or on all
+        channels. The observers of each event type and channel are indexed
+        when they register, so notifying an event only looks at the observers
+        subscribed to it. Events that don't have a channel are sent to all the
+        observers of their type. Observers are called directly, as messages
+        from the irc thread are already received on the GUI thread.
+
         Args:
             config: A dictionnary with configuration options.
         """
         self.config = config
-        self.observers = {}
+        self.subscriptions = {}  # Observer -> set of (event, channel)
+        self.priorities = {}  # Observer -> priority
+        self.observers = {}  # (event, channel) -> list of observers
+        self.observers_any = {}  # Event -> list of observers on all channels
 
-    def notify_observers(self, event, data):
+    def notify_observers(self, event):
         """
         Notify all observers of an event if they subscribed to that event's
-        type.
+        type and channel.
 
         Args:
-            event: Event type.
-            data: Additionnal data for that event.
+            event: An event from lib.events. Events with a channel of None
+                   are sent to the observers of all channels.
+        """
+        for observer in self._get_observers(event.type, event.channel):
+            observer.notify(event)
+
+    def notify_observers_batch(self, events):
         """
-        for observer, subscriptions in self.observers.items():
-            if event in subscriptions:
-                GLib.idle_add(observer.notify, event, data)
+        Notify all observers of a list of events, with a single call per
+        observer. Observers that define notify_batch receive all their events
+        at once, the others have notify called for each event.
+
+        Args:
+            events: A list of events from lib.events.
+        """
+        batches = {}
+        for event in events:
+            for observer in self._get_observers(event.type, event.channel):
+                batch = batches.get(observer)
+                if batch is None:
+                    batch = batches[observer] = []
+                batch.append(event)
+        for observer in sorted(batches, key=self.priorities.get,
+                               reverse=True):
+            batch = batches[observer]
+            if hasattr(observer, 'notify_batch'):
+                observer.notify_batch(batch)
+            else:
+                for event in batch:
+                    observer.notify(event)
 
     def receive_message(self, msg):
         """
         Receive a message from the irc thread.
         """
-        self.notify_observers(msg[0], msg[1:])
+        self.notify_observers(msg)
+
+    def receive_batch(self, msgs):
+        """
+        Receive a list of messages from the irc thread.
+        """
+        start = time.perf_counter()
+        traces = None
+        if tracer.enabled:
+            traces = [trace for trace in map(tracer.get, msgs)
+                      if trace is not None]
+            for trace in traces:
+                tracer.span('queue', trace.end, start, trace)
+        self.notify_observers_batch(msgs)
+        end = time.perf_counter()
+        dispatch_time.observe(end - start)
+        events_dispatched.value += len(msgs)
+        if traces:
+            tracer.span('dispatch', start, end, traces[0], {
+                'events': len(msgs),
+                'traces': [trace.trace_id for trace in traces]})
 
-    def register_observer(self, observer, event):
+    def register_observer(self, observer, event, priority=0, channel=None):
         """
         Register a new observer to an event type.
 
         Args:
             observer: New observer.
-            event: Event type to subscribe.
+            event: Event type to subscribe, see lib.events.
+            priority: Observers with a higher priority are notified first.
+                      The priority applies to all of the observer's events.
+            channel: Channel to subscribe to, or None for all channels.
         """
-        if observer in self.observers.keys():
-            self.observers[observer].add(event)
-        else:
-            self.observers[observer] = set([event])
+        self.priorities[observer] = priority
+        self.subscriptions.setdefault(observer, set()).add((event, channel))
+        self._build_index()
 
-    def unregister_observer(self, observer, event):
+    def unregister_observer(self, observer, event, channel=None):
         """
         Unregister an observer from an event type.
 
         Args:
-            observer: New observer.
-            event: Event type to subscribe.
-        """
-        if observer in self.observer.keys():
-            try:
-                self.observers[observer].remove(event)
-                if len(observers[observer]) == 0:
-                    del self.observers[observer]
-            except KeyError:
-                pass
+            observer: Observer to unregister.
+            event: Event type to unsubscribe.
+            channel: Channel the observer subscribed to, or None if it
+                     subscribed to all channels.
+        """
+        subscriptions = self.subscriptions.get(observer)
+        if subscriptions is not None:
+            subscriptions.discard((event, channel))
+            if len(subscriptions) == 0:
+                del self.subscriptions[observer]
+                del self.priorities[observer]
+            self._build_index()
         return
+
+    def _build_index(self):
+        """
+        Build the lists of observers for each event type and channel.
+        """
+        observers = {}
+        observers_any = {}
+        for observer, subscriptions in self.subscriptions.items():
+            for event, channel in subscriptions:
+                if channel is None:
+                    observers_any.setdefault(event, []).append(observer)
+                    channels = self.config['irc']['channels']
+                else:
+                    channels = [channel]
+                for channel in [None] + channels:
+                    key = (event, channel)
+                    if observer not in observers.setdefault(key, []):
+                        observers[key].append(observer)
+        for observer_list in list(observers.values()) + \
+                list(observers_any.values()):
+            observer_list.sort(key=self.priorities.get, reverse=True)
+        self.observers = observers
+        self.observers_any = observers_any
+
+    def _get_observers(self, event, channel):
+        """
+        Get the observers to notify of an event on a channel.
+        """
+        observers = self.observers.get((event, channel))
+        if observers is None:
+            observers = self.observers_any.get(event, ())
+        return observers
@@ -3,13 +3,16 @@
 
 from gi.repository import Gtk, Gio, Gdk
 
+from gui.chatcache import ChatCache
 from gui.chatdisplay import ChatDisplay
 from gui.chatentry import ChatEntry
 from gui.irchandler import IrcHandler
 from gui.statusbar import StatusBar
 from gui.subscriberwidget import SubscriberWidget
 from gui.subscribercontrol import SubscriberControl
+from gui.userlist import UserList
 from gui.menubar import MenuBar
+from lib import events
 
 
 class MainApplication(Gtk.Application):
@@ -22,7 +25,7 @@ class MainApplication(Gtk.Application):
     def do_activate(self):
         win = MainWindow(self, self.config, self.out_queue)
         win.show_all()
-        self.func_queue.put(win.irchandler.receive_message)
+        self.func_queue.put(win.irchandler.receive_batch)
 
     def do_startup(self):
         Gtk.Application.do_startup(self)
@@ -44,10 +47,12 @@ class MainWindow(Gtk.ApplicationWindow):
         # Set window options
         self.set_default_size(640, 480)
         # Init widgets
+        self._init_chat_cache()
         self._init_chat_display()
         self._init_chat_entry()
         self._init_subscriber_widget()
         self._init_subscriber_control()
+        self._init_user_list()
         self._init_status_bar()
         self._init_menu_bar()
         self._init_irc_handler()
@@ -58,27 +63,47 @@ class MainWindow(Gtk.ApplicationWindow):
         Function called when the 'quit' action is activated. Calls GTK
         to close the window.
         """
-        self.chat.save_display_names()
+        self.chat_cache.save_display_names()
         self.app.quit()
 
+    def _init_chat_cache(self):
+        self.chat_cache = ChatCache(self.config)
+
     def _init_chat_display(self):
-        self.chat = ChatDisplay(self.config)
+        self.chats = {}
+        for channel in self.config['irc']['channels']:
+            self.chats[channel] = ChatDisplay(
+                self.config, channel, self.chat_cache)
 
     def _init_chat_entry(self):
-        self.chat_entry = ChatEntry(self.config, self.out_queue)
+        self.chat_entries = {}
+        for channel in self.config['irc']['channels']:
+            self.chat_entries[channel] = ChatEntry(
+                self.config, self.out_queue, channel)
+
+    def _init_user_list(self):
+        self.user_lists = {}
+        for channel in self.config['irc']['channels']:
+            self.user_lists[channel] = UserList(self.config, channel)
 
     def _init_irc_handler(self):
         self.irchandler = IrcHandler(self.config)
-        self.irchandler.register_observer(self.chat, 'MSG')
-        self.irchandler.register_observer(self.chat, 'USERCOLOR')
-        self.irchandler.register_observer(self.chat, 'EMOTESET')
-        self.irchandler.register_observer(self.chat, 'SPECIALUSER')
-        self.irchandler.register_observer(self.chat, 'MOD')
-        self.irchandler.register_observer(self.chat, 'DEMOD')
-        self.irchandler.register_observer(self.subscriber, 'SUBSCRIBER')
-        self.irchandler.register_observer(self.status, 'CONNECTING')
-        self.irchandler.register_observer(self.status, 'CONNECTED')
-        self.irchandler.register_observer(self.status, 'DISCONNECTED')
+        self.irchandler.register_observer(self.chat_cache, events.USERCOLOR)
+        self.irchandler.register_observer(self.chat_cache, events.EMOTESET)
+        for channel in self.config['irc']['channels']:
+            for event in (events.MSG, events.SPECIALUSER, events.MOD,
+                          events.DEMOD):
+                self.irchandler.register_observer(
+                    self.chats[channel], event, channel=channel)
+            self.irchandler.register_observer(
+                self.subscribers[channel], events.SUBSCRIBER, channel=channel)
+            for event in (events.JOIN, events.PART, events.MOD, events.DEMOD,
+                          events.SPECIALUSER, events.CONNECTED):
+                self.irchandler.register_observer(
+                    self.user_lists[channel], event, channel=channel)
+        self.irchandler.register_observer(self.status, events.CONNECTING)
+        self.irchandler.register_observer(self.status, events.CONNECTED)
+        self.irchandler.register_observer(self.status, events.DISCONNECTED)
 
     def _init_layout(self):
         self.grid = Gtk.Grid()
@@ -89,18 +114,37 @@ class MainWindow(Gtk.ApplicationWindow):
         self.grid.set_margin_left(3)
         self.grid.set_margin_right(3)
         self.grid.attach(self.menu.menubar, 0, 0, 1, 1)
-        vbox_chat = Gtk.Box.new(Gtk.Orientation.VERTICAL, 2)
-        vbox_chat.add(self.chat)
-        vbox_chat.add(self.chat_entry)
-        frame_chat = Gtk.Frame.new('Chat')
-        frame_chat.add(vbox_chat)
-        self.grid.attach(frame_chat, 0, 1, 1, 4)
-        vbox_subscriber = Gtk.Box.new(Gtk.Orientation.VERTICAL, 2)
-        vbox_subscriber.add(self.subscriber)
-        vbox_subscriber.add(self.subscriber_control)
-        frame_subscriber = Gtk.Frame.new('New subscribers')
-        frame_subscriber.add(vbox_subscriber)
-        self.grid.attach(frame_subscriber, 0, 5, 1, 1)
+        self.notebook = Gtk.Notebook()
+        self.notebook.set_show_tabs(len(self.config['irc']['channels']) > 1)
+        self.notebook.set_show_border(False)
+        for channel in self.config['irc']['channels']:
+            grid_channel = Gtk.Grid()
+            grid_channel.set_row_spacing(6)
+            grid_channel.set_column_spacing(6)
+            vbox_chat = Gtk.Box.new(Gtk.Orientation.VERTICAL, 2)
+            overlay_chat = Gtk.Overlay()
+            overlay_chat.add(self.chats[channel])
+            overlay_chat.add_overlay(self.chats[channel].autoscroll.indicator)
+            vbox_chat.add(overlay_chat)
+            vbox_chat.add(self.chat_entries[channel])
+            frame_chat = Gtk.Frame.new('Chat')
+            frame_chat.add(vbox_chat)
+            grid_channel.attach(frame_chat, 0, 0, 1, 4)
+            vbox_subscriber = Gtk.Box.new(Gtk.Orientation.VERTICAL, 2)
+            overlay_subscriber = Gtk.Overlay()
+            overlay_subscriber.add(self.subscribers[channel])
+            overlay_subscriber.add_overlay(
+                self.subscribers[channel].autoscroll.indicator)
+            vbox_subscriber.add(overlay_subscriber)
+            vbox_subscriber.add(self.subscriber_controls[channel])
+            frame_subscriber = Gtk.Frame.new('New subscribers')
+            frame_subscriber.add(vbox_subscriber)
+            grid_channel.attach(frame_subscriber, 0, 4, 1, 1)
+            frame_users = Gtk.Frame.new('Users')
+            frame_users.add(self.user_lists[channel])
+            grid_channel.attach(frame_users, 1, 0, 1, 5)
+            self.notebook.append_page(grid_channel, Gtk.Label(label=channel))
+        self.grid.attach(self.notebook, 0, 1, 1, 5)
         self.grid.attach(self.status, 0, 6, 1, 1)
         self.add(self.grid)
 
@@ -119,8 +163,12 @@ class MainWindow(Gtk.ApplicationWindow):
         self.status = StatusBar(self.config)
 
     def _init_subscriber_widget(self):
-        self.subscriber = SubscriberWidget(self.config)
+        self.subscribers = {}
+        for channel in self.config['irc']['channels']:
+            self.subscribers[channel] = SubscriberWidget(self.config)
 
     def _init_subscriber_control(self):
-        text_buffer = self.subscriber.text_view.get_buffer()
-        self.subscriber_control = SubscriberControl(text_buffer)
+        self.subscriber_controls = {}
+        for channel in self.config['irc']['channels']:
+            text_buffer = self.subscribers[channel].text_view.get_buffer()
+            self.subscriber_controls[channel] = SubscriberControl(text_buffer)
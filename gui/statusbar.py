@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 # -*- encoding:utf-8 -*-
 
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
+from lib import events, metrics
 
 
 class StatusBar(Gtk.Statusbar):
     def __init__(self, config):
         """
         This widget creates a status bar meant to be displayed at the bottom of
-        the screen. It shows the state of the IRC connection.
+        the screen. It shows the state of the IRC connection and, if
+        debug.metrics_statusbar is set, a summary of the performance metrics
+        updated every second.
 
         Args:
             config: A dictionnary with configuration options.
@@ -18,23 +21,62 @@ class StatusBar(Gtk.Statusbar):
         self.set_halign(Gtk.Align.END)
         self.context_id = self.get_context_id('info')
         self.first_connection = True
+        if self.config['debug']['metrics_statusbar']:
+            self.sampler = metrics.Sampler()
+            self.sampler.sample()
+            self.metrics_label = Gtk.Label()
+            self.pack_start(self.metrics_label, False, False, 6)
+            GLib.timeout_add_seconds(1, self.update_metrics)
 
-    def notify(self, event, data):
+    def notify(self, event):
         """
         Notify this widget of an event.
 
         Args:
-            event: Type of the event
-            data: Additionnal data for this event
+            event: An event from lib.events.
         """
         self.pop(self.context_id)
-        if event == 'CONNECTING':
+        if event.type == events.CONNECTING:
             if self.first_connection:
                 self.push(self.context_id, 'Connecting.')
             else:
                 self.push(self.context_id, 'Connection lost. Reconnecting.')
-        elif event == 'CONNECTED':
+        elif event.type == events.CONNECTED:
             self.push(self.context_id, 'Connected.')
-        elif event == 'DISCONNECTED':
+        elif event.type == events.DISCONNECTED:
             self.first_connection = False
             self.push(self.context_id, 'Connection lost.')
+
+    def update_metrics(self):
+        """
+        Show the metrics of the last second.
+        """
+        sampler = self.sampler
+        sampler.sample()
+        parts = ['{0:.0f} msg/s'.format(
+            sampler.rate('irc_messages_received_total'))]
+        lines = sampler.delta('irc_lines_received_total')
+        if lines:
+            parts.append('parse {0:.0f}\u00b5s'.format(
+                sampler.delta('irc_parse_seconds_total') / lines * 1e6))
+        for name, label in (('gui_idle_latency_seconds', 'idle'),
+                            ('chat_render_seconds', 'render'),
+                            ('http_fetch_seconds', 'http')):
+            mean = sampler.mean(name)
+            if mean is not None:
+                parts.append('{0} {1:.0f}ms'.format(label, mean * 1000))
+        parts.append('queues {0}/{1}/{2}'.format(
+            sampler.value('event_buffer_depth'),
+            sampler.value('worker_queue_depth'),
+            sampler.value('irc_send_queue_depth')))
+        hits = sampler.value('display_name_cache_hits_total')
+        misses = sampler.value('display_name_cache_misses_total')
+        if hits + misses:
+            parts.append('names {0:.0f}%'.format(
+                100 * hits / (hits + misses)))
+        shed = sampler.value('events_shed_total') + \
+            sampler.value('worker_requests_shed_total')
+        if shed:
+            parts.append('shed {0}'.format(shed))
+        self.metrics_label.set_text(' | '.join(parts))
+        return True
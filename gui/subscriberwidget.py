@@ -3,12 +3,15 @@
 
 import time
 from gi.repository import Gtk, Pango
+from gui.autoscroll import AutoScroll
+from lib import events
 
 
 class SubscriberWidget(Gtk.ScrolledWindow):
     def __init__(self, config):
         """
-        This widget shows new subscribers in a text box.
+        This widget shows new subscribers in a text box. The view is kept
+        at the bottom by an AutoScroll.
 
         Args:
             config: A dictionnary with configuration options.
@@ -28,62 +31,80 @@ class SubscriberWidget(Gtk.ScrolledWindow):
         self.add(self.text_view)
         # Bind events and init misc stuff
         self.msg_count = 0
-        self.text_view.connect('size-allocate', self.scroll_bottom)
+        self.autoscroll = AutoScroll(self)
         self.tag_time = self.text_view.get_buffer().create_tag(
             'time', weight=Pango.Weight.LIGHT)
         self.tag_bold = self.text_view.get_buffer().create_tag(
             'bold', weight=Pango.Weight.BOLD)
 
-    def notify(self, event, data):
+    def notify(self, event):
         """
         Notify this widget of an event.
 
         Args:
-            event: Type of the event
-            data: Additionnal data for this event
+            event: An event from lib.events.
         """
-        if event == 'SUBSCRIBER':
-            text_buffer = self.text_view.get_buffer()
-            if self.msg_count != 0:
-                text_buffer.insert(text_buffer.get_end_iter(), '\r\n')
-            mark_begin = text_buffer.create_mark(
-                None, text_buffer.get_end_iter(), True)
-            # Add timestamp
-            timestamp = time.strftime('%H:%M:%S')
-            text_buffer.insert(text_buffer.get_end_iter(), timestamp)
-            tag_iter_1 = text_buffer.get_iter_at_mark(mark_begin)
-            tag_iter_2 = text_buffer.get_end_iter()
-            text_buffer.apply_tag(self.tag_time, tag_iter_1, tag_iter_2)
-            text_buffer.insert(text_buffer.get_end_iter(), '  ')
-            # Add subscriber message
-            mark_msg = text_buffer.create_mark(
-                None, text_buffer.get_end_iter(), True)
-            text_buffer.insert(
-                text_buffer.get_end_iter(),
-                '{0} has subscribed!'.format(data[0]))
-            tag_iter_1 = text_buffer.get_iter_at_mark(mark_msg)
-            tag_iter_2 = text_buffer.get_end_iter()
-            text_buffer.apply_tag(self.tag_bold, tag_iter_1, tag_iter_2)
-            # Cleanup mark and old messages
-            text_buffer.delete_mark(mark_begin)
-            text_buffer.delete_mark(mark_msg)
-            self.msg_count += 1
-            if self.msg_count > self.config['gui']['subscriber_maxmessages']:
-                iter_1 = text_buffer.get_start_iter()
-                iter_2 = text_buffer.get_iter_at_line(1)
-                text_buffer.delete(iter_1, iter_2)
-                self.msg_count -= 1
+        if event.type == events.SUBSCRIBER:
+            self.notify_batch([event])
         return
 
-    def scroll_bottom(self, event, data=None):
+    def notify_batch(self, batch):
         """
-        Scroll to the bottom of the window.
+        Notify this widget of a list of events.
 
         Args:
-            event: Event that called this function
-            data: Additionnal data for this event
+            batch: A list of events from lib.events.
         """
-        adj = self.get_vadjustment()
-        adj.set_value(adj.get_upper() - adj.get_page_size())
-        self.text_view.queue_draw()
-        return
+        count = 0
+        for event in batch:
+            if event.type == events.SUBSCRIBER:
+                self._add_message(event)
+                count += 1
+        self._remove_old_messages()
+        self.autoscroll.add_lines(count)
+
+    def _add_message(self, event):
+        """
+        Add a subscriber message at the end of the text view.
+
+        Args:
+            event: The Subscriber event.
+        """
+        text_buffer = self.text_view.get_buffer()
+        if self.msg_count != 0:
+            text_buffer.insert(text_buffer.get_end_iter(), '\r\n')
+        mark_begin = text_buffer.create_mark(
+            None, text_buffer.get_end_iter(), True)
+        # Add timestamp
+        timestamp = time.strftime('%H:%M:%S')
+        text_buffer.insert(text_buffer.get_end_iter(), timestamp)
+        tag_iter_1 = text_buffer.get_iter_at_mark(mark_begin)
+        tag_iter_2 = text_buffer.get_end_iter()
+        text_buffer.apply_tag(self.tag_time, tag_iter_1, tag_iter_2)
+        text_buffer.insert(text_buffer.get_end_iter(), '  ')
+        # Add subscriber message
+        mark_msg = text_buffer.create_mark(
+            None, text_buffer.get_end_iter(), True)
+        text_buffer.insert(
+            text_buffer.get_end_iter(),
+            '{0} has subscribed!'.format(event.username))
+        tag_iter_1 = text_buffer.get_iter_at_mark(mark_msg)
+        tag_iter_2 = text_buffer.get_end_iter()
+        text_buffer.apply_tag(self.tag_bold, tag_iter_1, tag_iter_2)
+        # Cleanup marks
+        text_buffer.delete_mark(mark_begin)
+        text_buffer.delete_mark(mark_msg)
+        self.msg_count += 1
+
+    def _remove_old_messages(self):
+        """
+        Remove the oldest messages when there are more messages than the
+        maximum defined in the config.
+        """
+        excess = self.msg_count - self.config['gui']['subscriber_maxmessages']
+        if excess > 0:
+            text_buffer = self.text_view.get_buffer()
+            iter_1 = text_buffer.get_start_iter()
+            iter_2 = text_buffer.get_iter_at_line(excess)
+            text_buffer.delete(iter_1, iter_2)
+            self.msg_count -= excess
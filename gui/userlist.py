@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+from gi.repository import Gtk, Gdk, GLib, Pango
+from lib.userregistry import UserRegistry
+
+
+class UserList(Gtk.Box):
+    def __init__(self, config, channel):
+        """
+        This widget shows the users in a channel, with a search entry to
+        filter them.
+
+        The list only holds the rows that fit in the widget, and a separate
+        scrollbar moves that window over the users kept by a UserRegistry,
+        so channels with a very large number of users stay responsive.
+        The list is updated at most once per main loop iteration.
+
+        Args:
+            config: A dictionnary with configuration options.
+            channel: Channel to show the users of, including the '#'.
+        """
+        Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL,
+                         spacing=2)
+        self.config = config
+        self.registry = UserRegistry(
+            channel, config['gui']['chat_cache_size'])
+        self.users = []
+        self.filter_text = ''
+        self.row_height = 0
+        self.page_rows = 0
+        self.refresh_pending = False
+        # Init search entry
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.connect('search-changed', self.on_search_changed)
+        # Init TreeView, it only shows the visible rows
+        self.list_store = Gtk.ListStore(str, int)
+        self.tree_view = Gtk.TreeView(model=self.list_store)
+        self.tree_view.set_headers_visible(False)
+        self.tree_view.set_enable_search(False)
+        self.tree_view.set_hexpand(True)
+        self.tree_view.set_vexpand(True)
+        self.renderer = Gtk.CellRendererText()
+        self.renderer.set_property('ellipsize', Pango.EllipsizeMode.END)
+        column = Gtk.TreeViewColumn('User', self.renderer, text=0, weight=1)
+        self.tree_view.append_column(column)
+        self.tree_view.add_events(Gdk.EventMask.SCROLL_MASK |
+                                  Gdk.EventMask.SMOOTH_SCROLL_MASK)
+        self.tree_view.connect('size-allocate', self.on_size_allocate)
+        self.tree_view.connect('scroll-event', self.on_scroll)
+        # Init scrollbar, it covers all the users
+        self.adjustment = Gtk.Adjustment(
+            value=0, lower=0, upper=0, step_increment=1, page_increment=1,
+            page_size=0)
+        self.adjustment.connect('value-changed', self.on_scrolled)
+        self.scrollbar = Gtk.Scrollbar(
+            orientation=Gtk.Orientation.VERTICAL, adjustment=self.adjustment)
+        # Init user count
+        self.count_label = Gtk.Label(label='0 users')
+        self.count_label.set_halign(Gtk.Align.START)
+        # Init layout
+        hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        hbox.add(self.tree_view)
+        hbox.add(self.scrollbar)
+        self.add(self.search_entry)
+        self.add(hbox)
+        self.add(self.count_label)
+        self.set_size_request(160, -1)
+        self.set_vexpand(True)
+
+    def notify(self, event):
+        """
+        Notify this widget of an event.
+
+        Args:
+            event: An event from lib.events.
+        """
+        self.notify_batch([event])
+
+    def notify_batch(self, batch):
+        """
+        Notify this widget of a list of events.
+
+        Args:
+            batch: A list of events from lib.events.
+        """
+        if self.registry.apply(batch):
+            self.queue_refresh()
+
+    def queue_refresh(self):
+        """
+        Update the list at the next iteration of the main loop.
+        """
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            GLib.idle_add(self.refresh)
+
+    def refresh(self, *args):
+        """
+        Update the list from the registry and the search text.
+        """
+        self.refresh_pending = False
+        self.users = self.registry.get_users(self.filter_text)
+        if self.filter_text:
+            self.count_label.set_text('{0} of {1} users'.format(
+                len(self.users), len(self.registry)))
+        else:
+            self.count_label.set_text('{0} users'.format(len(self.users)))
+        self.adjustment.set_upper(len(self.users))
+        self.adjustment.set_page_size(self.page_rows)
+        self.adjustment.set_page_increment(max(self.page_rows - 1, 1))
+        self._scroll_to(self.adjustment.get_value())
+        self._fill()
+        return False
+
+    def on_search_changed(self, *args):
+        """
+        Function called when the search text changes.
+        """
+        self.filter_text = self.search_entry.get_text()
+        self.adjustment.set_value(0)
+        self.queue_refresh()
+
+    def on_size_allocate(self, widget, allocation):
+        """
+        Function called when the list is resized. Updates the number of rows
+        to show.
+        """
+        if self.row_height == 0:
+            _, height = self.renderer.get_preferred_height(self.tree_view)
+            separator = self.tree_view.style_get_property(
+                'vertical-separator')
+            self.row_height = max(height + separator, 1)
+        page_rows = max(allocation.height // self.row_height, 1)
+        if page_rows != self.page_rows:
+            self.page_rows = page_rows
+            self.queue_refresh()
+
+    def on_scroll(self, widget, event):
+        """
+        Function called when the mouse wheel is used on the list.
+        """
+        has_deltas, _, delta_y = event.get_scroll_deltas()
+        if not has_deltas:
+            _, direction = event.get_scroll_direction()
+            if direction == Gdk.ScrollDirection.UP:
+                delta_y = -1
+            elif direction == Gdk.ScrollDirection.DOWN:
+                delta_y = 1
+            else:
+                delta_y = 0
+        self._scroll_to(self.adjustment.get_value() + 3 * delta_y)
+        return True
+
+    def on_scrolled(self, *args):
+        """
+        Function called when the scrollbar moves.
+        """
+        self._fill()
+
+    def _scroll_to(self, value):
+        """
+        Move the scrollbar, keeping it in the range of the list.
+        """
+        value = min(value, len(self.users) - self.page_rows)
+        value = max(int(value), 0)
+        if value != self.adjustment.get_value():
+            self.adjustment.set_value(value)
+
+    def _fill(self):
+        """
+        Put the visible users in the list.
+        """
+        start = int(self.adjustment.get_value())
+        moderators = self.registry.moderators
+        self.tree_view.set_model(None)
+        self.list_store.clear()
+        for username in self.users[start:start + self.page_rows]:
+            if username in moderators:
+                weight = Pango.Weight.BOLD
+            else:
+                weight = Pango.Weight.NORMAL
+            self.list_store.append([username, weight])
+        self.tree_view.set_model(self.list_store)
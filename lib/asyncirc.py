@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import asyncio
+import logging
+from lib.irc import Irc, IrcError
+from lib.linebuffer import LineBuffer
+
+
+class AsyncIrc(Irc):
+    def __init__(self, config):
+        """
+        Build an irc object to interact with a single IRC chat room using
+        asyncio streams.
+
+        This class has the same interface as Irc, except that connect,
+        receive_message and send_message are coroutines. It must be used from
+        a running event loop.
+
+        Args:
+            config: config object. See config.py and config.yaml.
+        """
+        super().__init__(config)
+        self.reader = None
+        self.writer = None
+        self.scheduler = None
+
+    def set_scheduler(self, scheduler):
+        """
+        Set the SendScheduler used to send PONGs. Without a scheduler, PONGs
+        are written to the connection directly.
+        """
+        self.scheduler = scheduler
+
+    async def connect(self, post_init_msg=None):
+        """
+        Connect to the server defined in the config file.
+
+        Raises:
+            IrcError if the connection failed for any reason.
+            IrcError.value is a string describing the reason the connection
+            failed.
+        """
+        if not self.parser:
+            raise IrcError('No parser defined before connecting')
+        # Connect to server
+        try:
+            reader, writer = await asyncio.open_connection(
+                self.config['irc']['server'], self.config['irc']['port'])
+            logging.info(
+                'IRC: connected to the server {0}:{1}'.format(
+                    self.config['irc']['server'], self.config['irc']['port']))
+        except OSError:
+            raise IrcError('Cannot connect to the server')
+        self.reader = reader
+        self.writer = writer
+        # Login to the IRC chat room
+        login_msg = 'USER {0}\r\nPASS {1}\r\nNICK {0}\r\n'.format(
+            self.config['irc']['user'], self.config['irc']['password'])
+        if not await self.send_message(login_msg, timeout=5):
+            self.close()
+            raise IrcError('Failed to send login data to the server')
+        try:
+            response = await asyncio.wait_for(
+                reader.read(self.config['irc']['buffer_size']), 5)
+        except (asyncio.TimeoutError, OSError):
+            self.close()
+            raise IrcError('No login response from the server')
+        # Keep the response, it can include messages to parse
+        self.line_buffer = LineBuffer(self.config['irc']['buffer_size'])
+        self.line_buffer.feed(response)
+        response = response.decode('utf-8', 'replace').rstrip()
+        if self.parser.check_connection_success(response):
+            logging.info('IRC: successfully logged in with username {0}'
+                         .format(self.config['irc']['user']))
+        else:
+            self.close()
+            raise IrcError('Login failed with message {0}'.format(response))
+        # Send post-init message to the server
+        if type(post_init_msg) == str or type(post_init_msg) == bytes:
+            if not await self.send_message(post_init_msg):
+                self.close()
+                raise IrcError(
+                    'Failed to send post-init message to the server')
+        # Join channels
+        await self.send_message('JOIN {0}\r\n'.format(
+            ','.join(self.config['irc']['channels'])))
+        logging.info('IRC: joined channels {0}'.format(
+            ', '.join(self.config['irc']['channels'])))
+        return
+
+    def close(self):
+        """
+        Close the connection to the server.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def receive_message(self, timeout=None):
+        """
+        Wait for a message on the IRC channel.
+
+        Args:
+            Timeout in seconds, or None for no timeout.
+
+        Returns:
+            True if a message was received, False otherwise
+
+        Raises:
+            IrcError if the connection was lost.
+        """
+        if not self.reader:
+            return False
+        try:
+            data = await asyncio.wait_for(
+                self.reader.read(self.config['irc']['buffer_size']), timeout)
+        except asyncio.TimeoutError:
+            return False
+        except OSError:
+            data = b''
+        if len(data) == 0:
+            logging.warning('IRC: connection lost')
+            raise IrcError('Connection lost')
+        self.line_buffer.feed(data)
+        return True
+
+    async def send_message(self, msg, timeout=None):
+        """
+        Send a message to the IRC server.
+
+        Args:
+            msg: Message to send. Can be type 'str' or 'bytes'.
+            timeout: Timeout for the message, or None for no timeout.
+
+        Returns:
+            True if the data was sent successfully, False otherwise.
+        """
+        if not self.writer:
+            return False
+        if type(msg) == str:
+            msg = msg.encode()
+        elif type(msg) != bytes:
+            return False
+        try:
+            self.writer.write(msg)
+            await asyncio.wait_for(self.writer.drain(), timeout)
+        except (asyncio.TimeoutError, OSError):
+            return False
+        return True
+
+    def _send_pong(self):
+        """
+        Reply to a PING from the server.
+        """
+        if self.scheduler is not None:
+            self.scheduler.put_line(self.parser.pong_message)
+        elif self.writer is not None:
+            self.writer.write(self.parser.pong_message.encode())
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # -*- encoding:utf-8 -*-
 
+import sys
 import yaml
+from lib import eventbuffer, events
 
 
 def config(yaml_path):
@@ -16,6 +18,9 @@ def config(yaml_path):
 
     Raises:
         RuntimeError if some options are missing from the config file.
+        Note that irc.channel can be a single channel or a list of channels.
+        The list of channels is always available as irc.channels, and
+        irc.channel is the first channel of that list.
         Note that having no error this doesn't mean all options are correct,
         although some sanity checks are made.
     """
@@ -27,22 +32,84 @@ def config(yaml_path):
     try:
         data['irc']['server'] = str(data['irc']['server'])
         data['irc']['port'] = int(data['irc']['port'])
-        data['irc']['channel'] = str(data['irc']['channel'])
-        data['irc']['channel'] = data['irc']['channel'] if \
-            data['irc']['channel'][0] == '#' else \
-            '#{0}'.format(data['irc']['channel'])
-        data['irc']['channel'] = data['irc']['channel'].lower()
+        channels = data['irc']['channel']
+        if type(channels) != list:
+            channels = [channels]
+        data['irc']['channels'] = []
+        for channel in map(str, channels):
+            channel = channel if channel[0] == '#' else '#{0}'.format(channel)
+            data['irc']['channels'].append(channel.lower())
+        data['irc']['channel'] = data['irc']['channels'][0]
         data['irc']['user'] = str(data['irc']['user'])
         data['irc']['password'] = str(data['irc']['password'])
         data['irc']['buffer_size'] = int(data['irc']['buffer_size'])
         data['irc']['send_timeout'] = int(data['irc']['send_timeout'])
+        data['irc']['ping_interval'] = int(data['irc']['ping_interval'])
+        data['irc']['event_batch_interval'] = \
+            int(data['irc']['event_batch_interval'])
+        data['irc']['shared_connection'] = \
+            bool(data['irc']['shared_connection'])
+        data['irc']['reconnect_delay_max'] = \
+            int(data['irc']['reconnect_delay_max'])
+        data['irc']['send_rate_normal'] = int(data['irc']['send_rate_normal'])
+        data['irc']['send_rate_moderator'] = \
+            int(data['irc']['send_rate_moderator'])
+        data['irc']['send_rate_period'] = \
+            float(data['irc']['send_rate_period'])
+        if data['irc']['send_rate_normal'] < 4 or \
+                data['irc']['send_rate_moderator'] < 4:
+            # A message must cost at most the capacity of the token bucket,
+            # a quarter of send_rate_moderator, see SendScheduler
+            raise ValueError('Invalid send rate')
+        data['irc']['send_delay_warning'] = \
+            float(data['irc']['send_delay_warning'])
+        data['irc']['username_cache_size'] = \
+            int(data['irc']['username_cache_size'])
+        data['irc']['event_buffer_size'] = \
+            int(data['irc']['event_buffer_size'])
+        event_overflow = {}
+        for event_type, policy in data['irc']['event_overflow'].items():
+            event_type = str(event_type).upper()
+            policy = str(policy)
+            if event_type not in events.TYPES:
+                raise ValueError('Invalid event type in event_overflow')
+            if policy not in eventbuffer.POLICIES or \
+                    (event_type in eventbuffer.PROTECTED and
+                     policy != eventbuffer.KEEP):
+                raise ValueError('Invalid event_overflow policy')
+            event_overflow[sys.intern(event_type)] = policy
+        data['irc']['event_overflow'] = event_overflow
+        data['irc']['send_queue_size'] = int(data['irc']['send_queue_size'])
         data['irc']['log_folder'] = str(data['irc']['log_folder'])
+        data['irc']['log_buffer_size'] = int(data['irc']['log_buffer_size'])
+        data['irc']['log_flush_size'] = int(data['irc']['log_flush_size'])
+        data['irc']['log_flush_interval'] = \
+            float(data['irc']['log_flush_interval'])
+        data['irc']['log_rotate_daily'] = \
+            bool(data['irc']['log_rotate_daily'])
+        data['irc']['log_max_size'] = int(data['irc']['log_max_size'])
+        data['irc']['log_fsync'] = str(data['irc']['log_fsync'])
+        if data['irc']['log_fsync'] not in ('never', 'flush', 'rotate'):
+            raise ValueError('Invalid log_fsync policy')
+        data['irc']['log_archive'] = str(data['irc']['log_archive'])
+        if data['irc']['log_archive'] not in ('none', 'lzma', 'gzip'):
+            raise ValueError('Invalid log_archive compression')
+        if data['irc']['log_archive'] != 'none' and \
+                not data['irc']['log_rotate_daily'] and \
+                not data['irc']['log_max_size']:
+            # Only rotated log files are archived
+            raise ValueError('log_archive needs a log rotation')
+        data['irc']['log_index'] = bool(data['irc']['log_index'])
         data['gui']['emote_globals_path'] = str(
             data['gui']['emote_globals_path'])
         data['gui']['emote_subscriber_path'] = str(
             data['gui']['emote_subscriber_path'])
         data['gui']['badges_path'] = str(data['gui']['badges_path'])
         data['gui']['chat_maxmessages'] = int(data['gui']['chat_maxmessages'])
+        data['gui']['chat_window_size'] = int(data['gui']['chat_window_size'])
+        if data['gui']['chat_maxmessages'] < 1 or \
+                data['gui']['chat_window_size'] < 1:
+            raise ValueError('Invalid chat size')
         data['gui']['chat_linespacing'] = int(data['gui']['chat_linespacing'])
         data['gui']['chat_cache_size'] = int(data['gui']['chat_cache_size'])
         data['gui']['display_names_cache_size'] = \
@@ -53,9 +120,24 @@ def config(yaml_path):
             int(data['gui']['display_names_save_interval'])
         data['gui']['subscriber_maxmessages'] = int(
             data['gui']['subscriber_maxmessages'])
+        data['gui']['worker_queue_size'] = \
+            int(data['gui']['worker_queue_size'])
+        data['gui']['emote_matcher_cache_size'] = \
+            int(data['gui']['emote_matcher_cache_size'])
         data['debug']['log-level'] = str(data['debug']['log-level'])
         data['debug']['log-file'] = str(data['debug']['log-file'])
-    except KeyError:
+        data['debug']['metrics_statusbar'] = \
+            bool(data['debug']['metrics_statusbar'])
+        data['debug']['metrics_file'] = str(data['debug']['metrics_file'])
+        data['debug']['metrics_interval'] = \
+            float(data['debug']['metrics_interval'])
+        data['debug']['metrics_port'] = int(data['debug']['metrics_port'])
+        data['debug']['trace_file'] = str(data['debug']['trace_file'])
+        data['debug']['trace_sample_rate'] = \
+            int(data['debug']['trace_sample_rate'])
+        if data['debug']['trace_sample_rate'] < 1:
+            raise ValueError('Invalid trace_sample_rate')
+    except (KeyError, IndexError):
         raise RuntimeError('Options missing from the config file')
     except ValueError:
         raise RuntimeError('Invalid option in the config file')
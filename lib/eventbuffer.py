@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import logging
+import threading
+from collections import Counter
+from lib import events
+
+KEEP = 'keep'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COALESCE = 'coalesce'
+POLICIES = (KEEP, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+# Events that change a state, and are never shed
+PROTECTED = (events.MOD, events.DEMOD, events.TIMEOUT, events.SUBSCRIBER,
+             events.CLEARCHAT, events.CONNECTING, events.CONNECTED,
+             events.DISCONNECTED)
+
+# Number of fields of each event type that identify what it updates, for
+# the coalesce policy. A newer event with the same fields replaces the
+# older one. Other event types only coalesce identical events.
+COALESCE_FIELDS = {
+    events.USERCOLOR: 2,  # channel, username
+    events.EMOTESET: 2,  # channel, username
+}
+
+
+class EventBuffer:
+    def __init__(self, max_size, policies):
+        """
+        This class buffers events between the IRC thread and a slower
+        consumer, e.g. the GUI, without growing without limit.
+
+        Events are added in batches by one thread and taken all at once by
+        another. When the buffer holds more than max_size events, events are
+        shed according to the policy of their type, until the buffer is back
+        to three quarters of max_size:
+            coalesce: only the newest event updating the same thing is
+                kept, e.g. the last color of a user. See COALESCE_FIELDS.
+            drop_oldest: the oldest events of the type are dropped.
+            drop_newest: new events of the type are dropped while the
+                buffer is full.
+            keep: events are never shed. The buffer can grow past max_size
+                with them.
+        Coalescing is tried before dropping. The types in PROTECTED always
+        use the keep policy.
+
+        The number of events shed is counted by event type in shed.
+
+        Args:
+            max_size: Number of events above which events are shed.
+            policies: A dictionnary of event type -> policy. Types that
+                      aren't in it use the keep policy.
+        """
+        self.max_size = max_size
+        self.policies = {event_type: policy
+                         for event_type, policy in policies.items()
+                         if event_type not in PROTECTED}
+        self.lock = threading.Lock()
+        self.events = []
+        self.shed = Counter()  # Event type -> number of events shed
+        self.shed_total = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def put(self, batch):
+        """
+        Add a list of events to the buffer.
+
+        Returns:
+            True if the buffer was empty, i.e. the consumer must be told
+            there are new events.
+        """
+        with self.lock:
+            was_empty = not self.events
+            if len(self.events) + len(batch) > self.max_size:
+                self._shed(batch)
+            else:
+                self.events += batch
+            return was_empty
+
+    def take(self):
+        """
+        Take all the events in the buffer.
+
+        Returns:
+            A list of events, in the order they were added.
+        """
+        with self.lock:
+            batch = self.events
+            self.events = []
+            return batch
+
+    def _shed(self, batch):
+        """
+        Add a list of events to a full buffer, shedding events.
+        """
+        policies = self.policies
+        shed_before = self.shed_total
+        for event in batch:
+            if policies.get(event.type) == DROP_NEWEST:
+                self._count(event.type, 1)
+            else:
+                self.events.append(event)
+        target = self.max_size * 3 // 4
+        if len(self.events) > target:
+            self._coalesce()
+        if len(self.events) > target:
+            self._drop_oldest(len(self.events) - target)
+        if self.shed_total > shed_before and (
+                shed_before == 0 or
+                self.shed_total // 1000 > shed_before // 1000):
+            logging.warning('EventBuffer: consumer is late, {0} events shed '
+                            'so far ({1})'.format(
+                                self.shed_total, ', '.join(
+                                    '{0} {1}'.format(count, event_type)
+                                    for event_type, count
+                                    in self.shed.most_common())))
+
+    def _coalesce(self):
+        """
+        Remove the events replaced by a newer event.
+        """
+        policies = self.policies
+        seen = set()
+        kept = []
+        for event in reversed(self.events):
+            if policies.get(event.type) == COALESCE:
+                fields = COALESCE_FIELDS.get(event.type)
+                key = (event.type, event if fields is None else
+                       event[:fields])
+                if key in seen:
+                    self._count(event.type, 1)
+                    continue
+                seen.add(key)
+            kept.append(event)
+        kept.reverse()
+        self.events = kept
+
+    def _drop_oldest(self, count):
+        """
+        Remove up to count events with the drop_oldest policy, oldest
+        first.
+        """
+        policies = self.policies
+        kept = []
+        for event in self.events:
+            if count > 0 and policies.get(event.type) == DROP_OLDEST:
+                self._count(event.type, 1)
+                count -= 1
+            else:
+                kept.append(event)
+        self.events = kept
+
+    def _count(self, event_type, count):
+        self.shed[event_type] += count
+        self.shed_total += count
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+"""
+Events sent from the IRC parsers to the widgets.
+
+Events are immutable named tuples without a per-instance dictionary. Their
+type is a class attribute, one of the constants below, so it isn't stored
+in each event. The first field of every event is the channel it happened
+on ('#channel'), or None if it has no channel.
+
+Observers use the type constants to subscribe to events, and the fields by
+name, e.g. event.username.
+"""
+
+import sys
+from collections import namedtuple
+
+JOIN = sys.intern('JOIN')
+PART = sys.intern('PART')
+MSG = sys.intern('MSG')
+MOD = sys.intern('MOD')
+DEMOD = sys.intern('DEMOD')
+SUBSCRIBER = sys.intern('SUBSCRIBER')
+USERCOLOR = sys.intern('USERCOLOR')
+EMOTESET = sys.intern('EMOTESET')
+SPECIALUSER = sys.intern('SPECIALUSER')
+TIMEOUT = sys.intern('TIMEOUT')
+CLEARCHAT = sys.intern('CLEARCHAT')
+PING = sys.intern('PING')
+CONNECTING = sys.intern('CONNECTING')
+CONNECTED = sys.intern('CONNECTED')
+DISCONNECTED = sys.intern('DISCONNECTED')
+TYPES = (JOIN, PART, MSG, MOD, DEMOD, SUBSCRIBER, USERCOLOR, EMOTESET,
+         SPECIALUSER, TIMEOUT, CLEARCHAT, PING, CONNECTING, CONNECTED,
+         DISCONNECTED)
+
+
+class Join(namedtuple('Join', 'channel usernames')):
+    """
+    One or more users joined the channel. This also includes the 'NAMES'
+    message sent when joining the channel. usernames is a tuple.
+    """
+    __slots__ = ()
+    type = JOIN
+
+
+class Part(namedtuple('Part', 'channel usernames')):
+    """
+    One or more users left the channel. usernames is a tuple.
+    """
+    __slots__ = ()
+    type = PART
+
+
+class Msg(namedtuple('Msg', 'channel username message')):
+    """
+    A user sent a message to the channel.
+    """
+    __slots__ = ()
+    type = MSG
+
+
+class Mod(namedtuple('Mod', 'channel username')):
+    """
+    A user was given mod status on the channel.
+    """
+    __slots__ = ()
+    type = MOD
+
+
+class Demod(namedtuple('Demod', 'channel username')):
+    """
+    A mod was demoted on the channel.
+    """
+    __slots__ = ()
+    type = DEMOD
+
+
+class Subscriber(namedtuple('Subscriber', 'channel username')):
+    """
+    A user subscribed to the channel.
+    """
+    __slots__ = ()
+    type = SUBSCRIBER
+
+
+class UserColor(namedtuple('UserColor', 'channel username color')):
+    """
+    Information on a user's color. The color is either hexadecimal
+    (#FFFFFF) or a word.
+    """
+    __slots__ = ()
+    type = USERCOLOR
+
+
+class EmoteSet(namedtuple('EmoteSet', 'channel username emotesets')):
+    """
+    The emotesets a user has access to, as a tuple of ints.
+    """
+    __slots__ = ()
+    type = EMOTESET
+
+
+class SpecialUser(namedtuple('SpecialUser', 'channel username usertype')):
+    """
+    Information on a user's special status, e.g. 'subscriber'.
+    """
+    __slots__ = ()
+    type = SPECIALUSER
+
+
+class Timeout(namedtuple('Timeout', 'channel username')):
+    """
+    A user has been banned or timed out.
+    """
+    __slots__ = ()
+    type = TIMEOUT
+
+
+class ClearChat(namedtuple('ClearChat', 'channel')):
+    """
+    A moderator has cleared the chat.
+    """
+    __slots__ = ()
+    type = CLEARCHAT
+
+
+class Ping(namedtuple('Ping', 'channel')):
+    """
+    The server sent a PING.
+    """
+    __slots__ = ()
+    type = PING
+
+
+class Connecting(namedtuple('Connecting', 'channel')):
+    """
+    Connecting to the server.
+    """
+    __slots__ = ()
+    type = CONNECTING
+
+
+class Connected(namedtuple('Connected', 'channel')):
+    """
+    Connected to the server.
+    """
+    __slots__ = ()
+    type = CONNECTED
+
+
+class Disconnected(namedtuple('Disconnected', 'channel')):
+    """
+    Connection to the server lost.
+    """
+    __slots__ = ()
+    type = DISCONNECTED
+
+
+# Events without data are shared
+PING_EVENT = Ping(None)
+CONNECTING_EVENT = Connecting(None)
+CONNECTED_EVENT = Connected(None)
+DISCONNECTED_EVENT = Disconnected(None)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+"""
+Event sinks receive the batches of events sent by IrcEventGenerator.
+
+A sink's send function is called in the thread of the IRC event loop, with
+a list of events from lib.events. It must not block: the sinks below either
+call a function, or put the batch in a queue for another thread or
+coroutine. The GUI uses gui.glibsink.GLibSink, which calls a function in
+the GTK main loop; nothing in lib imports GTK.
+"""
+
+import asyncio
+
+
+class EventSink:
+    """
+    Base class for event sinks.
+    """
+    async def start(self):
+        """
+        Called once in the IRC event loop, before the first connection.
+        Sinks can wait for their receiver to be ready here.
+        """
+        return
+
+    def send(self, batch):
+        """
+        Send a batch of events to the receiver.
+
+        Args:
+            batch: A list of events from lib.events.
+        """
+        raise NotImplementedError
+
+
+class CallbackSink(EventSink):
+    def __init__(self, func):
+        """
+        This sink calls a function with each batch of events, in the thread
+        of the IRC event loop. The function must return quickly.
+
+        Args:
+            func: Function called with a list of events.
+        """
+        self.func = func
+
+    def send(self, batch):
+        self.func(batch)
+
+
+class QueueSink(EventSink):
+    def __init__(self, event_queue):
+        """
+        This sink puts each batch of events in a thread-safe queue, to be
+        read by another thread.
+
+        Args:
+            event_queue: A queue.Queue that receives lists of events.
+        """
+        self.event_queue = event_queue
+
+    def send(self, batch):
+        self.event_queue.put(batch)
+
+
+class AsyncioSink(EventSink):
+    def __init__(self):
+        """
+        This sink puts each batch of events in an asyncio queue, to be read
+        by coroutines running on the IRC event loop, with
+        'batch = await sink.get()'.
+        """
+        self.event_queue = None
+
+    async def start(self):
+        self.event_queue = asyncio.Queue()
+
+    def send(self, batch):
+        self.event_queue.put_nowait(batch)
+
+    async def get(self):
+        """
+        Wait for the next batch of events.
+
+        Returns:
+            A list of events from lib.events.
+        """
+        return await self.event_queue.get()
@@ -2,11 +2,19 @@
 # -*- encoding:utf-8 -*-
 
 import logging
-import os
-import os.path
 import re
 import socket
 import time
+from lib import events, metrics
+from lib.tracing import tracer
+from lib.linebuffer import LineBuffer
+
+lines_received = metrics.counter(
+    'irc_lines_received_total', 'Lines received from the IRC server')
+messages_received = metrics.counter(
+    'irc_messages_received_total', 'Chat messages received')
+parse_time = metrics.counter(
+    'irc_parse_seconds_total', 'Time spent parsing the received lines')
 
 
 class IrcError(Exception):
@@ -30,6 +38,8 @@ class Irc:
         """
         self.config = config
         self.parser = None
+        self.log_writer = None
+        self.delivers_events = True
         self.logging = logging
 
     def connect(self, post_init_msg=None):
@@ -85,14 +95,14 @@ class Irc:
             except socket.timeout:
                 raise IrcError(
                     'Failed to send post-init message to the server')
-        # Join channel
+        # Join channels
         sock.send('JOIN {0}\r\n'.format(
-            self.config['irc']['channel']).encode())
-        logging.info('IRC: joined channel {0}'.format(
-            self.config['irc']['channel']))
+            ','.join(self.config['irc']['channels'])).encode())
+        logging.info('IRC: joined channels {0}'.format(
+            ', '.join(self.config['irc']['channels'])))
         # Change self variable and return
         self.sock = sock
-        self.message = ''
+        self.line_buffer = LineBuffer(self.config['irc']['buffer_size'])
         return
 
     def parse_message(self):
@@ -101,61 +111,63 @@ class Irc:
         (ex: sending PONG after a PING).
 
         Returns:
-            A list with parsed data related to the event. The list has 1 item
-            per event (i.e. [event1, event2, etc.]). Each event is also
-            represented by a list. The possible events, as well as their list's
-            structure, are the following:
-            - JOIN: ['JOIN', 'username 1', 'username 2', ...]
-                One or more user(s) joined the channel. This also includes the
-                'NAMES' message sent when joining the channel.
-            - PART: ['PART', 'username 1', 'username 2', ...]
-                One or more user(s) left the channel.
-            - MSG: ['MSG', 'username', 'message']
-                A user sent a message to the channel.
-            - MOD: ['MOD', 'username']
-                A user was given mod status on the channel.
-            - DEMOD: ['DEMOD', 'username']
-                A mod was demoted on the channel.
-            - SUBSCRIBER: ['SUBSCRIBER', 'username']
-                A user subscribed to the channel.
-            - USERCOLOR: ['USERCOLOR', 'username', 'color']
-                Information on a user's color. Format for the color is #FFFFFF.
-            - EMOTESET: ['EMOTESET', 'username', emoteset1, emoteset2, ...]
-                A list of emoteset a user has access to.
-            - SPECIALUSER: ['SPECIALUSER', 'username', 'type']
-                Information on a user's special status.
-            - TIMEOUT: ['TIMEOUT', 'username']
-                A user has been banned or timed out.
-            - CLEARCHAT: ['CLEARCHAT']
-                A moderator has cleared the chat.
+            A list with the events parsed from the received messages (i.e.
+            [event1, event2, etc.]). Events are the objects defined in
+            lib.events, see IrcParser.parse_message. PINGs are answered here
+            and not returned.
+
+            Received messages are logged to the log file of their event's
+            channel, or of the first channel if they have no channel, with
+            the time they were received. They are counted in the metrics and
+            traced only if the events are delivered, see
+            set_delivers_events.
         """
-        # Split messages for parsing
-        messages = self.message.split('\r\n')
-        if self.message[-2:] != '\r\n':
-            self.message = messages[-1]
-        else:
-            self.message = ''
-        messages = messages[:-1]
-        # Pass messages to the parser
+        # Pass complete lines to the parser
+        messages = self.line_buffer.lines()
+        received_times = self.line_buffer.times
         retval = []
-        timestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ')
-        for msg in messages:
+        perf_counter = time.perf_counter
+        # Offset from the receive times to the wall clock
+        clock_offset = time.time() - perf_counter()
+        second = None
+        parse_seconds = 0
+        delivers_events = self.delivers_events
+        for msg, received in zip(messages, received_times):
             logging.debug('IRC chat in: {0}'.format(msg))
-            os.makedirs(self.config['irc']['log_folder'], exist_ok=True)
-            log_file_path = os.path.join(self.config['irc']['log_folder'],
-                                         self.config['irc']['channel']+'.log')
-            with open(log_file_path, 'a', encoding='utf-8') as log_file:
-                log_file.write('{0} : {1}\r\n'.format(timestamp, msg))
+            start = perf_counter()
             parsed_msg = self.parser.parse_message(msg)
+            end = perf_counter()
+            parse_seconds += end - start
+            if self.log_writer is not None:
+                if parsed_msg is not None and parsed_msg.channel is not None:
+                    channel = parsed_msg.channel
+                else:
+                    channel = self.config['irc']['channel']
+                if int(received + clock_offset) != second:
+                    second = int(received + clock_offset)
+                    timestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                              time.localtime(second))
+                self.log_writer.write(channel,
+                                      '{0} : {1}\r\n'.format(timestamp, msg))
             if parsed_msg is None:
                 logging.warning('IRC could not parse message: {0}'.format(msg))
-            elif parsed_msg[0] == 'PING':
-                self.sock.send(self.parser.pong_message.encode())
+            elif parsed_msg.type == events.PING:
+                self._send_pong()
                 logging.debug('IRC chat out: {0}'
                               .format(self.parser.pong_message).rstrip())
             else:
                 logging.debug('IRC event: {0}'.format(parsed_msg))
                 retval.append(parsed_msg)
+                if parsed_msg.type == events.MSG and delivers_events:
+                    messages_received.value += 1
+                    trace = tracer.enabled and \
+                        tracer.sample(parsed_msg, received)
+                    if trace:
+                        tracer.span('recv', received, start, trace)
+                        tracer.span('parse', start, end, trace)
+        if delivers_events:
+            lines_received.value += len(messages)
+            parse_time.value += parse_seconds
         return retval
 
     def receive_message(self, timeout=None):
@@ -175,12 +187,10 @@ class Irc:
             return False
         self.sock.settimeout(timeout)
         try:
-            new_message = self.sock.recv(
-                self.config['irc']['buffer_size']).decode()
+            nbytes = self.line_buffer.recv_into(self.sock)
         except socket.timeout:
             return False
-        self.message = self.message + new_message
-        if len(new_message) == 0:
+        if nbytes == 0:
             logging.warning('IRC: connection lost')
             raise IrcError('Connection lost')
         else:
@@ -219,6 +229,28 @@ class Irc:
         """
         self.parser = parser
 
+    def set_log_writer(self, log_writer):
+        """
+        Set the log writer used to save received messages. If no log writer
+        is set, messages are not logged.
+        """
+        self.log_writer = log_writer
+
+    def set_delivers_events(self, delivers_events):
+        """
+        Set whether the events parsed on this connection are delivered to
+        the application. Connections that only send messages also receive
+        the chat: their lines aren't counted in the metrics or traced, so
+        that they aren't counted twice. Events are delivered by default.
+        """
+        self.delivers_events = delivers_events
+
+    def _send_pong(self):
+        """
+        Reply to a PING from the server.
+        """
+        self.sock.send(self.parser.pong_message.encode())
+
 if __name__ == '__main__':
     """
     This is a simple example of an IRC connection that parses messages and
@@ -230,6 +262,7 @@ if __name__ == '__main__':
     import logging
     import sys
     import config
+    import logwriter
     import twitchparser1
     try:
         c = config.config('./config.yaml')
@@ -245,10 +278,12 @@ if __name__ == '__main__':
         filename=c['debug']['log-file'], filemode='w',
         level=log_levels[c['debug']['log-level']])
     # Main loop
+    log_writer = logwriter.LogWriter(c)
     while True:
         # Connect to IRC
         irc_sock = Irc(c)
         irc_sock.set_parser(twitchparser1.TwitchParser1())
+        irc_sock.set_log_writer(log_writer)
         try:
             irc_sock.connect('TWITCHCLIENT 1\r\n')
         except IrcError as e:
@@ -260,7 +295,7 @@ if __name__ == '__main__':
                 if irc_sock.receive_message():
                     messages = irc_sock.parse_message()
                     for msg in messages:
-                        if msg[0] == 'SUBSCRIBER':
-                            print('{0} has subscribed!'.format(msg[1]))
+                        if msg.type == events.SUBSCRIBER:
+                            print('{0} has subscribed!'.format(msg.username))
         except IrcError:
             pass
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import asyncio
+import logging
+import queue
+from lib import metrics
+from lib.asyncirc import AsyncIrc
+from lib.irc import IrcError
+from lib.sendscheduler import SendScheduler
+from lib.twitchparser1 import TwitchParser1 as IrcParser
+
+connections = metrics.counter(
+    'irc_connections_total', 'Connections established to the IRC server')
+send_queue_depth = metrics.gauge(
+    'irc_send_queue_depth', 'Lines waiting to be sent to the IRC server')
+lines_sent = metrics.counter(
+    'irc_lines_sent_total', 'Lines sent to the IRC server')
+
+
+class IrcClient:
+    # The parsed events are delivered to the application, see
+    # Irc.set_delivers_events
+    delivers_events = False
+
+    def __init__(self, config, post_init_msg=None, out_queue=None):
+        """
+        Base class for objects that keep a connection to the IRC server.
+
+        The connection is handled by tasks on an asyncio event loop: one task
+        receives and parses messages (answering PINGs), one sends PINGs when
+        the server is silent and detects dead connections, one writes the
+        queued lines to the connection, and subclasses can add their own tasks
+        with connection_tasks. When any task fails, the connection is closed
+        and re-established with an increasing delay.
+
+        Once connected, all lines are sent through a SendScheduler that keeps
+        the rate limits and sends PONGs before moderation commands and chat
+        messages. Chat messages from out_queue are kept in the scheduler
+        while the connection is being re-established.
+
+        Args:
+            config: config object. See config.py and config.yaml.
+            post_init_msg: Message sent to the server after logging in.
+            out_queue: A queue of chat messages to send, or None if this
+                       client doesn't send messages. Messages are either
+                       (channel, text) tuples, or a text to send to the
+                       first channel.
+        """
+        self.config = config
+        self.post_init_msg = post_init_msg
+        self.out_queue = out_queue
+        self.out_queue_task = None
+        self.scheduler = None
+        self.log_writer = None
+        self.last_receive = 0
+
+    def run(self):
+        """
+        Run this client in the calling thread. This function never returns.
+        """
+        run_clients([self])
+
+    async def run_async(self):
+        """
+        Connect to the IRC server and run the connection's tasks. If the
+        connection is lost, it is automatically re-established. This
+        coroutine never returns, the client stops when it is cancelled.
+        """
+        scheduler = self.scheduler = SendScheduler(self.config)
+        depth_source = send_queue_depth.add_source(scheduler.depth)
+        sent_source = lines_sent.add_source(lambda: scheduler.sent)
+        if self.out_queue is not None:
+            self.out_queue_task = asyncio.ensure_future(
+                self._read_out_queue())
+            self.out_queue_task.add_done_callback(self._on_out_queue_done)
+        try:
+            await self.on_start()
+            await self._run_connections()
+        finally:
+            if self.out_queue_task is not None:
+                self.out_queue_task.cancel()
+                self.out_queue_task = None
+            send_queue_depth.remove_source(depth_source)
+            lines_sent.remove_source(sent_source)
+
+    async def _run_connections(self):
+        """
+        Connect to the server and run the connection's tasks, reconnecting
+        with an increasing delay.
+        """
+        loop = asyncio.get_running_loop()
+        delay_min = 1
+        delay_max = self.config['irc']['reconnect_delay_max']
+        delay = delay_min
+        while True:
+            # Connect to IRC
+            self.on_connecting()
+            irc_sock = AsyncIrc(self.config)
+            irc_sock.set_parser(IrcParser())
+            irc_sock.set_log_writer(self.log_writer)
+            irc_sock.set_delivers_events(self.delivers_events)
+            irc_sock.set_scheduler(self.scheduler)
+            try:
+                await irc_sock.connect(self.post_init_msg)
+            except IrcError as e:
+                logging.error('IRC error: {0}'.format(e.value))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, delay_max)
+                continue
+            delay = delay_min
+            connections.value += 1
+            self.scheduler.clear(SendScheduler.LANE_PONG)
+            self.last_receive = loop.time()
+            self.on_connected()
+            # Run the connection's tasks until one of them fails
+            tasks = [asyncio.ensure_future(coro)
+                     for coro in self.connection_tasks(irc_sock)]
+            try:
+                done, pending = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            for task in done:
+                if task.cancelled():
+                    continue
+                e = task.exception()
+                if isinstance(e, IrcError):
+                    logging.warning('IRC error: {0}'.format(e.value))
+                elif e is not None:
+                    logging.error('IRC: unexpected error',
+                                  exc_info=(type(e), e, e.__traceback__))
+            irc_sock.close()
+            self.on_disconnected()
+
+    def connection_tasks(self, irc_sock):
+        """
+        Get the coroutines to run while connected to the server.
+
+        Args:
+            irc_sock: The connected AsyncIrc object.
+
+        Returns:
+            A list of coroutines.
+        """
+        return [self._receive(irc_sock), self._keepalive(irc_sock),
+                self.scheduler.run(irc_sock)]
+
+    async def on_start(self):
+        """
+        Called once in the event loop, before the first connection.
+        """
+        return
+
+    def on_connecting(self):
+        """
+        Called before connecting to the server.
+        """
+        return
+
+    def on_connected(self):
+        """
+        Called after the connection to the server was established.
+        """
+        return
+
+    def on_disconnected(self):
+        """
+        Called after the connection to the server was lost.
+        """
+        return
+
+    def on_event(self, msg):
+        """
+        Called for every event parsed from the server's messages.
+
+        Args:
+            msg: The parsed event. See Irc.parse_message.
+        """
+        return
+
+    async def _receive(self, irc_sock):
+        """
+        Receive and parse messages until disconnect.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            for msg in irc_sock.parse_message():
+                self.scheduler.on_event(msg)
+                self.on_event(msg)
+            if await irc_sock.receive_message(timeout=None):
+                self.last_receive = loop.time()
+
+    async def _keepalive(self, irc_sock):
+        """
+        Send a PING when nothing was received for a while, and fail if the
+        server stays silent.
+        """
+        loop = asyncio.get_running_loop()
+        interval = self.config['irc']['ping_interval']
+        while True:
+            await asyncio.sleep(interval)
+            idle = loop.time() - self.last_receive
+            if idle >= 2 * interval:
+                raise IrcError('Ping timeout')
+            elif idle >= interval:
+                self.scheduler.put_line('PING :tmi.twitch.tv\r\n')
+
+    async def _read_out_queue(self):
+        """
+        Move messages from the thread-safe out_queue to the send scheduler.
+        This task runs for as long as the event loop, so messages are queued
+        while the connection is being re-established. Messages are left in
+        out_queue while the scheduler is full, so that out_queue fills up
+        and the sender sees it.
+
+        The executor thread waits for out_queue with a timeout, so that it
+        doesn't keep the event loop from closing.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.scheduler.wait_for_space()
+            try:
+                out_msg = await loop.run_in_executor(
+                    None, self.out_queue.get, True, 1)
+            except queue.Empty:
+                continue
+            if type(out_msg) == tuple:
+                channel, out_msg = out_msg
+            else:
+                channel = self.config['irc']['channel']
+            self.scheduler.put_message(channel, out_msg)
+
+    def _on_out_queue_done(self, task):
+        """
+        Log the error that stopped the out_queue task, if any. Without it,
+        the chat messages would silently stop being sent.
+        """
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            logging.error('IRC: out_queue task failed',
+                          exc_info=(type(e), e, e.__traceback__))
+
+
+def run_clients(clients):
+    """
+    Run several IRC clients on one event loop in the calling thread. This
+    function never returns.
+
+    Args:
+        clients: A list of IrcClient objects.
+    """
+    async def main():
+        await asyncio.gather(*[client.run_async() for client in clients])
+    asyncio.run(main())
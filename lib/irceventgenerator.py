@@ -1,60 +1,73 @@
 #!/usr/bin/env python
 # -*- encoding:utf-8 -*-
 
-from lib.irc import Irc, IrcError
-from lib.twitchparser1 import TwitchParser1 as IrcParser
-import logging
-import time
+from lib import events
+from lib.ircclient import IrcClient
+from lib.logwriter import LogWriter
+import asyncio
 
-from gi.repository import GLib
 
+class IrcEventGenerator(IrcClient):
+    delivers_events = True
 
-class IrcEventGenerator:
-    def __init__(self, config, func_queue):
+    def __init__(self, config, sink, out_queue=None, write_logs=True):
         """
         This class handles the Irc subclass to receive messages, and sends
-        signals to the GUI after parsing those messages.
+        the parsed events to an event sink, e.g. the GUI.
+
+        If out_queue is given, chat messages taken from it are also sent on
+        the same connection, and no IrcSender is needed.
+
+        Events are sent in batches: the sink receives a list of events at
+        most once every irc.event_batch_interval milliseconds.
+
+        Args:
+            config: config object. See config.py and config.yaml.
+            sink: An EventSink, see eventsink.py.
+            out_queue: A queue of chat messages to send, see IrcClient.
+            write_logs: Write the received lines to the IRC logs.
         """
-        self.config = config
-        self.func_queue = func_queue
-        self.glib_func = None
+        super().__init__(config, 'TWITCHCLIENT 1\r\n', out_queue)
+        self.sink = sink
+        if write_logs:
+            self.log_writer = LogWriter(config)
+        self.batch = []
+        self.batch_interval = config['irc']['event_batch_interval'] / 1000
 
     def run(self):
         """
-        Connect to the IRC server and send events to the GUI. This funtion is
-        an endless loop that never exits, as it waits for a message before
-        sending a signal to the GUI. If the connection to the server is lost,
-        the connection is automatically re-established.
-
-        In addition to the events defined by Irc, the following events are
-        also sent:
-        - CONNECTING: ['CONNECTING']
-            Connecting to the server.
-        - CONNECTED: ['CONNECTED']
-            Connected to the server.
-        - DISCONNECTED: ['DISCONNECTED']
-            Connection to the server lost.
+        Connect to the IRC server and send events to the sink. This funtion
+        is an endless loop that never exits. If the connection to the server
+        is lost, the connection is automatically re-established.
+
+        Events are sent as lists of events, see Irc.parse_message. In
+        addition to the events parsed from the server's messages, the
+        Connecting, Connected and Disconnected events from lib.events are
+        also sent.
+        """
+        super().run()
+
+    async def on_start(self):
+        await self.sink.start()
+
+    def on_connecting(self):
+        self.on_event(events.CONNECTING_EVENT)
+
+    def on_connected(self):
+        self.on_event(events.CONNECTED_EVENT)
+
+    def on_disconnected(self):
+        self.on_event(events.DISCONNECTED_EVENT)
+
+    def on_event(self, msg):
+        if not self.batch:
+            loop = asyncio.get_running_loop()
+            loop.call_later(self.batch_interval, self._send_batch)
+        self.batch.append(msg)
+
+    def _send_batch(self):
+        """
+        Send all pending events to the sink at once.
         """
-        self.glib_func = self.func_queue.get()
-        while True:
-            # Connect to IRC
-            GLib.idle_add(self.glib_func, ['CONNECTING'])
-            irc_sock = Irc(self.config)
-            irc_sock.set_parser(IrcParser())
-            try:
-                irc_sock.connect('TWITCHCLIENT 1\r\n')
-            except IrcError as e:
-                logging.error('IRC error: {0}'.format(e.value))
-                time.sleep(1)
-                continue
-            GLib.idle_add(self.glib_func, ['CONNECTED'])
-            # Receive messages until disconnect
-            try:
-                while(True):
-                    if irc_sock.receive_message(timeout=None):
-                        messages = irc_sock.parse_message()
-                        for msg in messages:
-                            GLib.idle_add(self.glib_func, msg)
-            except IrcError:
-                pass
-            GLib.idle_add(self.glib_func, ['DISCONNECTED'])
+        self.sink.send(self.batch)
+        self.batch = []
@@ -1,26 +1,55 @@
 import re
+import sys
+from lib import events, usernames
+
+# Builds events from a tuple of their fields, without going through the
+# Python-level __new__ of the named tuples.
+new_event = tuple.__new__
 
 
 class IrcParser:
+    """
+    This class is the parent class for an IRC chat parser.
+
+    Subclasses define the regular expressions below as class attributes, so
+    they are compiled once when the module is imported. Messages are split
+    once to find their command, and only the expressions that can match that
+    command are tried.
+
+    Usernames are interned in the process-wide table of lib.usernames, so
+    every event about a user shares the same string object.
+    """
+    connection_re = None
+    join_re = None
+    names_re = None
+    part_re = None
+    msg_re = None
+    mod_re = None
+    demod_re = None
+    subscribe_re = None
+    usercolor_re = None
+    emoteset_re = None
+    specialuser_re = None
+    timeout_re = None
+    clearchat_re = None
+    ping_re = None
+    pong_message = None
+
     def __init__(self):
-        """
-        This class is the parent class for an IRC chat parser.
-        """
-        self.connection_re = None
-        self.join_re = None
-        self.names_re = None
-        self.part_re = None
-        self.msg_re = None
-        self.mod_re = None
-        self.demod_re = None
-        self.subscribe_re = None
-        self.usercolor_re = None
-        self.emoteset_re = None
-        self.specialuser_re = None
-        self.timeout_re = None
-        self.clearchat_re = None
-        self.ping_re = None
-        self.pong_message = None
+        self.command_handlers = {
+            'PRIVMSG': self._parse_privmsg,
+            'JOIN': self._parse_join,
+            'PART': self._parse_part,
+            '353': self._parse_names,
+            'MODE': self._parse_mode,
+            'PING': self._parse_ping}
+        self.jtv_handlers = {
+            'USERCOLOR': self._parse_usercolor,
+            'EMOTESET': self._parse_emoteset,
+            'SPECIALUSER': self._parse_specialuser,
+            'CLEARCHAT': self._parse_clearchat}
+        self.intern_username = usernames.table.intern
+        self.intern_usernames = usernames.table.intern_many
         return
 
     def check_connection_success(self, msg):
@@ -43,81 +72,123 @@ class IrcParser:
             msg: Message to parse.
 
         Returns:
-        A list with information on what the message contains. Possible formats
-        are:
-        - JOIN: ['JOIN', 'username 1', 'username 2', ...]
-            One or more user(s) joined the channel. This also includes the
-            'NAMES' message sent when joining the channel.
-        - PART: ['PART', 'username 1', 'username 2', ...]
-            One or more user(s) left the channel.
-        - MSG: ['MSG', 'username', 'message']
-            A user sent a message to the channel.
-        - MOD: ['MOD', 'username']
-            A user was given mod status on the channel.
-        - SUBSCRIBER: ['SUBSCRIBER', 'username']
-            A user subscribed to the channel.
-        - USERCOLOR: ['USERCOLOR', 'username', 'color']
-            Information on a user's color. Format for the color is either
-            hexadecimal (#FFFFFF) or a word.
-        - EMOTESET: ['EMOTESET', 'username', emoteset1, emoteset2, ...]
-            A list of emoteset a user has access to.
-        - SPECIALUSER: ['SPECIALUSER', 'username', 'type']
-            Information on a user's special status.
-        - TIMEOUT: ['TIMEOUT', 'username']
-            A user has been banned or timed out.
-        - CLEARCHAT: ['CLEARCHAT']
-            A moderator has cleared the chat.
-        - PING: ['PING']
-            The server sent a PING.
+            An event from lib.events, or None if the message isn't supported.
+            The event's channel is None if the message doesn't say which
+            channel it was sent to. Possible events are Join (this also
+            includes the 'NAMES' message sent when joining the channel),
+            Part, Msg, Mod, Demod, Subscriber, UserColor, EmoteSet,
+            SpecialUser, Timeout, ClearChat and Ping.
         """
-        match = self.join_re.match(msg)
+        if msg[:1] == ':':
+            rest = msg.partition(' ')[2]
+        else:
+            rest = msg
+        command, _, params = rest.partition(' ')
+        handler = self.command_handlers.get(command)
+        if handler is None:
+            return None
+        return handler(msg, params)
+
+    def _parse_privmsg(self, msg, params):
+        match = self.msg_re.match(msg)
         if match:
-            username = match.group('username')
-            return ['JOIN', username]
-        match = self.names_re.match(msg)
+            username, message = match.group('username', 'message')
+            username = self.intern_username(username)
+            return new_event(events.Msg,
+                             (self._channel(match), username, message))
+        match = self.subscribe_re.match(msg)
         if match:
-            usernames = match.group('usernames')
-            return ['JOIN'] + usernames.split(' ')
+            username = self.intern_username(match.group('username'))
+            return new_event(events.Subscriber,
+                             (self._channel(match), username))
+        keyword = params.partition(' :')[2].partition(' ')[0]
+        handler = self.jtv_handlers.get(keyword)
+        if handler is None:
+            return None
+        return handler(msg)
+
+    def _parse_join(self, msg, params):
+        match = self.join_re.match(msg)
+        if match:
+            username = self.intern_username(match.group('username'))
+            return new_event(events.Join, (self._channel(match), (username,)))
+        return None
+
+    def _parse_part(self, msg, params):
         match = self.part_re.match(msg)
         if match:
-            username = match.group('username')
-            return ['PART', username]
-        match = self.msg_re.match(msg)
+            username = self.intern_username(match.group('username'))
+            return new_event(events.Part, (self._channel(match), (username,)))
+        return None
+
+    def _parse_names(self, msg, params):
+        match = self.names_re.match(msg)
         if match:
-            username, message = match.group('username', 'message')
-            return ['MSG', username, message]
+            names = match.group('usernames')
+            return new_event(events.Join, (
+                self._channel(match), self.intern_usernames(names.split(' '))))
+        return None
+
+    def _parse_mode(self, msg, params):
         match = self.mod_re.match(msg)
         if match:
-            username = match.group('username')
-            return ['MOD', username]
+            username = self.intern_username(match.group('username'))
+            return new_event(events.Mod, (self._channel(match), username))
         match = self.demod_re.match(msg)
         if match:
-            username = match.group('username')
-            return ['DEMOD', username]
-        match = self.subscribe_re.match(msg)
+            username = self.intern_username(match.group('username'))
+            return new_event(events.Demod, (self._channel(match), username))
+        return None
+
+    def _parse_ping(self, msg, params):
+        match = self.ping_re.match(msg)
         if match:
-            username = match.group('username')
-            return ['SUBSCRIBER', username]
+            return events.PING_EVENT
+        return None
+
+    def _parse_usercolor(self, msg):
         match = self.usercolor_re.match(msg)
         if match:
             username, color = match.group('username', 'color')
-            return ['USERCOLOR', username, color]
+            username = self.intern_username(username)
+            return new_event(events.UserColor,
+                             (self._channel(match), username, color))
+        return None
+
+    def _parse_emoteset(self, msg):
         match = self.emoteset_re.match(msg)
         if match:
             username, emoteset = match.group('username', 'emoteset')
-            return ['EMOTESET', username] + list(map(int, emoteset.split(',')))
+            username = self.intern_username(username)
+            return new_event(events.EmoteSet, (
+                self._channel(match), username,
+                tuple(map(int, emoteset.split(',')))))
+        return None
+
+    def _parse_specialuser(self, msg):
         match = self.specialuser_re.match(msg)
         if match:
             username, usertype = match.group('username', 'usertype')
-            return ['SPECIALUSER', username, usertype]
+            username = self.intern_username(username)
+            return new_event(events.SpecialUser,
+                             (self._channel(match), username, usertype))
+        return None
+
+    def _parse_clearchat(self, msg):
         match = self.timeout_re.match(msg)
         if match:
-            username = match.group('username')
-            return ['TIMEOUT', username]
+            username = self.intern_username(match.group('username'))
+            return new_event(events.Timeout, (self._channel(match), username))
         match = self.clearchat_re.match(msg)
         if match:
-            return ['CLEARCHAT']
-        match = self.ping_re.match(msg)
-        if match:
-            return ['PING']
+            return new_event(events.ClearChat, (self._channel(match),))
+        return None
+
+    def _channel(self, match):
+        """
+        Get the channel captured by a match, or None if the pattern doesn't
+        capture one.
+        """
+        if 'channel' in match.re.groupindex:
+            return sys.intern('#' + match.group('channel'))
         return None
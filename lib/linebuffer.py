@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import time
+
+
+class LineBuffer:
+    def __init__(self, recv_size):
+        """
+        Split a stream of bytes into lines terminated by '\r\n'.
+
+        Data is received directly into a preallocated bytearray, and only
+        complete lines are decoded. A multibyte character split between two
+        receives is decoded correctly once its line is complete. Partial
+        lines are only moved when the buffer runs out of space.
+
+        The time each line was received is kept, from time.perf_counter: it is
+        the time of the receive that completed the line. See lines.
+
+        Args:
+            recv_size: Maximum number of bytes to receive at once.
+        """
+        self.recv_size = recv_size
+        self.buffer = bytearray(2 * recv_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Beginning of the first incomplete line
+        self.end = 0  # End of the received data
+        self.scan = 0  # Position to resume searching for '\r\n'
+        self.stamps = []  # (end of the data, time) of each receive
+        self.times = []  # Receive time of each line returned by lines
+
+    def recv_into(self, sock):
+        """
+        Receive data from a socket into the buffer.
+
+        Args:
+            sock: Socket to receive from.
+
+        Returns:
+            The number of bytes received. 0 means the connection was closed.
+        """
+        self._make_room(self.recv_size)
+        nbytes = sock.recv_into(self.view[self.end:self.end+self.recv_size])
+        self.end += nbytes
+        self.stamps.append((self.end, time.perf_counter()))
+        return nbytes
+
+    def feed(self, data):
+        """
+        Copy data that was already received into the buffer.
+
+        Args:
+            data: A bytes-like object.
+        """
+        self._make_room(len(data))
+        self.view[self.end:self.end+len(data)] = data
+        self.end += len(data)
+        self.stamps.append((self.end, time.perf_counter()))
+
+    def lines(self):
+        """
+        Get all complete lines received since the last call.
+
+        Returns:
+            A list of decoded lines, without their '\r\n' terminator. The
+            receive time of each line is put in the list self.times.
+        """
+        retval = []
+        times = []
+        stamps = self.stamps
+        stamp = 0
+        start = self.start
+        index = self.buffer.find(b'\r\n', self.scan, self.end)
+        while index != -1:
+            retval.append(str(self.view[start:index], 'utf-8', 'replace'))
+            start = index + 2
+            while stamps[stamp][0] < start:
+                stamp += 1
+            times.append(stamps[stamp][1])
+            index = self.buffer.find(b'\r\n', start, self.end)
+        if start == self.end:
+            self.start = self.end = self.scan = 0
+            stamps.clear()
+        else:
+            self.start = start
+            self.scan = max(start, self.end - 1)
+            while stamps[0][0] <= start:
+                del stamps[0]
+        self.times = times
+        return retval
+
+    def _make_room(self, nbytes):
+        """
+        Make sure at least nbytes can be written at the end of the buffer,
+        moving the incomplete line to the front or growing the buffer.
+        """
+        if len(self.buffer) - self.end >= nbytes:
+            return
+        pending = self.end - self.start
+        if pending + nbytes > len(self.buffer):
+            size = len(self.buffer)
+            while pending + nbytes > size:
+                size *= 2
+            self.view.release()
+            self.buffer.extend(bytes(size - len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        if self.start > 0:
+            self.view[:pending] = self.buffer[self.start:self.end]
+            self.scan -= self.start
+            self.end = pending
+            self.stamps = [(end - self.start, received)
+                           for end, received in self.stamps]
+            self.start = 0
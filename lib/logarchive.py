@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+"""
+Compressed archives of IRC logs.
+
+The current log of a channel (<channel>.log) is the hot segment: LogWriter
+appends to it uncompressed. When it is rotated, it is sealed into the
+channel's archive (<channel>.logz), and the rotated file is removed.
+
+An archive is a sequence of independent blocks. Each block is a fixed size
+header followed by its compressed lines:
+    magic (8 bytes), oldest and newest timestamp of the block (int64),
+    number of lines (uint32), compression and flags (uint8), uncompressed
+    size and compressed size (uint64), all little endian.
+Headers are read without decompressing anything, so readers skip the
+blocks outside of the time range they want. Blocks are only appended to an
+archive. The blocks of each sealed log file are followed by a source block,
+with the FLAG_SOURCE and FLAG_END flags: its uncompressed data is the name,
+size and modification time of the log file, one per line. Blocks after the
+last FLAG_END were left by a crash while sealing, they are ignored by
+readers and removed when the next log file is sealed. A log file whose
+source block is in the archive was sealed, but the process stopped before
+removing it: it isn't sealed again.
+
+Timestamps are in the unit of lib.logindex.parse_timestamp.
+"""
+
+import argparse
+import glob
+import gzip
+import lzma
+import os
+import os.path
+import struct
+import sys
+import time
+import zlib
+from collections import deque, namedtuple
+from lib.logindex import TIMESTAMP_FORMAT, LogIndex, TimestampCache, \
+    parse_time_arg
+from lib.twitchparser1 import TwitchParser1
+
+MAGIC = b'PBTVLOG1'
+HEADER = struct.Struct('<8sqqIBBQQ')
+COMPRESSIONS = {'lzma': 1, 'gzip': 2}
+FLAG_END = 1  # Last block of a sealed log file
+FLAG_SOURCE = 2  # Block describing the sealed log file, without lines
+BLOCK_SIZE = 4 * 1024 * 1024  # Uncompressed bytes per block
+READ_SIZE = 65536
+
+
+class Block(namedtuple('Block', 'offset first_time last_time line_count '
+                       'compression flags raw_size size')):
+    """
+    Header of an archive block. offset is the position of the compressed
+    data in the archive.
+    """
+    __slots__ = ()
+
+
+def archive_path(folder, channel):
+    """
+    Get the path of a channel's archive.
+    """
+    return os.path.join(folder, channel + '.logz')
+
+
+def read_blocks(path):
+    """
+    Read the headers of the complete blocks of an archive.
+
+    Returns:
+        A list of Block.
+    """
+    blocks = []
+    sealing = []  # Blocks of a log file that isn't completely sealed
+    try:
+        archive = open(path, 'rb')
+    except FileNotFoundError:
+        return blocks
+    with archive:
+        end = os.fstat(archive.fileno()).st_size
+        offset = 0
+        while offset + HEADER.size <= end:
+            archive.seek(offset)
+            magic, *fields = HEADER.unpack(archive.read(HEADER.size))
+            block = Block(offset + HEADER.size, *fields)
+            if magic != MAGIC or block.offset + block.size > end:
+                break
+            sealing.append(block)
+            if block.flags & FLAG_END:
+                blocks += sealing
+                sealing = []
+            offset = block.offset + block.size
+    return blocks
+
+
+def read_sources(path, blocks=None):
+    """
+    Read the log files sealed into an archive, from its source blocks.
+
+    Args:
+        path: Path to the archive.
+        blocks: The blocks of the archive, or None to read them.
+
+    Returns:
+        A set of (file name, size, modification time in ns) tuples.
+    """
+    if blocks is None:
+        blocks = read_blocks(path)
+    sources = set()
+    source_blocks = [block for block in blocks if block.flags & FLAG_SOURCE]
+    if not source_blocks:
+        return sources
+    with open(path, 'rb') as archive:
+        for block in source_blocks:
+            archive.seek(block.offset)
+            fields = str(archive.read(block.size), 'utf-8').split('\n')
+            if len(fields) == 3:
+                sources.add((fields[0], int(fields[1]), int(fields[2])))
+    return sources
+
+
+def seal(log_path, path, compression='lzma', block_size=BLOCK_SIZE):
+    """
+    Append the lines of a log file to an archive, as compressed blocks of
+    at most block_size bytes (or one line if it is longer), followed by its
+    source block. The archive is synced to the disk before returning. The
+    log file is not modified. If the log file is already in the archive,
+    e.g. when the process stopped before removing it, nothing is appended.
+
+    Args:
+        log_path: Path to the log file.
+        path: Path to the archive, created if needed.
+        compression: 'lzma' or 'gzip'.
+        block_size: Maximum uncompressed size of a block.
+
+    Returns:
+        A (number of blocks, number of lines) tuple, not counting the source
+        block. (0, 0) if the log file was already sealed.
+    """
+    compression_id = COMPRESSIONS[compression]
+    blocks = read_blocks(path)
+    valid_size = blocks[-1].offset + blocks[-1].size if blocks else 0
+    block_count = 0
+    line_count = 0
+    stat = os.stat(log_path)
+    source = (os.path.basename(log_path), stat.st_size, stat.st_mtime_ns)
+    if source in read_sources(path, blocks):
+        return block_count, line_count
+    with open(log_path, 'rb') as log_file, open(path, 'ab') as archive:
+        # Remove the blocks left by a crash
+        archive.truncate(valid_size)
+        lines = []
+        size = 0
+        for line in log_file:
+            if not line.endswith(b'\n'):
+                line += b'\r\n'
+            if lines and size + len(line) > block_size:
+                _write_block(archive, lines, size, compression_id, 0)
+                block_count += 1
+                line_count += len(lines)
+                lines = []
+                size = 0
+            lines.append(line)
+            size += len(line)
+        if lines:
+            _write_block(archive, lines, size, compression_id, 0)
+            block_count += 1
+            line_count += len(lines)
+        data = '{0}\n{1}\n{2}'.format(*source).encode('utf-8')
+        archive.write(HEADER.pack(
+            MAGIC, 0, 0, 0, 0, FLAG_SOURCE | FLAG_END, len(data), len(data)))
+        archive.write(data)
+        archive.flush()
+        os.fsync(archive.fileno())
+    return block_count, line_count
+
+
+def _write_block(archive, lines, size, compression_id, flags):
+    """
+    Compress a list of lines and append them to an archive.
+    """
+    first_time = None
+    last_time = None
+    parse_timestamp = TimestampCache().parse
+    for line in lines:
+        seconds = parse_timestamp(str(line[:20], 'ascii', 'replace'))
+        if seconds is not None:
+            if first_time is None or seconds < first_time:
+                first_time = seconds
+            if last_time is None or seconds > last_time:
+                last_time = seconds
+    data = b''.join(lines)
+    if compression_id == COMPRESSIONS['lzma']:
+        compressed = lzma.compress(data)
+    else:
+        compressed = gzip.compress(data)
+    archive.write(HEADER.pack(
+        MAGIC, first_time or 0, last_time or 0, len(lines), compression_id,
+        flags, size, len(compressed)))
+    archive.write(compressed)
+
+
+def read_archive(path, since=None, until=None):
+    """
+    Read the lines of an archive, decompressing one block at a time.
+
+    Args:
+        path: Path to the archive.
+        since: Minimum timestamp, or None.
+        until: Maximum timestamp, or None.
+
+    Yields:
+        (timestamp, line) tuples, where line is the log line without its
+        timestamp.
+    """
+    blocks = read_blocks(path)
+    if not blocks:
+        return
+    parse_timestamp = TimestampCache().parse
+    with open(path, 'rb') as archive:
+        for block in blocks:
+            if block.flags & FLAG_SOURCE:
+                continue
+            if (since is not None and block.last_time < since) or \
+                    (until is not None and block.first_time > until):
+                continue
+            # Only the lines of blocks crossing the limits are checked
+            check = (since is not None and block.first_time < since) or \
+                (until is not None and block.last_time > until)
+            for line in _read_block(archive, block):
+                yield from _filter_line(line, since if check else None,
+                                        until if check else None,
+                                        parse_timestamp)
+
+
+def search_archive(path, username=None, since=None, until=None, text=None,
+                   limit=None):
+    """
+    Search the lines of an archive, with the same criteria as
+    lib.logindex.LogIndex.search. Archives have no index: the blocks in the
+    time range are decompressed, and their lines are parsed and checked.
+
+    Returns:
+        Same as LogIndex.search.
+    """
+    parse_message = TwitchParser1().parse_message
+    token_findall = LogIndex.token_re.findall
+    tokens = set(token_findall((text or '').lower()))
+    if username is not None:
+        username = username.lower()
+    results = deque(maxlen=limit)
+    for timestamp, msg in read_archive(path, since, until):
+        if username is not None or tokens:
+            event = parse_message(msg)
+            if username is not None and \
+                    getattr(event, 'username', None) != username:
+                continue
+            message = getattr(event, 'message', None)
+            if tokens and (message is None or not tokens.issubset(
+                    token_findall(message.lower()))):
+                continue
+        results.append((timestamp, msg))
+    return list(results)
+
+
+def _read_block(archive, block):
+    """
+    Decompress the lines of a block, a chunk at a time.
+
+    Yields:
+        Lines of the block, as bytes.
+    """
+    if block.compression == COMPRESSIONS['lzma']:
+        decompressor = lzma.LZMADecompressor()
+    else:
+        decompressor = zlib.decompressobj(wbits=31)
+    archive.seek(block.offset)
+    remaining = block.size
+    rest = b''
+    while remaining > 0:
+        chunk = archive.read(min(READ_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        lines = (rest + decompressor.decompress(chunk)).split(b'\n')
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def read_log(log_path, since=None, until=None):
+    """
+    Read the lines of an uncompressed log file.
+
+    Yields:
+        Same as read_archive.
+    """
+    try:
+        log_file = open(log_path, 'rb')
+    except FileNotFoundError:
+        return
+    parse_timestamp = TimestampCache().parse
+    with log_file:
+        for line in log_file:
+            yield from _filter_line(line.rstrip(b'\n'), since, until,
+                                    parse_timestamp)
+
+
+def _filter_line(line, since, until, parse_timestamp):
+    """
+    Split a log line, and check its timestamp against the limits if there
+    are some. Lines with an invalid timestamp are only kept without limits.
+    """
+    line = str(line, 'utf-8', 'replace').rstrip('\r')
+    timestamp, _, msg = line.partition(' : ')
+    if since is not None or until is not None:
+        seconds = parse_timestamp(timestamp)
+        if seconds is None or (since is not None and seconds < since) or \
+                (until is not None and seconds > until):
+            return
+    yield (timestamp, msg)
+
+
+def rotated_logs(folder, channel):
+    """
+    Get the rotated log files of a channel that aren't archived yet, oldest
+    first.
+    """
+    pattern = os.path.join(glob.escape(folder),
+                           glob.escape(channel) + '.*.log')
+    return sorted(glob.glob(pattern))
+
+
+def read_channel(folder, channel, since=None, until=None):
+    """
+    Read all the logs of a channel in order: its archive, its rotated log
+    files and its current log file.
+
+    Args:
+        folder: Folder of the logs, see the log_folder option.
+        channel: Channel, including the '#'.
+        since: Minimum timestamp, or None.
+        until: Maximum timestamp, or None.
+
+    Yields:
+        Same as read_archive.
+    """
+    yield from read_archive(archive_path(folder, channel), since, until)
+    for log_path in rotated_logs(folder, channel):
+        yield from read_log(log_path, since, until)
+    yield from read_log(os.path.join(folder, channel + '.log'), since, until)
+
+
+def convert(log_path, folder=None, compression='lzma', keep=False):
+    """
+    Seal an existing log file into the archive of its channel, then remove
+    it once the archive is synced to the disk. The channel is the start of
+    the file name, up to the first '.'. A log file already in the archive
+    is only removed.
+
+    Args:
+        log_path: Path to the log file.
+        folder: Folder of the archive, or None for the folder of the log.
+        compression: 'lzma' or 'gzip'.
+        keep: Don't remove the log file.
+
+    Returns:
+        Same as seal.
+    """
+    if folder is None:
+        folder = os.path.dirname(log_path)
+    channel = os.path.basename(log_path).split('.', 1)[0]
+    result = seal(log_path, archive_path(folder, channel), compression)
+    if not keep:
+        os.remove(log_path)
+        # The search index of the log is useless without it
+        if os.path.isfile(log_path + '.idx'):
+            os.remove(log_path + '.idx')
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Compressed archives of the IRC logs.')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    convert_parser = commands.add_parser(
+        'convert', help='move log files to the archives of their channels')
+    convert_parser.add_argument(
+        'logs', nargs='+', help='log files, oldest first for each channel')
+    convert_parser.add_argument(
+        '-c', '--compression', choices=sorted(COMPRESSIONS),
+        default='lzma', help='compression of the blocks (default: lzma)')
+    convert_parser.add_argument('--keep', action='store_true',
+                                help="don't remove the log files")
+    read_parser = commands.add_parser(
+        'read', help='print the logs of a channel, archived or not')
+    read_parser.add_argument('channel', help="channel, including the '#'")
+    read_parser.add_argument(
+        '-f', '--folder', default='irc_logs',
+        help='folder of the logs (default: irc_logs)')
+    read_parser.add_argument(
+        '-s', '--since', type=parse_time_arg,
+        help='oldest time, ex: 2015-01-31, 2015-01-31T20:00:00Z, 12h, 7d')
+    read_parser.add_argument('--until', type=parse_time_arg,
+                             help='newest time, same format as --since')
+    info_parser = commands.add_parser(
+        'info', help='show the blocks of an archive')
+    info_parser.add_argument('archive', help='path to the archive')
+    args = arg_parser.parse_args()
+    if args.command == 'convert':
+        for log_path in args.logs:
+            blocks, lines = convert(log_path, compression=args.compression,
+                                    keep=args.keep)
+            print('{0}: {1} lines in {2} blocks'.format(
+                log_path, lines, blocks))
+    elif args.command == 'read':
+        for timestamp, line in read_channel(
+                args.folder, args.channel, args.since, args.until):
+            sys.stdout.write('{0} : {1}\n'.format(timestamp, line))
+    else:
+        names = {value: key for key, value in COMPRESSIONS.items()}
+        blocks = read_blocks(args.archive)
+        sources = sorted(read_sources(args.archive, blocks))
+        for block in blocks:
+            if block.flags & FLAG_SOURCE:
+                continue
+            print('{0}: {1} lines, {2} -> {3} bytes ({4}), {5} - {6}'.format(
+                block.offset - HEADER.size, block.line_count, block.raw_size,
+                block.size, names.get(block.compression, '?'),
+                time.strftime(TIMESTAMP_FORMAT, time.gmtime(block.first_time)),
+                time.strftime(TIMESTAMP_FORMAT, time.gmtime(block.last_time))))
+        for name, size, _ in sources:
+            print('sealed {0} ({1} bytes)'.format(name, size))
+
+if __name__ == '__main__':
+    main()
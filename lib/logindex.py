@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import argparse
+import calendar
+import glob
+import logging
+import mmap
+import os
+import os.path
+import re
+import sqlite3
+import sys
+import time
+from lib.twitchparser1 import TwitchParser1
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+BUCKET_SIZE = 3600  # Seconds per timestamp bucket
+INSERT_CHUNK = 10000  # Lines inserted per transaction
+
+
+def parse_timestamp(timestamp):
+    """
+    Convert a log timestamp to a number of seconds. Log timestamps are in
+    local time, so the result is only meaningful when compared with other
+    log timestamps, or with now().
+
+    Returns:
+        An int, or None if the timestamp is invalid.
+    """
+    try:
+        return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+    except ValueError:
+        return None
+
+
+def now():
+    """
+    Get the current time, in the same unit as parse_timestamp.
+    """
+    return calendar.timegm(time.localtime())
+
+
+def parse_time_arg(value):
+    """
+    Convert a time given on the command line to a number of seconds. The
+    time is either a log timestamp (2015-01-31T20:00:00Z), a date
+    (2015-01-31) or a duration before now (30m, 12h, 7d).
+    """
+    match = re.match(r'\A(\d+)([smhdw])\Z', value)
+    if match:
+        units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+        return now() - int(match.group(1)) * units[match.group(2)]
+    timestamp = parse_timestamp(value)
+    if timestamp is None:
+        timestamp = parse_timestamp(value + 'T00:00:00Z')
+    if timestamp is None:
+        raise ValueError('Invalid time: {0}'.format(value))
+    return timestamp
+
+
+class TimestampCache:
+    def __init__(self):
+        """
+        This class converts log timestamps like parse_timestamp, faster on
+        consecutive lines: strptime is only called once per hour of log.
+        """
+        self.hours = {}  # Timestamp up to the hour -> seconds
+
+    def parse(self, timestamp):
+        """
+        Same as parse_timestamp.
+        """
+        hour = self.hours.get(timestamp[:14])
+        if hour is None:
+            hour = parse_timestamp(timestamp[:14] + '00:00Z')
+            if hour is None:
+                return None
+            self.hours[timestamp[:14]] = hour
+        minutes = timestamp[14:16]
+        seconds = timestamp[17:19]
+        if len(timestamp) != 20 or not (minutes + seconds).isdigit():
+            return parse_timestamp(timestamp)
+        return hour + int(minutes) * 60 + int(seconds)
+
+
+class LogIndex:
+    token_re = re.compile(r'\w+')
+
+    def __init__(self, log_path, index_path=None):
+        """
+        This class indexes an IRC log file written by LogWriter, and searches
+        it.
+
+        The index is a sqlite database next to the log ('<log>.idx'). It
+        keeps the offset of every line with its timestamp bucket, timestamp
+        and username, and the offsets of the lines containing each word of
+        the messages. The index is updated incrementally: update indexes the
+        lines appended to the log since the last update. LogWriter calls it
+        from a background thread after writing lines, so searches don't
+        index anything. If the log was rotated or truncated, update rebuilds
+        the index.
+
+        Lines found by a search are read from the log through mmap, so only
+        the pages holding them are read from the disk.
+
+        Args:
+            log_path: Path to the log file.
+            index_path: Path to the index, or None for '<log_path>.idx'.
+        """
+        self.log_path = log_path
+        self.index_path = index_path or '{0}.idx'.format(log_path)
+        self.parser = TwitchParser1()
+        self.timestamps = TimestampCache()
+        self.db = sqlite3.connect(self.index_path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value);
+            CREATE TABLE IF NOT EXISTS lines (
+                offset INTEGER PRIMARY KEY, bucket INTEGER,
+                time INTEGER, username TEXT);
+            CREATE INDEX IF NOT EXISTS lines_bucket ON lines (bucket);
+            CREATE INDEX IF NOT EXISTS lines_username
+                ON lines (username, bucket);
+            CREATE TABLE IF NOT EXISTS tokens (
+                token TEXT, offset INTEGER, PRIMARY KEY (token, offset))
+                WITHOUT ROWID;
+            """)
+
+    def close(self):
+        self.db.close()
+
+    def is_stale(self):
+        """
+        Check if the index doesn't match its log anymore, e.g. if the log
+        was rotated since the last update. Stale indexes are rebuilt by
+        update, and can't be searched before.
+        """
+        try:
+            with open(self.log_path, 'rb') as log_file:
+                size = os.fstat(log_file.fileno()).st_size
+                head = log_file.read(256)
+        except FileNotFoundError:
+            return True
+        indexed_head = self._get_meta('head', b'')
+        return size < self._get_meta('indexed_size', 0) or \
+            head[:len(indexed_head)] != indexed_head
+
+    def update(self):
+        """
+        Index the lines appended to the log since the last update.
+
+        Returns:
+            The number of lines indexed.
+        """
+        try:
+            log_file = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            self._clear()
+            return 0
+        with log_file:
+            size = os.fstat(log_file.fileno()).st_size
+            head = log_file.read(256)
+            indexed_size = self._get_meta('indexed_size', 0)
+            indexed_head = self._get_meta('head', b'')
+            if size < indexed_size or \
+                    head[:len(indexed_head)] != indexed_head:
+                # The log was rotated or truncated
+                self._clear()
+                indexed_size = 0
+            if size == indexed_size or size == 0:
+                return 0
+            with mmap.mmap(log_file.fileno(), size,
+                           access=mmap.ACCESS_READ) as data:
+                count = self._index(data, indexed_size)
+            self._set_meta('head', head)
+            self.db.commit()
+        return count
+
+    def search(self, username=None, since=None, until=None, text=None,
+               limit=None):
+        """
+        Search the indexed lines of the log. All the given criteria must
+        match. Lines that weren't indexed yet aren't found, and nothing is
+        found if the index is stale.
+
+        Args:
+            username: Name of the user who sent the line.
+            since: Minimum timestamp, see parse_timestamp.
+            until: Maximum timestamp, see parse_timestamp.
+            text: Words that must all be in the message, ignoring case.
+            limit: Maximum number of lines, the last ones are returned.
+
+        Returns:
+            A list of (timestamp, line) tuples in the order of the log, where
+            line is the log line without its timestamp.
+        """
+        if self.is_stale():
+            return []
+        conditions = []
+        params = []
+        if username is not None:
+            conditions.append('username = ?')
+            params.append(username.lower())
+        if since is not None:
+            conditions.append('bucket >= ? AND time >= ?')
+            params += [since // BUCKET_SIZE, since]
+        if until is not None:
+            conditions.append('bucket <= ? AND time <= ?')
+            params += [until // BUCKET_SIZE, until]
+        for token in set(self.token_re.findall((text or '').lower())):
+            conditions.append(
+                'offset IN (SELECT offset FROM tokens WHERE token = ?)')
+            params.append(token)
+        query = 'SELECT offset FROM lines'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY offset DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        offsets = [row[0] for row in self.db.execute(query, params)]
+        offsets.reverse()
+        if not offsets:
+            return []
+        results = []
+        with open(self.log_path, 'rb') as log_file:
+            size = self._get_meta('indexed_size', 0)
+            with mmap.mmap(log_file.fileno(), size,
+                           access=mmap.ACCESS_READ) as data:
+                for offset in offsets:
+                    end = data.find(b'\n', offset)
+                    if end == -1:
+                        end = size
+                    line = str(data[offset:end], 'utf-8', 'replace')
+                    timestamp, _, msg = line.rstrip('\r').partition(' : ')
+                    results.append((timestamp, msg))
+        return results
+
+    def _index(self, data, start):
+        """
+        Index the complete lines of the log from an offset, and save the
+        offset of the first line that wasn't indexed.
+        """
+        parse_message = self.parser.parse_message
+        parse_timestamp = self.timestamps.parse
+        token_findall = self.token_re.findall
+        lines = []
+        tokens = []
+        count = 0
+        offset = start
+        end = data.rfind(b'\n', start) + 1
+        while offset < end:
+            line_end = data.find(b'\n', offset)
+            line = str(data[offset:line_end], 'utf-8', 'replace')
+            timestamp, _, msg = line.rstrip('\r').partition(' : ')
+            seconds = parse_timestamp(timestamp)
+            if seconds is not None:
+                event = parse_message(msg)
+                username = getattr(event, 'username', None)
+                lines.append((offset, seconds // BUCKET_SIZE, seconds,
+                              username))
+                message = getattr(event, 'message', None)
+                if message is not None:
+                    for token in set(token_findall(message.lower())):
+                        tokens.append((token, offset))
+            offset = line_end + 1
+            if len(lines) >= INSERT_CHUNK or offset >= end:
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?)', lines)
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO tokens VALUES (?, ?)', tokens)
+                self._set_meta('indexed_size', offset)
+                self.db.commit()
+                count += len(lines)
+                lines = []
+                tokens = []
+        return count
+
+    def _clear(self):
+        self.db.execute('DELETE FROM lines')
+        self.db.execute('DELETE FROM tokens')
+        self.db.execute('DELETE FROM meta')
+        self.db.commit()
+
+    def _get_meta(self, key, default):
+        row = self.db.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        self.db.execute(
+            'INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+
+def search_logs(log_paths, username=None, since=None, until=None, text=None,
+                limit=None):
+    """
+    Search several log files. Stale indexes are skipped with a warning,
+    they must be rebuilt with LogIndex.update first. Archives (.logz files)
+    are searched without an index, see lib.logarchive.search_archive. See
+    LogIndex.search for the arguments.
+
+    Returns:
+        A list of (log path, timestamp, line) tuples, ordered by timestamp.
+    """
+    # Imported here, lib.logarchive imports this module
+    from lib.logarchive import search_archive
+    results = []
+    for log_path in log_paths:
+        if not os.path.isfile(log_path):
+            continue
+        if log_path.endswith('.logz'):
+            for timestamp, line in search_archive(
+                    log_path, username, since, until, text, limit):
+                results.append((log_path, timestamp, line))
+            continue
+        index = LogIndex(log_path)
+        try:
+            if index.is_stale():
+                logging.warning('LogIndex: the index of {0} is out of date, '
+                                'update it with --update'.format(log_path))
+                continue
+            for timestamp, line in index.search(
+                    username, since, until, text, limit):
+                results.append((log_path, timestamp, line))
+        finally:
+            index.close()
+    results.sort(key=lambda x: x[1])
+    if limit is not None:
+        results = results[-limit:]
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Search the IRC logs and their archives. The logs are '
+        'indexed as they are written, use --update to index other logs.')
+    arg_parser.add_argument(
+        'logs', nargs='*', default=['irc_logs'],
+        help='log files, archives or folders of them (default: irc_logs)')
+    arg_parser.add_argument('-u', '--user', help='name of the user')
+    arg_parser.add_argument(
+        '-s', '--since', type=parse_time_arg,
+        help='oldest time, ex: 2015-01-31, 2015-01-31T20:00:00Z, 12h, 7d')
+    arg_parser.add_argument('--until', type=parse_time_arg,
+                            help='newest time, same format as --since')
+    arg_parser.add_argument('-t', '--text',
+                            help='words that must be in the message')
+    arg_parser.add_argument('-n', '--limit', type=int,
+                            help='only show the last LIMIT lines')
+    arg_parser.add_argument(
+        '--update', action='store_true',
+        help='only index the lines missing from the indexes, rebuilding '
+        'the out of date indexes')
+    args = arg_parser.parse_args()
+    log_paths = []
+    for path in args.logs:
+        if os.path.isdir(path):
+            log_paths += sorted(glob.glob(os.path.join(path, '*.log')))
+            log_paths += sorted(glob.glob(os.path.join(path, '*.logz')))
+        else:
+            log_paths.append(path)
+    if args.update:
+        for log_path in log_paths:
+            if log_path.endswith('.logz'):
+                continue
+            index = LogIndex(log_path)
+            count = index.update()
+            index.close()
+            print('{0}: {1} new lines indexed'.format(log_path, count))
+        return
+    results = search_logs(log_paths, args.user, args.since, args.until,
+                          args.text, args.limit)
+    for log_path, timestamp, line in results:
+        if len(log_paths) > 1:
+            sys.stdout.write('{0}: '.format(os.path.basename(log_path)))
+        sys.stdout.write('{0} : {1}\n'.format(timestamp, line))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import atexit
+import glob
+import logging
+import os
+import os.path
+import queue
+import sqlite3
+import threading
+import time
+from lib import logarchive, logindex, metrics
+
+# Time to wait for the file being compressed, and for the indexing of the
+# last lines, when the writer is closed
+JOIN_TIMEOUT = 10
+# Time before trying again to rotate a log file that couldn't be renamed
+ROTATE_RETRY_DELAY = 60
+
+
+class LogWriter:
+    def __init__(self, config):
+        """
+        Write IRC chat logs from a background thread.
+
+        Lines are put in a bounded in-memory buffer and written to disk by a
+        dedicated thread, so the thread receiving IRC messages never waits on
+        disk. Pending lines are flushed when enough data is buffered or when
+        the flush interval expires. Log files are rotated daily and/or when
+        they grow past a maximum size. Rotated log files are compressed
+        into the archive of their channel by another thread, see
+        logarchive.py. A third thread indexes the lines after they are
+        written, so that the logs can be searched at once, see
+        logindex.py.
+
+        Args:
+            config: config object. See config.py and config.yaml.
+        """
+        self.config = config
+        self.folder = config['irc']['log_folder']
+        self.flush_size = config['irc']['log_flush_size']
+        self.flush_interval = config['irc']['log_flush_interval']
+        self.rotate_daily = config['irc']['log_rotate_daily']
+        self.max_size = config['irc']['log_max_size']
+        self.fsync = config['irc']['log_fsync']
+        self.archive = config['irc']['log_archive']
+        self.index = config['irc']['log_index']
+        self.queue = queue.Queue(maxsize=config['irc']['log_buffer_size'])
+        self.dropped = 0
+        self.files = {}  # channel -> [file, size, date]
+        self.pending = {}  # channel -> list of encoded lines
+        self.pending_size = 0
+        self.rotate_retry = {}  # channel -> time of the next rotation try
+        self.dropped_metric = metrics.counter(
+            'log_lines_dropped_total',
+            'Log lines dropped because the buffer was full')
+        self.dropped_source = self.dropped_metric.add_source(
+            lambda: self.dropped)
+        self.seal_queue = queue.Queue()
+        self.seal_thread = None
+        self.index_queue = queue.Queue()
+        self.index_thread = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        if self.archive != 'none':
+            # Rotated files left by a previous run
+            for path in sorted(glob.glob(os.path.join(
+                    glob.escape(self.folder), '*.*.log'))):
+                self._seal(path)
+        # Only start writing once all the attributes exist: the writer
+        # thread uses the seal thread when it rotates a file
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, channel, line):
+        """
+        Queue a line to be written to a channel's log file. This function
+        never blocks: if the buffer is full, the line is dropped.
+
+        Args:
+            channel: Channel the line belongs to, including the '#'.
+            line: Line to write, including the line terminator.
+        """
+        try:
+            self.queue.put_nowait((channel, line))
+        except queue.Full:
+            if self.dropped % 1000 == 0:
+                logging.warning(
+                    'LogWriter: buffer full, {0} lines dropped so far'
+                    .format(self.dropped + 1))
+            self.dropped += 1
+
+    def close(self):
+        """
+        Write all pending lines to disk and stop the writer thread. Rotated
+        files that aren't compressed yet are left as is, they are compressed
+        at the next start. The file being compressed and the indexing of
+        the last lines are finished, waiting at most JOIN_TIMEOUT seconds
+        for each.
+        """
+        atexit.unregister(self.close)
+        if self.dropped_source is not None:
+            self.dropped_metric.remove_source(self.dropped_source)
+            self.dropped_source = None
+        if self.thread.is_alive():
+            self.queue.put((None, None))
+            self.thread.join()
+        # The last flush can rotate a file, stop the seal thread after it
+        if self.seal_thread is not None:
+            # Only finish the file being compressed
+            while True:
+                try:
+                    self.seal_queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.seal_queue.put(None)
+            self.seal_thread.join(JOIN_TIMEOUT)
+            if self.seal_thread.is_alive():
+                logging.warning('LogWriter: exiting before the end of the '
+                                'compression of a rotated log')
+        if self.index_thread is not None:
+            self.index_queue.put(None)
+            self.index_thread.join(JOIN_TIMEOUT)
+            if self.index_thread.is_alive():
+                logging.warning('LogWriter: exiting before the end of the '
+                                'indexing of the logs')
+
+    def run(self):
+        """
+        Main loop of the writer thread. Waits for lines and writes them to
+        disk when a flush is due.
+        """
+        deadline = None
+        while True:
+            timeout = None if deadline is None else \
+                max(0, deadline - time.monotonic())
+            try:
+                channel, line = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                deadline = None
+                continue
+            if channel is None:
+                self._flush()
+                self._close_files()
+                return
+            data = line.encode('utf-8')
+            self.pending.setdefault(channel, []).append(data)
+            self.pending_size += len(data)
+            if self.pending_size >= self.flush_size:
+                self._flush()
+                deadline = None
+            elif deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self):
+        """
+        Write all pending lines to their log files.
+        """
+        for channel, lines in self.pending.items():
+            try:
+                log_file = self._get_file(channel)
+                data = b''.join(lines)
+                log_file[0].write(data)
+                log_file[0].flush()
+                log_file[1] += len(data)
+                if self.fsync == 'flush':
+                    os.fsync(log_file[0].fileno())
+            except OSError as e:
+                logging.error('LogWriter: failed to write log for {0}: {1}'
+                              .format(channel, e))
+            if self.index:
+                self._update_index(channel)
+        self.pending = {}
+        self.pending_size = 0
+
+    def _get_file(self, channel):
+        """
+        Get the open log file of a channel, rotating it if needed. If the
+        file can't be rotated (e.g. it is open in another program on
+        Windows), lines are still appended to it, and the rotation is tried
+        again after ROTATE_RETRY_DELAY seconds.
+
+        Returns:
+            A list [file, size, date] describing the open log file.
+        """
+        today = time.strftime('%Y-%m-%d')
+        log_file = self.files.get(channel)
+        if log_file is None:
+            log_file = self._open_file(channel, today)
+        if ((self.rotate_daily and log_file[2] != today) or
+                (self.max_size and log_file[1] >= self.max_size)) and \
+                time.monotonic() >= self.rotate_retry.get(channel, 0):
+            self._close_file(channel)
+            if self._rotate(channel):
+                self.rotate_retry.pop(channel, None)
+            else:
+                self.rotate_retry[channel] = \
+                    time.monotonic() + ROTATE_RETRY_DELAY
+            log_file = self._open_file(channel, today)
+        return log_file
+
+    def _open_file(self, channel, today):
+        """
+        Open the log file of a channel for appending.
+
+        Returns:
+            Same as _get_file.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(channel)
+        if os.access(path, os.F_OK):
+            mtime = os.path.getmtime(path)
+            date = time.strftime('%Y-%m-%d', time.localtime(mtime))
+        else:
+            date = today
+        log_file = [open(path, 'ab'), os.path.getsize(path), date]
+        self.files[channel] = log_file
+        return log_file
+
+    def _rotate(self, channel):
+        """
+        Rename a channel's current log file so a new one can be started.
+
+        Returns:
+            True if the file was renamed.
+        """
+        path = self._path(channel)
+        rotated_name = '{0}.{1}'.format(
+            channel, time.strftime('%Y%m%d-%H%M%S'))
+        rotated_path = os.path.join(self.folder, rotated_name + '.log')
+        count = 1
+        while os.access(rotated_path, os.F_OK):
+            rotated_path = os.path.join(
+                self.folder, '{0}-{1}.log'.format(rotated_name, count))
+            count += 1
+        try:
+            os.replace(path, rotated_path)
+            logging.info('LogWriter: rotated {0} to {1}'
+                         .format(path, rotated_path))
+        except OSError as e:
+            logging.error('LogWriter: failed to rotate {0}: {1}'
+                          .format(path, e))
+            return False
+        if self.archive != 'none':
+            self._seal(rotated_path)
+        return True
+
+    def _seal(self, path):
+        """
+        Queue a rotated log file to be compressed into its channel's archive.
+        """
+        if self.seal_thread is None:
+            self.seal_thread = threading.Thread(target=self.run_seal,
+                                                daemon=True)
+            self.seal_thread.start()
+        self.seal_queue.put(path)
+
+    def run_seal(self):
+        """
+        Main loop of the thread compressing rotated log files. Files are
+        compressed one at a time, in the order they were rotated.
+        """
+        while True:
+            path = self.seal_queue.get()
+            if path is None:
+                return
+            try:
+                blocks, lines = logarchive.convert(path,
+                                                   compression=self.archive)
+                logging.info('LogWriter: archived {0} ({1} lines)'
+                             .format(path, lines))
+            except OSError as e:
+                logging.error('LogWriter: failed to archive {0}: {1}'
+                              .format(path, e))
+
+    def _update_index(self, channel):
+        """
+        Queue a channel's log file to have its new lines indexed.
+        """
+        if self.index_thread is None:
+            self.index_thread = threading.Thread(target=self.run_index,
+                                                 daemon=True)
+            self.index_thread.start()
+        self.index_queue.put(channel)
+
+    def run_index(self):
+        """
+        Main loop of the thread indexing the log files. The channels queued
+        while a channel was being indexed are indexed together, once each.
+        The first update of a log that wasn't indexed before indexes the
+        whole log.
+        """
+        indexes = {}  # Channel -> LogIndex
+        try:
+            while True:
+                channels = [self.index_queue.get()]
+                while True:
+                    try:
+                        channels.append(self.index_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for channel in set(channels):
+                    if channel is None:
+                        continue
+                    try:
+                        index = indexes.get(channel)
+                        if index is None:
+                            index = logindex.LogIndex(self._path(channel))
+                            indexes[channel] = index
+                        index.update()
+                    except (OSError, sqlite3.Error) as e:
+                        logging.error(
+                            'LogWriter: failed to index log for {0}: {1}'
+                            .format(channel, e))
+                if None in channels:
+                    return
+        finally:
+            for index in indexes.values():
+                index.close()
+
+    def _close_file(self, channel):
+        log_file = self.files.pop(channel)
+        try:
+            if self.fsync != 'never':
+                os.fsync(log_file[0].fileno())
+        except OSError as e:
+            logging.error('LogWriter: failed to sync log for {0}: {1}'
+                          .format(channel, e))
+        try:
+            log_file[0].close()
+        except OSError as e:
+            logging.error('LogWriter: failed to close log for {0}: {1}'
+                          .format(channel, e))
+
+    def _close_files(self):
+        for channel in list(self.files.keys()):
+            self._close_file(channel)
+
+    def _path(self, channel):
+        return os.path.join(self.folder, channel + '.log')
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+"""
+Performance metrics of the whole process.
+
+Modules create their metrics once from the shared registry, e.g.
+    parsed_lines = metrics.counter('irc_lines_parsed_total', 'Lines parsed')
+and update them on their hot paths with plain attribute updates, so a
+metric costs about as much as an integer addition. Values that are already
+kept elsewhere (queue lengths, statistics of the send scheduler...) are
+added as sources: functions called when the metrics are read. Objects that
+don't live as long as the process remove their sources when they are
+closed, so that they aren't counted twice or kept alive by the registry.
+
+Metrics are not locked: each metric must only be updated by one thread.
+Readers from other threads may see a value that is a few updates late.
+
+The metrics are exported in the Prometheus text format, to a file and/or
+on a localhost HTTP endpoint, see start_exporter.
+"""
+
+import bisect
+import http.server
+import logging
+import os
+import threading
+import time
+
+PREFIX = 'pybottv_'
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        """
+        A value that only increases, e.g. a number of lines received.
+        Update it with 'counter.value += n'.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self.sources = []
+
+    def add_source(self, func):
+        """
+        Add a function returning a value to add to this metric when it is
+        read.
+
+        Returns:
+            The function, to give to remove_source.
+        """
+        self.sources.append(func)
+        return func
+
+    def remove_source(self, func):
+        """
+        Remove a source added with add_source. The last value of the source
+        is added to the counter, so that it doesn't go down.
+        """
+        self.sources.remove(func)
+        self.value += func()
+
+    def get(self):
+        return self.value + sum(func() for func in self.sources)
+
+    def format_text(self, kind='counter'):
+        return '# HELP {0} {1}\n# TYPE {0} {2}\n{0} {3}\n'.format(
+            self.name, self.help_text, kind, _format_value(self.get()))
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, e.g. a queue length. Set it with
+    'gauge.value = x', or add sources.
+    """
+    def remove_source(self, func):
+        """
+        Remove a source added with add_source.
+        """
+        self.sources.remove(func)
+
+    def format_text(self):
+        return super().format_text('gauge')
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        """
+        A distribution of values, e.g. durations in seconds. Add values with
+        observe.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get(self):
+        return self.count
+
+    def format_text(self):
+        lines = ['# HELP {0} {1}\n# TYPE {0} histogram\n'.format(
+            self.name, self.help_text)]
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append('{0}_bucket{{le="{1}"}} {2}\n'.format(
+                self.name, bound, total))
+        lines.append('{0}_sum {1}\n{0}_count {2}\n'.format(
+            self.name, _format_value(self.sum), self.count))
+        return ''.join(lines)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Registry:
+    def __init__(self):
+        """
+        This class keeps the metrics of the process by name. Asking for a
+        metric that already exists returns it, so modules that are created
+        several times share their metrics.
+        """
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets)
+
+    def get(self, name):
+        """
+        Get a metric by name, without the prefix.
+
+        Returns:
+            The metric, or None if it doesn't exist.
+        """
+        return self.metrics.get(PREFIX + name)
+
+    def format_text(self):
+        """
+        Get all the metrics in the Prometheus text format.
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        return ''.join(metric.format_text() for _, metric in metrics)
+
+    def _get(self, cls, name, help_text, *args):
+        with self.lock:
+            metric = self.metrics.get(PREFIX + name)
+            if metric is None:
+                metric = cls(PREFIX + name, help_text, *args)
+                self.metrics[metric.name] = metric
+            return metric
+
+
+# Registry shared by the whole process
+registry = Registry()
+
+
+def counter(name, help_text):
+    """
+    Get a counter from the process-wide registry, creating it if needed.
+    """
+    return registry.counter(name, help_text)
+
+
+def gauge(name, help_text):
+    """
+    Get a gauge from the process-wide registry, creating it if needed.
+    """
+    return registry.gauge(name, help_text)
+
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """
+    Get a histogram from the process-wide registry, creating it if needed.
+    """
+    return registry.histogram(name, help_text, buckets)
+
+
+class Sampler:
+    def __init__(self, registry=registry):
+        """
+        This class computes rates and averages of metrics between two calls
+        of sample, e.g. for a readout refreshed every second.
+        """
+        self.registry = registry
+        self.previous = {}  # Name -> (value, sum)
+        self.current = {}
+        self.elapsed = 0
+        self.last_time = None
+
+    def sample(self):
+        """
+        Read the metrics. Rates and averages are computed since the previous
+        call.
+        """
+        now = time.monotonic()
+        if self.last_time is not None:
+            self.elapsed = now - self.last_time
+        self.last_time = now
+        self.previous = self.current
+        self.current = {}
+        with self.registry.lock:
+            metrics = list(self.registry.metrics.values())
+        for metric in metrics:
+            self.current[metric.name] = (
+                metric.get(), getattr(metric, 'sum', 0))
+
+    def value(self, name):
+        """
+        Get the value of a metric, or 0 if it doesn't exist.
+        """
+        return self.current.get(PREFIX + name, (0, 0))[0]
+
+    def delta(self, name):
+        """
+        Get the change of a metric since the previous sample.
+        """
+        current = self.current.get(PREFIX + name, (0, 0))[0]
+        previous = self.previous.get(PREFIX + name, (current, 0))[0]
+        return current - previous
+
+    def rate(self, name):
+        """
+        Get the change of a metric per second since the previous sample.
+        """
+        if self.elapsed <= 0:
+            return 0
+        return self.delta(name) / self.elapsed
+
+    def mean(self, name):
+        """
+        Get the average of the values added to a histogram since the
+        previous sample, or None if there were none.
+        """
+        count, total = self.current.get(PREFIX + name, (0, 0))
+        previous_count, previous_total = self.previous.get(
+            PREFIX + name, (count, total))
+        if count == previous_count:
+            return None
+        return (total - previous_total) / (count - previous_count)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = registry.format_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        return
+
+
+def write_file(path):
+    """
+    Write all the metrics to a file, replacing it at once so that readers
+    never see a partial file.
+    """
+    temp_path = '{0}.tmp'.format(path)
+    with open(temp_path, 'w') as metrics_file:
+        metrics_file.write(registry.format_text())
+    os.replace(temp_path, path)
+
+
+def start_exporter(config):
+    """
+    Start exporting the metrics, as configured by debug.metrics_file,
+    debug.metrics_interval and debug.metrics_port. Exporters run in daemon
+    threads.
+
+    Args:
+        config: config object. See config.py and config.yaml.
+    """
+    path = config['debug']['metrics_file']
+    interval = config['debug']['metrics_interval']
+    port = config['debug']['metrics_port']
+    if path:
+        def write_loop():
+            while True:
+                try:
+                    write_file(path)
+                except OSError as e:
+                    logging.warning('Metrics: failed to write {0}: {1}'
+                                    .format(path, e))
+                time.sleep(interval)
+        threading.Thread(target=write_loop, daemon=True).start()
+    if port:
+        try:
+            server = http.server.HTTPServer(('127.0.0.1', port),
+                                            _MetricsHandler)
+        except OSError as e:
+            logging.warning('Metrics: failed to listen on port {0}: {1}'
+                            .format(port, e))
+            return
+        threading.Thread(target=server.serve_forever, daemon=True).start()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import asyncio
+import logging
+from collections import deque
+from lib import events, metrics
+from lib.irc import IrcError
+
+send_delay = metrics.histogram(
+    'irc_send_delay_seconds',
+    'Time lines waited in the send scheduler before being sent')
+
+# Chat commands (after the '/' or '.') queued in the moderation lane
+MODERATION_COMMANDS = frozenset([
+    'ban', 'unban', 'timeout', 'untimeout', 'clear', 'delete', 'slow',
+    'slowoff', 'followers', 'followersoff', 'subscribers', 'subscribersoff',
+    'emoteonly', 'emoteonlyoff', 'r9kbeta', 'r9kbetaoff', 'uniquechat',
+    'uniquechatoff', 'mod', 'unmod', 'vip', 'unvip'])
+
+
+class SendScheduler:
+    # Lanes, in order of priority
+    LANE_PONG = 0
+    LANE_MODERATION = 1
+    LANE_CHAT = 2
+
+    def __init__(self, config):
+        """
+        This class queues the lines to send to the IRC server and writes them
+        without exceeding the server's rate limits.
+
+        Lines are queued in three lanes: PONG (and other keepalive lines),
+        moderation commands (see MODERATION_COMMANDS) and chat messages,
+        including the other commands like '/me'. Lines are always taken from
+        the lane with the highest priority first. The PONG lane isn't rate
+        limited, the other lanes share a token bucket. All the lines that can
+        be sent at once are written to the connection with a single write.
+
+        The token bucket counts in moderator messages: it holds a quarter of
+        irc.send_rate_moderator tokens, and refills so that no more than
+        irc.send_rate_moderator tokens are used in any irc.send_rate_period.
+        A message costs one token in the channels where the user is a
+        moderator, and more tokens in the other channels so that at most
+        irc.send_rate_normal messages are sent per period.
+
+        Chat messages and moderation commands are limited to
+        irc.send_queue_size: wait_for_space waits until there is room for a
+        new one.
+
+        Args:
+            config: config object. See config.py and config.yaml.
+        """
+        self.config = config
+        rate_moderator = config['irc']['send_rate_moderator']
+        self.capacity = rate_moderator / 4
+        self.refill_rate = (rate_moderator - self.capacity) / \
+            config['irc']['send_rate_period']
+        self.normal_cost = rate_moderator / config['irc']['send_rate_normal']
+        self.tokens = self.capacity
+        self.last_refill = None
+        self.moderator_channels = set()
+        broadcaster_channel = '#{0}'.format(config['irc']['user'].lower())
+        if broadcaster_channel in config['irc']['channels']:
+            self.moderator_channels.add(broadcaster_channel)
+        self.lanes = (deque(), deque(), deque())
+        self.max_messages = config['irc']['send_queue_size']
+        self.wakeup = asyncio.Event()
+        self.space = asyncio.Event()
+        self.throttled = False
+        self.sent = 0
+        self.last_delay = 0
+        self.max_delay = 0
+
+    def put_line(self, line, lane=LANE_PONG, channel=None):
+        """
+        Queue a raw line to send.
+
+        Args:
+            line: Line to send, including the '\\r\\n'.
+            lane: Lane to queue the line in.
+            channel: Channel the line is sent to, or None.
+        """
+        self.lanes[lane].append(
+            (line, channel, asyncio.get_running_loop().time()))
+        self.wakeup.set()
+
+    def put_message(self, channel, text):
+        """
+        Queue a chat message. Moderation commands, e.g. '/timeout user' or
+        '.ban user', are queued in the moderation lane.
+
+        Args:
+            channel: Channel to send the message to, including the '#'.
+            text: Text of the message.
+        """
+        if text[:1] in ('/', '.') and \
+                text[1:].split(' ', 1)[0].lower() in MODERATION_COMMANDS:
+            lane = self.LANE_MODERATION
+        else:
+            lane = self.LANE_CHAT
+        line = 'PRIVMSG {0} : {1}\r\n'.format(channel, text)
+        self.put_line(line, lane, channel)
+
+    def clear(self, lane):
+        """
+        Remove all queued lines from a lane.
+        """
+        self.lanes[lane].clear()
+        self.space.set()
+
+    def depth(self):
+        """
+        Get the number of lines waiting to be sent.
+        """
+        return sum(len(lane) for lane in self.lanes)
+
+    async def wait_for_space(self):
+        """
+        Wait until fewer than irc.send_queue_size chat messages and
+        moderation commands are waiting to be sent.
+        """
+        while len(self.lanes[self.LANE_MODERATION]) + \
+                len(self.lanes[self.LANE_CHAT]) >= self.max_messages:
+            self.space.clear()
+            await self.space.wait()
+
+    def set_moderator(self, channel, moderator):
+        """
+        Set whether the user is a moderator in a channel, which changes the
+        rate limit of the messages sent to that channel.
+        """
+        if moderator:
+            self.moderator_channels.add(channel)
+        else:
+            self.moderator_channels.discard(channel)
+
+    def on_event(self, msg):
+        """
+        Update the user's moderator status from a parsed event.
+
+        Args:
+            msg: The parsed event. See lib.events.
+        """
+        if msg.type in (events.MOD, events.DEMOD) and \
+                msg.username == self.config['irc']['user'].lower():
+            self.set_moderator(msg.channel, msg.type == events.MOD)
+
+    async def run(self, irc_sock):
+        """
+        Write the queued lines to the connection until disconnect.
+
+        Args:
+            irc_sock: The connected AsyncIrc object.
+
+        Raises:
+            IrcError if a write failed.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.depth() == 0:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            lines, wait_time = self._take_lines(loop.time())
+            if not lines:
+                # Rate limited, wait for a token or for a PONG to send
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait_time)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            data = ''.join(line for line, _ in lines)
+            sent_success = await irc_sock.send_message(
+                data, timeout=self.config['irc']['send_timeout'])
+            if not sent_success:
+                logging.warning('IRC: failed to send {0} lines'.format(
+                    len(lines)))
+                raise IrcError('Failed to send messages')
+            self.space.set()
+            now = loop.time()
+            self.sent += len(lines)
+            self.last_delay = now - min(queued for _, queued in lines)
+            self.max_delay = max(self.max_delay, self.last_delay)
+            send_delay.observe(self.last_delay)
+            logging.debug(
+                'IRC: sent {0} lines, {1} queued, delay {2:.3f}s'.format(
+                    len(lines), self.depth(), self.last_delay))
+            if self.last_delay > self.config['irc']['send_delay_warning']:
+                logging.warning(
+                    'IRC: messages waited {0:.1f}s to be sent, {1} still '
+                    'queued'.format(self.last_delay, self.depth()))
+
+    def _take_lines(self, now):
+        """
+        Take all the lines that can be sent now from the lanes.
+
+        Args:
+            now: Current time of the event loop.
+
+        Returns:
+            A tuple (lines, wait_time). lines is a list of (line, queue time)
+            tuples. If it is empty, wait_time is the time to wait before the
+            next line can be sent.
+        """
+        if self.last_refill is not None:
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+        lines = []
+        pong_lane = self.lanes[self.LANE_PONG]
+        while pong_lane:
+            line, _, queued = pong_lane.popleft()
+            lines.append((line, queued))
+        cost = 0
+        for lane in self.lanes[self.LANE_MODERATION:]:
+            while lane:
+                line, channel, queued = lane[0]
+                if channel in self.moderator_channels:
+                    cost = 1
+                else:
+                    cost = self.normal_cost
+                if cost > self.tokens:
+                    break
+                self.tokens -= cost
+                lane.popleft()
+                lines.append((line, queued))
+            if lane:
+                break
+        throttled = self.depth() > 0
+        if throttled and not self.throttled:
+            logging.info('IRC: send rate limit reached, {0} lines queued'
+                         .format(self.depth()))
+        self.throttled = throttled
+        wait_time = max(cost - self.tokens, 0) / self.refill_rate
+        return lines, wait_time
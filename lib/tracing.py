@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+"""
+Sampled latency traces of the chat messages, from the socket to the chat
+widgets.
+
+Every received line has a receive time, see LineBuffer. One chat message out
+of debug.trace_sample_rate is traced: the stages that handle it record a
+span with the time they took, and the spans are written to debug.trace_file
+in the trace event format of Chrome, which chrome://tracing and
+https://ui.perfetto.dev open. Times come from time.perf_counter.
+
+The spans of a message are:
+    recv: from the receive of the line to the beginning of its parsing;
+    parse: parsing of the line;
+    queue: from the end of the parsing to the GUI taking the event, i.e.
+        batching and waiting for the main loop;
+    dispatch: notification of the widgets of the whole batch;
+    render: insertion of the message in a chat widget;
+    emote resolve: from an emote being asked to the worker thread to its
+        image being inserted.
+Each message also gets a 'message' span on its own track, from the receive of
+its line to the end of its render.
+
+Stages only record spans for the events given to Tracer.sample, and check
+tracer.enabled first, so tracing costs nothing when it's disabled.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+# Number of spans kept in memory before they are written to the file
+FLUSH_SIZE = 256
+
+
+class Trace:
+    __slots__ = ('event', 'trace_id', 'begin', 'end', 'channel')
+
+    def __init__(self, event, trace_id, begin):
+        """
+        The spans recorded so far for a traced event.
+        """
+        self.event = event
+        self.trace_id = trace_id
+        self.begin = begin
+        self.end = begin
+        self.channel = event.channel
+
+
+class Tracer:
+    def __init__(self):
+        """
+        This class samples events and writes the spans of the sampled events
+        to a trace file. It is disabled until open is called.
+
+        Traces are looked up by the identity of their event. The event is
+        kept with its trace, so its id can't be reused while the trace is
+        alive. Events that are dropped before reaching the chat (shed by a
+        late GUI, removed by a new batch...) are finished when more than
+        max_traces events are traced.
+        """
+        self.enabled = False
+        self.sample_rate = 0
+        self.countdown = 0
+        self.max_traces = 1000
+        self.next_id = 0
+        self.traces = OrderedDict()  # id(event) -> Trace
+        self.pending = {}  # id(object) -> (object, name, Trace, begin)
+        self.spans = []
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.file = None
+        self.written = False
+        self.pid = os.getpid()
+
+    def open(self, path, sample_rate):
+        """
+        Start tracing one event out of sample_rate, writing the spans to a
+        file.
+        """
+        self.file = open(path, 'w')
+        self.file.write('[')
+        self.sample_rate = sample_rate
+        self.countdown = sample_rate
+        self.enabled = True
+        atexit.register(self.close)
+
+    def close(self):
+        """
+        Stop tracing and complete the file.
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        with self.lock:
+            for trace in list(self.traces.values()):
+                self._finish(trace)
+            self.traces.clear()
+            self._flush()
+            self.file.write('\n]\n')
+            self.file.close()
+
+    def sample(self, event, received):
+        """
+        Decide whether to trace an event. Called once per event, in the
+        thread that parses them.
+
+        Args:
+            event: An event from lib.events.
+            received: Time the event's line was received.
+
+        Returns:
+            The Trace of the event, or None if it isn't traced.
+        """
+        self.countdown -= 1
+        if self.countdown > 0:
+            return None
+        self.countdown = self.sample_rate
+        with self.lock:
+            self.next_id += 1
+            trace = Trace(event, self.next_id, received)
+            self.traces[id(event)] = trace
+            if len(self.traces) > self.max_traces:
+                self._finish(self.traces.popitem(last=False)[1])
+        return trace
+
+    def get(self, event):
+        """
+        Get the trace of an event.
+
+        Returns:
+            A Trace, or None if the event isn't traced.
+        """
+        trace = self.traces.get(id(event))
+        if trace is None or trace.event is not event:
+            return None
+        return trace
+
+    def span(self, name, begin, end, trace, args=None):
+        """
+        Record a span of a trace in the current thread.
+
+        Args:
+            name: Name of the stage, e.g. 'parse'.
+            begin: Beginning of the span, from time.perf_counter.
+            end: End of the span.
+            trace: The Trace, see sample and get.
+            args: A dictionnary of extra data shown with the span.
+        """
+        data = {'trace': trace.trace_id}
+        if args is not None:
+            data.update(args)
+        with self.lock:
+            self._add('X', name, begin, data, dur=_us(end - begin))
+            if end > trace.end:
+                trace.end = end
+
+    def begin(self, name, obj, trace, begin):
+        """
+        Begin a span that is ended by end, possibly in another thread, e.g.
+        when a request is sent to a worker. obj identifies the span, e.g. the
+        request's mark.
+        """
+        with self.lock:
+            self.pending[id(obj)] = (obj, name, trace, begin)
+            if len(self.pending) > self.max_traces:
+                # Forget the oldest span, its end was probably lost
+                del self.pending[next(iter(self.pending))]
+
+    def end(self, obj, end):
+        """
+        End a span started with begin. Nothing is done if no span was started
+        for obj.
+        """
+        if id(obj) not in self.pending:
+            return
+        with self.lock:
+            span = self.pending.get(id(obj))
+            if span is None or span[0] is not obj:
+                return
+            del self.pending[id(obj)]
+            _, name, trace, begin = span
+            self._add('X', name, begin, {'trace': trace.trace_id},
+                      dur=_us(end - begin))
+
+    def finish(self, event):
+        """
+        Record the span of a traced event that went through the whole
+        pipeline.
+        """
+        with self.lock:
+            trace = self.traces.get(id(event))
+            if trace is not None and trace.event is event:
+                del self.traces[id(event)]
+                self._finish(trace)
+
+    def _finish(self, trace):
+        """
+        Add the span covering all of a trace's spans. Must be called with the
+        lock held.
+        """
+        args = {'trace': trace.trace_id, 'channel': trace.channel}
+        self._add('b', 'message', trace.begin, args, id=trace.trace_id,
+                  cat='message')
+        self._add('e', 'message', trace.end, {}, id=trace.trace_id,
+                  cat='message')
+
+    def _add(self, phase, name, time, args, **fields):
+        """
+        Add a trace event in the current thread, and write the events to the
+        file if enough of them are waiting. Must be called with the lock
+        held.
+        """
+        thread = threading.current_thread()
+        if thread.ident not in self.threads:
+            self.threads.add(thread.ident)
+            self.spans.append({
+                'ph': 'M', 'name': 'thread_name', 'pid': self.pid,
+                'tid': thread.ident, 'args': {'name': thread.name}})
+        span = {'ph': phase, 'name': name, 'cat': 'chat', 'pid': self.pid,
+                'tid': thread.ident, 'ts': _us(time), 'args': args}
+        span.update(fields)
+        self.spans.append(span)
+        if len(self.spans) >= FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        """
+        Write the waiting trace events to the file.
+        """
+        if not self.spans:
+            return
+        if self.written:
+            self.file.write(',\n')
+        else:
+            self.file.write('\n')
+            self.written = True
+        self.file.write(',\n'.join(json.dumps(span) for span in self.spans))
+        self.file.flush()
+        self.spans = []
+
+
+def _us(seconds):
+    return round(seconds * 1000000, 1)
+
+
+# Tracer shared by the whole process
+tracer = Tracer()
+
+
+def configure(config):
+    """
+    Start tracing if debug.trace_file is set.
+
+    Args:
+        config: config object. See config.py and config.yaml.
+    """
+    if config['debug']['trace_file']:
+        try:
+            tracer.open(config['debug']['trace_file'],
+                        config['debug']['trace_sample_rate'])
+        except OSError as e:
+            logging.warning('Tracing: failed to open {0}: {1}'
+                            .format(config['debug']['trace_file'], e))
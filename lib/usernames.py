@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+from lib import metrics
+
+
+class InternTable:
+    def __init__(self, max_size):
+        """
+        A bounded table of interned strings. Interning a string returns the
+        string object already in the table if there is one, so that equal
+        strings share one object and dictionary lookups on them compare
+        identities before comparing characters.
+
+        The table keeps two generations of strings. New strings go to the
+        young generation. When it is full, the old generation is dropped and
+        the young one takes its place. Strings found in the old generation
+        are moved back to the young one, so recently used strings are kept.
+        The table never keeps more than max_size strings.
+
+        Args:
+            max_size: Maximum number of strings in the table.
+        """
+        self.young = {}
+        self.old = {}
+        self.generation_size = max(max_size // 2, 1)
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, string):
+        """
+        Get the interned version of a string.
+
+        Args:
+            string: String to intern.
+
+        Returns:
+            A string equal to the argument, shared with the previous calls.
+        """
+        interned = self.young.get(string)
+        if interned is not None:
+            self.hits += 1
+            return interned
+        interned = self.old.pop(string, None)
+        if interned is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            interned = string
+        if len(self.young) >= self.generation_size:
+            self.old = self.young
+            self.young = {}
+        self.young[interned] = interned
+        return interned
+
+    def intern_many(self, strings):
+        """
+        Get the interned version of several strings.
+
+        Args:
+            strings: An iterable of strings to intern.
+
+        Returns:
+            A tuple with the interned strings.
+        """
+        result = []
+        young = self.young
+        hits = 0
+        for string in strings:
+            interned = young.get(string)
+            if interned is None:
+                interned = self.intern(string)
+                young = self.young
+            else:
+                hits += 1
+            result.append(interned)
+        self.hits += hits
+        return tuple(result)
+
+    def set_max_size(self, max_size):
+        """
+        Change the maximum number of strings in the table. The table is
+        cleared.
+        """
+        self.young = {}
+        self.old = {}
+        self.generation_size = max(max_size // 2, 1)
+
+    def __len__(self):
+        return len(self.young) + len(self.old)
+
+
+# Table shared by the whole process
+table = InternTable(100000)
+metrics.counter('username_cache_hits_total',
+                'Usernames found in the table').add_source(lambda: table.hits)
+metrics.counter('username_cache_misses_total',
+                'Usernames added to the table').add_source(
+                    lambda: table.misses)
+
+
+def intern_username(username):
+    """
+    Get the interned version of a username from the process-wide table.
+    """
+    return table.intern(username)
+
+
+def configure(config):
+    """
+    Set the size of the process-wide table from the config.
+
+    Args:
+        config: config object. See config.py and config.yaml.
+    """
+    table.set_max_size(config['irc']['username_cache_size'])
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- encoding:utf-8 -*-
+
+import bisect
+from collections import OrderedDict
+from lib import events
+
+# Above this number of users joining, leaving or changing status in a
+# batch (plus a fraction of the users), the sorted list is rebuilt instead
+# of being updated one user at a time, e.g. after the NAMES of a channel.
+SORT_UPDATES_MIN = 64
+SORT_UPDATES_RATIO = 64
+
+
+class UserRegistry:
+    def __init__(self, channel, max_specialusers):
+        """
+        This class keeps the list of users in a channel, with their moderator
+        and special statuses, from the JOIN, PART, MOD, DEMOD and SPECIALUSER
+        events. The users are removed on CONNECTED events, as the server
+        sends the list of users again after a reconnection.
+
+        Events are applied in batches: the users joining and leaving during a
+        batch are collected in sets, and the list of users is updated with
+        two set operations at the end of the batch. The moderators and
+        special statuses are updated event by event, so that a user leaving
+        and joining again in a batch loses them. The sorted list of users
+        is built when first asked for, then kept sorted with binary searches
+        as users join and leave. It is only rebuilt after large batches,
+        e.g. the list of users sent when joining the channel. Filtered lists
+        are computed when asked for, and kept until the users change.
+
+        Special statuses are kept for the users in the channel. The statuses
+        of the users who aren't in the channel yet are kept separately, for
+        at most max_specialusers users.
+
+        Args:
+            channel: Channel of the users, including the '#'.
+            max_specialusers: Maximum number of users outside the channel
+                              whose statuses are kept.
+        """
+        self.channel = channel
+        self.max_specialusers = max_specialusers
+        self.users = set()
+        self.moderators = set()
+        self.specialusers = {}  # Username -> set of statuses
+        self.pending_specialusers = OrderedDict()  # Same, outside channel
+        self.version = 0
+        self.sorted_users = None  # Moderators first, then the other users
+        self.sorted_moderators = 0  # Number of moderators in sorted_users
+        self.filtered_users = None  # (version, filter text, list)
+
+    def __len__(self):
+        return len(self.users)
+
+    def apply(self, batch):
+        """
+        Apply a list of events to the registry. Events that don't change the
+        users are ignored.
+
+        Args:
+            batch: A list of events from lib.events.
+
+        Returns:
+            True if the users or their statuses changed.
+        """
+        joined = set()
+        parted = set()
+        changed = False
+        # Username -> place in sorted_users before the batch, see _place
+        touched = {} if self.sorted_users is not None else None
+        for event in batch:
+            event_type = event.type
+            if event_type == events.JOIN:
+                if touched is not None:
+                    touched = self._touch(touched, event.usernames)
+                joined.update(event.usernames)
+                parted.difference_update(event.usernames)
+                if self.pending_specialusers:
+                    self._join_statuses(event.usernames)
+            elif event_type == events.PART:
+                if touched is not None:
+                    touched = self._touch(touched, event.usernames)
+                parted.update(event.usernames)
+                joined.difference_update(event.usernames)
+                if not self.moderators.isdisjoint(event.usernames):
+                    self.moderators.difference_update(event.usernames)
+                    changed = True
+                if self.specialusers:
+                    for username in event.usernames:
+                        if self.specialusers.pop(username, None) is not None:
+                            changed = True
+            elif event_type == events.MOD:
+                if touched is not None:
+                    touched = self._touch(touched, (event.username,))
+                self.moderators.add(event.username)
+                joined.add(event.username)
+                parted.discard(event.username)
+                if self.pending_specialusers:
+                    self._join_statuses((event.username,))
+                changed = True
+            elif event_type == events.DEMOD:
+                if touched is not None:
+                    touched = self._touch(touched, (event.username,))
+                self.moderators.discard(event.username)
+                changed = True
+            elif event_type == events.CONNECTED:
+                self.clear()
+                touched = {}
+                joined.clear()
+                parted.clear()
+                changed = True
+            elif event_type == events.SPECIALUSER:
+                username = event.username
+                self._add_status(username, event.usertype,
+                                 username in joined or (
+                                     username in self.users and
+                                     username not in parted))
+        if joined and not joined <= self.users:
+            joined -= self.users
+            self.users |= joined
+            changed = True
+        if parted and not parted.isdisjoint(self.users):
+            self.users -= parted
+            changed = True
+        if changed:
+            if touched is not None and self.sorted_users is not None:
+                for username, old_place in touched.items():
+                    place = self._place(username)
+                    if place != old_place:
+                        if old_place is not None:
+                            self._remove_sorted(username, old_place)
+                        if place is not None:
+                            self._insert_sorted(username, place)
+            self.version += 1
+        return changed
+
+    def clear(self):
+        """
+        Remove all users, e.g. after a reconnection.
+        """
+        self.users = set()
+        self.moderators = set()
+        self.specialusers = {}
+        self.pending_specialusers.clear()
+        self.sorted_users = []
+        self.sorted_moderators = 0
+        self.version += 1
+
+    def get_statuses(self, username):
+        """
+        Get the statuses of a user, e.g. 'mod' or 'subscriber'.
+
+        Returns:
+            A set of strings.
+        """
+        statuses = self.specialusers.get(username)
+        if statuses is None:
+            statuses = self.pending_specialusers.get(username, ())
+        statuses = set(statuses)
+        if username in self.moderators:
+            statuses.add('mod')
+        return statuses
+
+    def get_users(self, filter_text=''):
+        """
+        Get the users sorted by name, moderators first.
+
+        Args:
+            filter_text: Only return the users whose name contains this
+                         text, ignoring case.
+
+        Returns:
+            A list of usernames. The list must not be modified, the list
+            without filter is updated in place when the users change.
+        """
+        if self.sorted_users is None:
+            moderators = self.moderators & self.users
+            self.sorted_users = sorted(moderators) + \
+                sorted(self.users - moderators)
+            self.sorted_moderators = len(moderators)
+        users = self.sorted_users
+        filter_text = filter_text.lower()
+        if not filter_text:
+            return users
+        if self.filtered_users is not None and \
+                self.filtered_users[0] == self.version:
+            if self.filtered_users[1] == filter_text:
+                return self.filtered_users[2]
+            elif self.filtered_users[1] in filter_text:
+                # The text was typed further, filter the previous result
+                users = self.filtered_users[2]
+        self.filtered_users = (self.version, filter_text, [
+            username for username in users if filter_text in username])
+        return self.filtered_users[2]
+
+    def _add_status(self, username, usertype, in_channel):
+        """
+        Add a special status to a user. The statuses of the users outside
+        the channel are kept until they join, or until max_specialusers
+        other users get a status.
+
+        Args:
+            username: User getting the status.
+            usertype: The status, e.g. 'subscriber'.
+            in_channel: True if the user is in the channel at this point of
+                        the batch.
+        """
+        statuses = self.specialusers.get(username)
+        if statuses is not None:
+            statuses.add(usertype)
+        elif in_channel:
+            self.specialusers[username] = {usertype}
+        else:
+            statuses = self.pending_specialusers.get(username)
+            if statuses is not None:
+                statuses.add(usertype)
+                self.pending_specialusers.move_to_end(username)
+            else:
+                self.pending_specialusers[username] = {usertype}
+                if len(self.pending_specialusers) > self.max_specialusers:
+                    self.pending_specialusers.popitem(last=False)
+
+    def _join_statuses(self, usernames):
+        """
+        Move the statuses kept for users outside the channel to the users
+        joining it.
+        """
+        for username in usernames:
+            statuses = self.pending_specialusers.pop(username, None)
+            if statuses is not None:
+                self.specialusers[username] = statuses
+
+    def _place(self, username):
+        """
+        Get the place of a user in sorted_users.
+
+        Returns:
+            None if the user isn't in the channel, True if the user is in
+            the moderators section, False otherwise.
+        """
+        if username not in self.users:
+            return None
+        return username in self.moderators
+
+    def _touch(self, touched, usernames):
+        """
+        Remember the place in sorted_users of users about to change, so
+        that they can be moved at the end of the batch. If too many users
+        change, sorted_users is dropped to be rebuilt.
+
+        Returns:
+            The updated touched dictionnary, or None if sorted_users was
+            dropped.
+        """
+        for username in usernames:
+            if username not in touched:
+                touched[username] = self._place(username)
+        if len(touched) > SORT_UPDATES_MIN + \
+                len(self.sorted_users) // SORT_UPDATES_RATIO:
+            self.sorted_users = None
+            return None
+        return touched
+
+    def _insert_sorted(self, username, moderator):
+        """
+        Insert a user in sorted_users.
+        """
+        if moderator:
+            bisect.insort(self.sorted_users, username,
+                          0, self.sorted_moderators)
+            self.sorted_moderators += 1
+        else:
+            bisect.insort(self.sorted_users, username,
+                          self.sorted_moderators)
+
+    def _remove_sorted(self, username, moderator):
+        """
+        Remove a user from sorted_users.
+        """
+        if moderator:
+            lo, hi = 0, self.sorted_moderators
+            self.sorted_moderators -= 1
+        else:
+            lo, hi = self.sorted_moderators, len(self.sorted_users)
+        del self.sorted_users[
+            bisect.bisect_left(self.sorted_users, username, lo, hi)]
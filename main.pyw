@@ -3,7 +3,7 @@
 
 # TODO:
 #   - Create a proper readme
-#   - Add notebook with other widgets (userlist, poll, etc.)
+#   - Add notebook with other widgets (poll, etc.)
 #   - Add force update button to subscriberwidget
 #   - Make sure character encoding is working properly
 #
@@ -21,8 +21,10 @@ import sys
 import threading
 from gi.repository import Gtk
 
+from gui.glibsink import GLibSink
 from gui.mainwindow import MainApplication
-from lib import config
+from lib import config, metrics, tracing, usernames
+from lib.ircclient import run_clients
 from lib.irceventgenerator import IrcEventGenerator
 from lib.ircsender import IrcSender
 
@@ -35,15 +37,15 @@ def gui_main(config, out_queue, retval):
     return
 
 
-def irc_main(config, func_queue):
-    irc_event_generator = IrcEventGenerator(config, func_queue)
-    irc_event_generator.run()
-    return
-
-
-def irc_sender_main(config, out_queue):
-    irc_sender = IrcSender(config, out_queue)
-    irc_sender.run()
+def irc_main(config, func_queue, out_queue):
+    sink = GLibSink(config, func_queue)
+    if config['irc']['shared_connection']:
+        irc_event_generator = IrcEventGenerator(config, sink, out_queue)
+        run_clients([irc_event_generator])
+    else:
+        irc_event_generator = IrcEventGenerator(config, sink)
+        irc_sender = IrcSender(config, out_queue)
+        run_clients([irc_event_generator, irc_sender])
     return
 
 if __name__ == '__main__':
@@ -61,17 +63,17 @@ if __name__ == '__main__':
     logging.basicConfig(
         filename=c['debug']['log-file'], filemode='w',
         level=log_levels[c['debug']['log-level']])
+    # Share usernames across the application
+    usernames.configure(c)
+    metrics.start_exporter(c)
+    tracing.configure(c)
     # Create threads
-    out_queue = queue.Queue()
+    out_queue = queue.Queue(maxsize=c['irc']['send_queue_size'])
     func_queue = queue.Queue()
     irc_thread = threading.Thread(
         target=irc_main, daemon=True,
-        args=(c, func_queue))
+        args=(c, func_queue, out_queue))
     irc_thread.start()
-    irc_sender_thread = threading.Thread(
-        target=irc_sender_main, daemon=True,
-        args=(c, out_queue))
-    irc_sender_thread.start()
     # Create GUI
     app = MainApplication(c, out_queue, func_queue)
     exit_status = app.run(sys.argv)